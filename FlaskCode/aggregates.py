@@ -0,0 +1,746 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import cx_Oracle
+
+from db import get_connection
+
+# When enabled, query1-query5 read from the summary tables below instead of rebuilding the
+# per-state rollups from the raw tables on every request. Run `python aggregates.py create`
+# and `python aggregates.py refresh` once before turning this on, and `python aggregates.py update`
+# after every data load.
+USE_AGGREGATES = os.getenv('USE_AGGREGATES', 'false').lower() == 'true'
+
+# ORA-00955: name is already used by an existing object
+ORA_NAME_ALREADY_USED = 955
+
+# The summary tables live in the application user's own schema. The state tables are index
+# organized on (state_code, date) so that a request for one state and a date range is a single
+# index range scan whose cost depends on the number of rows returned.
+CREATE_TABLES = [
+    """
+    CREATE TABLE STATE_WEEKLY_SUMMARY (
+        state_code VARCHAR2(10),
+        start_of_week DATE,
+        currently_infected_count NUMBER,
+        infection_rate NUMBER,
+        avg_mobility_retail_and_recreation NUMBER,
+        avg_mobility_grocery_and_pharmacy NUMBER,
+        avg_mobility_parks NUMBER,
+        avg_mobility_transit_stations NUMBER,
+        avg_mobility_workplaces NUMBER,
+        avg_mobility_residential NUMBER,
+        CONSTRAINT state_weekly_summary_pk PRIMARY KEY (state_code, start_of_week)
+    ) ORGANIZATION INDEX
+    """,
+    """
+    CREATE TABLE STATE_MONTHLY_VACCINATION (
+        state_code VARCHAR2(10),
+        start_of_month DATE,
+        avg_monthly_sni_covid19_vaccination NUMBER,
+        avg_monthly_sni_vaccination_intent NUMBER,
+        avg_monthly_sni_safety_side_effects NUMBER,
+        new_persons_vaccinated NUMBER,
+        vaccination_rate NUMBER,
+        CONSTRAINT state_monthly_vaccination_pk PRIMARY KEY (state_code, start_of_month)
+    ) ORGANIZATION INDEX
+    """,
+    """
+    CREATE TABLE STATE_MONTHLY_HOSPITALIZATION (
+        state_code VARCHAR2(10),
+        start_of_month DATE,
+        new_hospitalized_patients NUMBER,
+        new_deceased NUMBER,
+        CONSTRAINT state_monthly_hosp_pk PRIMARY KEY (state_code, start_of_month)
+    ) ORGANIZATION INDEX
+    """,
+    """
+    CREATE TABLE STATE_MONTHLY_STRINGENCY (
+        state_code VARCHAR2(10),
+        start_of_month DATE,
+        monthly_avg_stringency_index NUMBER,
+        CONSTRAINT state_monthly_stringency_pk PRIMARY KEY (state_code, start_of_month)
+    ) ORGANIZATION INDEX
+    """,
+    """
+    CREATE TABLE STATE_MONTHLY_MORTALITY (
+        state_code VARCHAR2(10),
+        start_of_month DATE,
+        new_deceased NUMBER,
+        mortality_rate_100000 NUMBER,
+        CONSTRAINT state_monthly_mortality_pk PRIMARY KEY (state_code, start_of_month)
+    ) ORGANIZATION INDEX
+    """,
+    # Per sector and trading day: companies with a price, in profit (return >= 0), advancing and
+    # declining, and their median return in percent. query3 statistics are averages of these over a month.
+    """
+    CREATE TABLE SECTOR_DAILY_PROFIT (
+        sector VARCHAR2(100),
+        date_key DATE,
+        no_of_companies NUMBER,
+        no_in_profit NUMBER,
+        no_of_advancers NUMBER,
+        no_of_decliners NUMBER,
+        median_return_percent NUMBER,
+        CONSTRAINT sector_daily_profit_pk PRIMARY KEY (sector, date_key)
+    ) ORGANIZATION INDEX
+    """,
+    # Number of companies per sector, trading day and return bucket, where return_bucket is the
+    # return in percent rounded down to a multiple of PROFIT_THRESHOLD_STEP (0.1). The companies
+    # in profit at any threshold on that grid are the sum of the buckets at or above it.
+    """
+    CREATE TABLE SECTOR_DAILY_RETURNS (
+        sector VARCHAR2(100),
+        date_key DATE,
+        return_bucket NUMBER,
+        no_of_companies NUMBER,
+        CONSTRAINT sector_daily_returns_pk PRIMARY KEY (sector, date_key, return_bucket)
+    ) ORGANIZATION INDEX
+    """,
+    # Monthly rollup of SECTOR_DAILY_PROFIT, one column per query3 statistic
+    """
+    CREATE TABLE SECTOR_MONTHLY_STATS (
+        sector VARCHAR2(100),
+        start_of_month DATE,
+        percent_of_companies_in_profit NUMBER,
+        median_return_percent NUMBER,
+        breadth_percent NUMBER,
+        CONSTRAINT sector_monthly_stats_pk PRIMARY KEY (sector, start_of_month)
+    ) ORGANIZATION INDEX
+    """,
+    # Testing data is kept per day (not per month) because query3 applies its date filter before
+    # averaging, so partial months at the edges of a range must average only the days inside it.
+    """
+    CREATE TABLE US_DAILY_TESTING (
+        date_key DATE,
+        sum_tested_per_100000 NUMBER,
+        no_of_states NUMBER,
+        CONSTRAINT us_daily_testing_pk PRIMARY KEY (date_key)
+    ) ORGANIZATION INDEX
+    """,
+    # Latest date_key of the raw tables that each summary table has been refreshed up to
+    """
+    CREATE TABLE AGGREGATE_WATERMARKS (
+        table_name VARCHAR2(30),
+        max_date_key DATE,
+        refreshed_at DATE,
+        CONSTRAINT aggregate_watermarks_pk PRIMARY KEY (table_name)
+    )
+    """,
+]
+
+# For every summary table: its date column, the TRUNC unit of that column, how many days before
+# the first recomputed period its rollup still reads, and the raw tables it is built from.
+# query1's CurrentlyInfectedCount is a 14 day window, so a recomputed week needs the 13 days
+# before its Monday. The monthly and daily rollups only read the periods they write.
+# SECTOR_MONTHLY_STATS is built from SECTOR_DAILY_PROFIT, so it has to come after it.
+SUMMARY_TABLES = {
+    "STATE_WEEKLY_SUMMARY": ("start_of_week", "IW", 13, ['rgugale.US_Epidemiology', '"AMMAR.AMJAD".US_Mobility']),
+    "STATE_MONTHLY_VACCINATION": ("start_of_month", "MM", 0, ['"AMMAR.AMJAD".vaccination_search', '"AMMAR.AMJAD".us_vaccinations']),
+    "STATE_MONTHLY_HOSPITALIZATION": ("start_of_month", "MM", 0, ['"AMMAR.AMJAD".hospitalizations', 'rgugale.US_Epidemiology']),
+    "STATE_MONTHLY_STRINGENCY": ("start_of_month", "MM", 0, ['"AMMAR.AMJAD".government_responses']),
+    "STATE_MONTHLY_MORTALITY": ("start_of_month", "MM", 0, ['rgugale.US_Epidemiology']),
+    "SECTOR_DAILY_PROFIT": ("date_key", "DD", 0, ['"AMMAR.AMJAD".snp500']),
+    "SECTOR_DAILY_RETURNS": ("date_key", "DD", 0, ['"AMMAR.AMJAD".snp500']),
+    "SECTOR_MONTHLY_STATS": ("start_of_month", "MM", 0, ['SECTOR_DAILY_PROFIT']),
+    "US_DAILY_TESTING": ("date_key", "DD", 0, ['rgugale.US_Epidemiology']),
+}
+
+# Used as :write_from for a full refresh, before any date in the dataset
+BEGINNING_OF_DATA = datetime(1900, 1, 1)
+
+# Each refresh statement rebuilds one summary table from the raw tables. They are the same
+# rollups that query1-query5 compute, minus the final state/date filter. Only raw rows dated
+# :read_from or later are read, so an incremental refresh rescans just the trailing periods.
+REFRESH_STATEMENTS = {
+    "STATE_WEEKLY_SUMMARY": """
+    INSERT INTO STATE_WEEKLY_SUMMARY
+    WITH
+    DailyNewConfirmedPerState AS (
+        SELECT
+            date_key,
+            SUBSTR(location_key, 1, 5) AS state_code,
+            NVL(SUM(new_confirmed), 0) AS new_confirmed
+        FROM
+            rgugale.US_Epidemiology
+        WHERE
+            location_key LIKE 'US____%'
+            AND date_key >= :read_from
+        GROUP BY
+            date_key, SUBSTR(location_key, 1, 5)
+    ),
+    DailyCurrentlyInfectedCountPerState AS (
+        SELECT
+            date_key,
+            state_code,
+            SUM(new_confirmed) OVER (PARTITION BY state_code ORDER BY date_key ROWS BETWEEN 13 PRECEDING AND CURRENT ROW) AS CurrentlyInfectedCount
+        FROM
+            DailyNewConfirmedPerState
+    ),
+    InfectionRatePerStatePerWeek AS (
+        SELECT
+            cic.state_code,
+            cic.date_key AS start_of_week,
+            cic.CurrentlyInfectedCount,
+            ROUND((cic.CurrentlyInfectedCount/population)*100, 8) AS InfectionRatePerWeek
+        FROM
+            DailyCurrentlyInfectedCountPerState cic
+        JOIN
+            rgugale.demographics demo ON cic.state_code = demo.location_key
+        WHERE
+            cic.date_key = TRUNC(cic.date_key, 'IW')
+    ),
+    WeeklyMobilityInfoPerState AS (
+        SELECT
+            TRUNC(date_key, 'IW') AS start_of_week,
+            SUBSTR(location_key, 1, 5) AS state_code,
+            ROUND(AVG(mobility_retail_and_recreation), 4) AS AvgMobilityRetailAndRecreation,
+            ROUND(AVG(mobility_grocery_and_pharmacy), 4) AS AvgMobilityGroceryAndPharmacy,
+            ROUND(AVG(mobility_parks), 4) AS AvgMobilityParks,
+            ROUND(AVG(mobility_transit_stations), 4) AS AvgMobilityTransitStations,
+            ROUND(AVG(mobility_workplaces), 4) AS AvgMobilityWorkplaces,
+            ROUND(AVG(mobility_residential), 4) AS AvgMobilityResidential
+        FROM
+            "AMMAR.AMJAD".US_Mobility
+        WHERE
+            location_key LIKE 'US____%'
+            AND date_key >= :read_from
+        GROUP BY
+            TRUNC(date_key, 'IW'),
+            SUBSTR(location_key, 1, 5)
+    )
+    SELECT
+        irpspw.state_code,
+        irpspw.start_of_week,
+        irpspw.CurrentlyInfectedCount,
+        irpspw.InfectionRatePerWeek,
+        AvgMobilityRetailAndRecreation,
+        AvgMobilityGroceryAndPharmacy,
+        AvgMobilityParks,
+        AvgMobilityTransitStations,
+        AvgMobilityWorkplaces,
+        AvgMobilityResidential
+    FROM
+        InfectionRatePerStatePerWeek irpspw
+    JOIN
+        WeeklyMobilityInfoPerState mobi
+        ON irpspw.state_code = mobi.state_code
+            AND irpspw.start_of_week = mobi.start_of_week
+    WHERE
+        irpspw.start_of_week >= :write_from
+    """,
+    "STATE_MONTHLY_VACCINATION": """
+    INSERT INTO STATE_MONTHLY_VACCINATION
+    SELECT
+        MonthlyGoogleSearchesPerState.state_code,
+        MonthlyGoogleSearchesPerState.start_of_month,
+        avg_monthly_sni_covid19_vaccination,
+        avg_monthly_sni_vaccination_intent,
+        avg_monthly_sni_safety_side_effects,
+        new_persons_vaccinated,
+        vaccination_rate
+    FROM
+        (
+            SELECT
+                TRUNC(date_key, 'MM') AS start_of_month,
+                SUBSTR(location_key, 1, 5) AS state_code,
+                ROUND(AVG(sni_covid19_vaccination), 4) as avg_monthly_sni_covid19_vaccination,
+                ROUND(AVG(sni_vaccination_intent), 4) as avg_monthly_sni_vaccination_intent,
+                ROUND(AVG(sni_safety_side_effects), 4) as avg_monthly_sni_safety_side_effects
+            FROM
+                "AMMAR.AMJAD".vaccination_search
+            WHERE
+                location_key LIKE 'US____%'
+                AND date_key >= :read_from
+            GROUP BY
+                TRUNC(date_key, 'MM'), SUBSTR(location_key, 1, 5)
+        ) MonthlyGoogleSearchesPerState
+    JOIN
+        (
+            SELECT
+                MonthlyVacInfoPerState.start_of_month,
+                MonthlyVacInfoPerState.state_code,
+                MonthlyVacInfoPerState.new_persons_vaccinated,
+                ROUND((MonthlyVacInfoPerState.new_persons_vaccinated/Demographics.population), 8) as vaccination_rate
+            FROM
+                (
+                    SELECT
+                        TRUNC(date_key, 'MM') AS start_of_month,
+                        location_key as state_code,
+                        ROUND(SUM(new_persons_vaccinated), 4) AS new_persons_vaccinated
+                    FROM
+                        "AMMAR.AMJAD".us_vaccinations
+                    WHERE
+                        date_key >= :read_from
+                    GROUP BY
+                        TRUNC(date_key, 'MM'), location_key
+                ) MonthlyVacInfoPerState
+            JOIN
+                RGUGALE.Demographics ON MonthlyVacInfoPerState.state_code = Demographics.location_key
+        ) MonthlyVacRatePerState
+    ON MonthlyGoogleSearchesPerState.start_of_month = MonthlyVacRatePerState.start_of_month
+        AND MonthlyGoogleSearchesPerState.state_code = MonthlyVacRatePerState.state_code
+    """,
+    "STATE_MONTHLY_HOSPITALIZATION": """
+    INSERT INTO STATE_MONTHLY_HOSPITALIZATION
+    WITH
+    DailyHospitalizationInfoPerState AS (
+        (
+            SELECT
+                date_key,
+                location_key as state_code,
+                new_hospitalized_patients
+            FROM
+                "AMMAR.AMJAD".hospitalizations
+            WHERE
+                location_key LIKE 'US___'
+                AND date_key >= :read_from
+        )
+        MINUS
+        -- Get rid of US_NY values as they are incomplete
+        (
+            SELECT
+                date_key,
+                location_key,
+                new_hospitalized_patients
+            FROM
+                "AMMAR.AMJAD".hospitalizations
+            WHERE
+                location_key LIKE 'US_NY'
+                AND date_key >= :read_from
+        )
+        UNION
+        -- Sum up county data for NY
+        (
+            SELECT
+                date_key,
+                SUBSTR(location_key, 1, 5) AS state_code,
+                SUM(new_hospitalized_patients) AS new_hospitalized_patients
+            FROM
+                "AMMAR.AMJAD".hospitalizations
+            WHERE
+                location_key LIKE 'US_NY_%'
+                AND date_key >= :read_from
+            GROUP BY
+                date_key,
+                SUBSTR(location_key, 1, 5)
+        )
+    ),
+    MonthlyHospitalizationInfoPerState AS (
+        SELECT
+            TRUNC(date_key, 'MM') as start_of_month,
+            state_code,
+            SUM(new_hospitalized_patients) as new_hospitalized_patients
+        FROM DailyHospitalizationInfoPerState
+        GROUP BY
+            TRUNC(date_key, 'MM'), state_code
+    ),
+    MonthlyDeceasedPerState AS (
+        SELECT
+            TRUNC(date_key, 'MM') as start_of_month,
+            SUBSTR(location_key, 1, 5) AS state_code,
+            SUM(new_deceased) AS new_deceased
+        FROM
+            RGUGALE.us_epidemiology
+        WHERE
+            location_key LIKE 'US____%'
+            AND date_key >= :read_from
+        GROUP BY
+            TRUNC(date_key, 'MM'), SUBSTR(location_key, 1, 5)
+    )
+    SELECT
+        monthlyHosp.state_code,
+        monthlyHosp.start_of_month,
+        monthlyHosp.new_hospitalized_patients,
+        MonthlyDeceasedPerState.new_deceased
+    FROM
+        MonthlyHospitalizationInfoPerState monthlyHosp
+    JOIN
+        MonthlyDeceasedPerState
+    ON
+        monthlyHosp.start_of_month = MonthlyDeceasedPerState.start_of_month
+        AND monthlyHosp.state_code = MonthlyDeceasedPerState.state_code
+    """,
+    "STATE_MONTHLY_STRINGENCY": """
+    INSERT INTO STATE_MONTHLY_STRINGENCY
+    SELECT
+        location_key AS state_code,
+        TRUNC(date_key, 'MM') AS start_of_month,
+        ROUND(AVG(stringency_index), 4) AS monthly_avg_stringency_index
+    FROM "AMMAR.AMJAD".government_responses
+    WHERE location_key LIKE 'US___' AND date_key >= :read_from
+    GROUP BY TRUNC(date_key, 'MM'), location_key
+    """,
+    "STATE_MONTHLY_MORTALITY": """
+    INSERT INTO STATE_MONTHLY_MORTALITY
+    SELECT
+        MonthlyDeceasedPerState.state_code,
+        start_of_month,
+        monthly_avg_deceased,
+        GREATEST(ROUND(monthly_avg_deceased * 100000 / population, 8), 0) AS mortality_rate_100000
+    FROM
+        (
+            SELECT
+                TRUNC(date_key, 'MM') AS start_of_month,
+                location_key AS state_code,
+                SUM(new_deceased) AS monthly_avg_deceased
+            FROM rgugale.US_Epidemiology
+            WHERE location_key LIKE 'US___' AND date_key >= :read_from
+            GROUP BY TRUNC(date_key, 'MM'), location_key
+        ) MonthlyDeceasedPerState
+        JOIN rgugale.Demographics ON MonthlyDeceasedPerState.state_code = Demographics.location_key
+    """,
+    "SECTOR_DAILY_PROFIT": """
+    INSERT INTO SECTOR_DAILY_PROFIT
+    SELECT
+        sector,
+        date_key,
+        COUNT(return_percent) AS no_of_companies,
+        COUNT(CASE WHEN return_percent >= 0 THEN 1 END) AS no_in_profit,
+        COUNT(CASE WHEN return_percent > 0 THEN 1 END) AS no_of_advancers,
+        COUNT(CASE WHEN return_percent < 0 THEN 1 END) AS no_of_decliners,
+        MEDIAN(return_percent) AS median_return_percent
+    FROM
+        (
+            SELECT
+                date_key,
+                sector,
+                ROUND(((close - open) / open) * 100, 4) AS return_percent
+            FROM
+                "AMMAR.AMJAD".snp500
+                JOIN rgugale.snp500_company_info ON snp500.ticker = snp500_company_info.ticker
+            WHERE
+                date_key >= :read_from
+        ) DailyReturns
+    GROUP BY
+        sector, date_key
+    """,
+    "SECTOR_DAILY_RETURNS": """
+    INSERT INTO SECTOR_DAILY_RETURNS
+    SELECT
+        sector,
+        date_key,
+        return_bucket,
+        COUNT(*) AS no_of_companies
+    FROM
+        (
+            SELECT
+                date_key,
+                sector,
+                FLOOR(ROUND(((close - open) / open) * 100, 4) * 10) / 10 AS return_bucket
+            FROM
+                "AMMAR.AMJAD".snp500
+                JOIN rgugale.snp500_company_info ON snp500.ticker = snp500_company_info.ticker
+            WHERE
+                date_key >= :read_from
+                AND open IS NOT NULL AND close IS NOT NULL
+        ) DailyReturnBuckets
+    GROUP BY
+        sector, date_key, return_bucket
+    """,
+    "SECTOR_MONTHLY_STATS": """
+    INSERT INTO SECTOR_MONTHLY_STATS
+    WITH NoOfCompaniesPerSector AS (
+        SELECT
+            sector,
+            COUNT(ticker) AS noOfCompaniesInSector
+        FROM
+            RGUGALE.snp500_company_info
+        GROUP BY
+            sector
+    )
+    SELECT
+        dailyInfo.sector,
+        TRUNC(date_key, 'MM') AS start_of_month,
+        ROUND(AVG(CASE WHEN no_in_profit > 0 THEN (no_in_profit/noOfCompaniesInSector)*100 END), 4) AS percent_of_companies_in_profit,
+        ROUND(AVG(median_return_percent), 4) AS median_return_percent,
+        ROUND(AVG((no_of_advancers - no_of_decliners) / NULLIF(no_of_companies, 0) * 100), 4) AS breadth_percent
+    FROM
+        SECTOR_DAILY_PROFIT dailyInfo
+        JOIN NoOfCompaniesPerSector sectorCount ON dailyInfo.sector = sectorCount.sector
+    WHERE
+        date_key >= :read_from
+    GROUP BY
+        TRUNC(date_key, 'MM'), dailyInfo.sector
+    """,
+    "US_DAILY_TESTING": """
+    INSERT INTO US_DAILY_TESTING
+    SELECT
+        date_key,
+        SUM(NVL(100000 * new_tested / population, 0)) AS sum_tested_per_100000,
+        COUNT(*) AS no_of_states
+    FROM
+        rgugale.US_Epidemiology
+        JOIN rgugale.Demographics demo ON demo.location_key = US_Epidemiology.location_key
+    WHERE
+        US_Epidemiology.location_key LIKE 'US___'
+        AND date_key >= :read_from
+    GROUP BY date_key
+    """,
+}
+
+# Queries used by the routes when USE_AGGREGATES is on. They return exactly the same columns,
+# in the same order, as the queries they replace so the dimension lookups in oracle_backend.py and
+# the response shaping code are shared.
+# QUERY1 is formatted with the selected mobility columns, like the live query1, and QUERY1/QUERY2
+# with the same state filter as the live queries.
+QUERY1 = """
+    SELECT
+        s.start_of_week,
+        s.state_code,
+        s.currently_infected_count{mobility_columns}
+    FROM
+        STATE_WEEKLY_SUMMARY s
+    WHERE
+        s.start_of_week BETWEEN :start_date AND :end_date
+        {state_filter}
+    ORDER BY s.state_code, s.start_of_week
+    """
+
+QUERY2 = """
+    SELECT
+        s.start_of_month,
+        s.state_code,
+        s.avg_monthly_sni_covid19_vaccination,
+        s.avg_monthly_sni_vaccination_intent,
+        s.avg_monthly_sni_safety_side_effects,
+        s.new_persons_vaccinated
+    FROM
+        STATE_MONTHLY_VACCINATION s
+    WHERE
+        s.start_of_month BETWEEN TO_DATE(:start_date, 'DD-MON-YY') AND TO_DATE(:end_date, 'DD-MON-YY')
+        {state_filter}
+    ORDER BY s.state_code, s.start_of_month
+    """
+
+# Column of SECTOR_MONTHLY_STATS that holds each query3 statistic
+SECTOR_STATISTIC_COLUMNS = {
+    "percent_in_profit": "percent_of_companies_in_profit",
+    "median_return": "median_return_percent",
+    "breadth": "breadth_percent",
+}
+
+# QUERY3 is formatted with the SECTOR_STATISTIC_COLUMNS column of the requested statistic
+QUERY3 = """
+    WITH PerMonthTestingInfoWholeUS AS (
+        SELECT
+            TRUNC(date_key, 'MM') AS start_of_month,
+            ROUND(SUM(sum_tested_per_100000) / SUM(no_of_states), 5) AS no_of_tested_per_100000
+        FROM
+            US_DAILY_TESTING
+        WHERE
+            date_key BETWEEN :start_date AND :end_date
+        GROUP BY
+            TRUNC(date_key, 'MM')
+    )
+    SELECT
+        stockTab.start_of_month,
+        no_of_tested_per_100000,
+        {statistic_column},
+        sector
+    FROM
+        SECTOR_MONTHLY_STATS stockTab
+        JOIN PerMonthTestingInfoWholeUS testingTab ON stockTab.start_of_month = testingTab.start_of_month
+    WHERE sector IN (SELECT column_value FROM TABLE(:sectors))
+    ORDER BY stockTab.start_of_month, sector
+    """
+
+# percent_in_profit for a profit threshold other than 0. The companies at or above the threshold
+# on each day are summed from the return buckets of the selected sectors and months only.
+QUERY3_PROFIT_THRESHOLD = """
+    WITH NoOfCompaniesPerSector AS (
+        SELECT
+            sector,
+            COUNT(ticker) AS noOfCompaniesInSector
+        FROM
+            RGUGALE.snp500_company_info
+        GROUP BY
+            sector
+    ),
+    DailyNoOfCompaniesInProfitPerSector AS (
+        SELECT
+            dailyInfo.date_key,
+            dailyInfo.sector,
+            NVL(SUM(buckets.no_of_companies), 0) AS noOfCompaniesInProfitInSector
+        FROM
+            SECTOR_DAILY_PROFIT dailyInfo
+            LEFT JOIN SECTOR_DAILY_RETURNS buckets
+                ON buckets.sector = dailyInfo.sector
+                AND buckets.date_key = dailyInfo.date_key
+                AND buckets.return_bucket >= :profit_threshold
+        WHERE
+            dailyInfo.sector IN (SELECT column_value FROM TABLE(:sectors))
+            AND dailyInfo.date_key >= TRUNC(CAST(:start_date AS DATE), 'MM')
+            AND dailyInfo.date_key < ADD_MONTHS(TRUNC(CAST(:end_date AS DATE), 'MM'), 1)
+        GROUP BY
+            dailyInfo.date_key, dailyInfo.sector
+    ),
+    PercentOfCompaniesInProfitPerSectorPerMonth AS (
+        SELECT
+            TRUNC(date_key, 'MM') AS start_of_month,
+            dailyInfo.sector,
+            ROUND(AVG(CASE WHEN noOfCompaniesInProfitInSector > 0 THEN (noOfCompaniesInProfitInSector/noOfCompaniesInSector)*100 END), 4) AS percentOfCompaniesInProfit
+        FROM
+            DailyNoOfCompaniesInProfitPerSector dailyInfo
+            JOIN NoOfCompaniesPerSector sectorCount ON dailyInfo.sector = sectorCount.sector
+        GROUP BY
+            TRUNC(date_key, 'MM'), dailyInfo.sector
+    ),
+    PerMonthTestingInfoWholeUS AS (
+        SELECT
+            TRUNC(date_key, 'MM') AS start_of_month,
+            ROUND(SUM(sum_tested_per_100000) / SUM(no_of_states), 5) AS no_of_tested_per_100000
+        FROM
+            US_DAILY_TESTING
+        WHERE
+            date_key BETWEEN :start_date AND :end_date
+        GROUP BY
+            TRUNC(date_key, 'MM')
+    )
+    SELECT
+        stockTab.start_of_month,
+        no_of_tested_per_100000,
+        percentOfCompaniesInProfit,
+        sector
+    FROM
+        PercentOfCompaniesInProfitPerSectorPerMonth stockTab
+        JOIN PerMonthTestingInfoWholeUS testingTab ON stockTab.start_of_month = testingTab.start_of_month
+    ORDER BY stockTab.start_of_month, sector
+    """
+
+QUERY4 = """
+    SELECT
+        start_of_month,
+        state_code,
+        (new_deceased / NULLIF(new_hospitalized_patients, 0)) AS ratio_of_deaths
+    FROM
+        STATE_MONTHLY_HOSPITALIZATION
+    WHERE
+        start_of_month BETWEEN :start_date AND :end_date
+        AND state_code IN (SELECT column_value FROM TABLE(:state_codes))
+    ORDER BY start_of_month, state_code
+    """
+
+QUERY5 = """
+    SELECT 'stringency' AS measure, start_of_month, state_code, monthly_avg_stringency_index
+    FROM STATE_MONTHLY_STRINGENCY
+    WHERE start_of_month BETWEEN :start_date AND :end_date
+        AND state_code IN (SELECT column_value FROM TABLE(:state_codes))
+    UNION ALL
+    SELECT 'deceased' AS measure, start_of_month, state_code, new_deceased
+    FROM STATE_MONTHLY_MORTALITY
+    WHERE start_of_month BETWEEN :start_date AND :end_date
+        AND state_code IN (SELECT column_value FROM TABLE(:state_codes))
+    """
+
+
+def create_tables():
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        for statement in CREATE_TABLES:
+            try:
+                cursor.execute(statement)
+            except cx_Oracle.DatabaseError as e:
+                error, = e.args
+                if error.code != ORA_NAME_ALREADY_USED:
+                    raise
+        cursor.close()
+
+
+# First day of the week (Monday) or month containing date, or date itself for daily tables
+def start_of_period(date, period):
+    if period == "IW":
+        return date - timedelta(days=date.weekday())
+    if period == "MM":
+        return date.replace(day=1)
+    return date
+
+
+def source_max_date(cursor, sources):
+    # A summary table is only complete up to the raw table that lags behind the most.
+    max_dates = []
+    for source in sources:
+        cursor.execute("SELECT MAX(date_key) FROM {}".format(source))
+        max_dates.append(cursor.fetchone()[0])
+    return None if None in max_dates else min(max_dates)
+
+
+def get_watermark(cursor, table):
+    cursor.execute("SELECT max_date_key FROM AGGREGATE_WATERMARKS WHERE table_name = :table_name", table_name=table)
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def set_watermark(cursor, table, max_date):
+    cursor.execute(
+        """
+        MERGE INTO AGGREGATE_WATERMARKS w
+        USING (SELECT :table_name AS table_name FROM dual) t ON (w.table_name = t.table_name)
+        WHEN MATCHED THEN UPDATE SET max_date_key = :max_date_key, refreshed_at = SYSDATE
+        WHEN NOT MATCHED THEN INSERT (table_name, max_date_key, refreshed_at) VALUES (:table_name, :max_date_key, SYSDATE)
+        """,
+        table_name=table, max_date_key=max_date,
+    )
+
+
+# Recompute the rows of one summary table dated write_from or later.
+def refresh_table(cursor, table, write_from):
+    date_column, _, lookback_days, _ = SUMMARY_TABLES[table]
+    statement = REFRESH_STATEMENTS[table]
+    binds = {"read_from": write_from - timedelta(days=lookback_days), "write_from": write_from}
+    cursor.execute("DELETE FROM {} WHERE {} >= :write_from".format(table, date_column), write_from=write_from)
+    cursor.execute(statement, {name: value for name, value in binds.items() if ":" + name in statement})
+    return cursor.rowcount
+
+
+# Rebuild every summary table. Each table is cleared and reloaded in the same transaction so
+# readers keep seeing the previous contents until the refresh commits.
+def refresh_all():
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        for table, (_, _, _, sources) in SUMMARY_TABLES.items():
+            print("Refreshing {}".format(table))
+            max_date = source_max_date(cursor, sources)
+            print("{} rows".format(refresh_table(cursor, table, BEGINNING_OF_DATA)))
+            set_watermark(cursor, table, max_date)
+        connection.commit()
+        cursor.close()
+
+
+# Bring the summary tables up to date after new daily rows have been loaded. Only the periods from
+# the one containing the first new day onwards are recomputed (for query1 that read includes the 13
+# days of window state before it), instead of rescanning all of history. Tables that have never been
+# refreshed are rebuilt in full. Corrections to days older than the watermark need `refresh`.
+def refresh_incremental():
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        for table, (_, period, _, sources) in SUMMARY_TABLES.items():
+            max_date = source_max_date(cursor, sources)
+            watermark = get_watermark(cursor, table)
+            if watermark is None:
+                write_from = BEGINNING_OF_DATA
+            elif max_date is None or max_date <= watermark:
+                print("{} is up to date ({})".format(table, watermark))
+                continue
+            else:
+                write_from = start_of_period(watermark + timedelta(days=1), period)
+
+            print("Refreshing {} from {}".format(table, write_from))
+            print("{} rows".format(refresh_table(cursor, table, write_from)))
+            set_watermark(cursor, table, max_date)
+        connection.commit()
+        cursor.close()
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else "refresh"
+    if command == "create":
+        create_tables()
+    elif command == "refresh":
+        refresh_all()
+    elif command == "update":
+        refresh_incremental()
+    else:
+        print("Usage: python aggregates.py [create|refresh|update]")
+        sys.exit(1)
@@ -0,0 +1,488 @@
+from quart import Quart, Response, g, jsonify, request
+from quart_cors import cors
+import asyncio
+import time
+
+import async_backend
+import binary_response
+import http_cache
+import metrics
+from route_helpers import (
+    DASHBOARD_TIMEOUT_ERROR, DASHBOARD_TIMEOUT_SECONDS, NDJSON_MIMETYPE, DashboardRequestError, InvalidStatesError,
+    batch_states, check_states, dashboard_error, dashboard_params, group_rows_by_state, query1_columns, query1_keys,
+    query2_columns, query3_options, query4_columns, run_row_count, selected_mobility_types, shape_query1_rows,
+    shape_query2_rows, shape_query3_rows, shape_query4_rows, shape_query5_rows, wants_ndjson, warmup_params,
+)
+from async_backend import collect_rows, iter_blocking_batches, run_blocking
+from async_db import close_pool, pool_stats
+from cache import cached_result_async, in_flight, range_cache, result_cache
+from data_version import data_version
+from dimensions import UnknownStatesError, dimensions
+from db_settings import PoolTimeoutError
+from export import EXPORT_PARTITION_MONTHS, FORMATS as EXPORT_FORMATS, iter_export
+from metrics import stage
+from resolution import ResolutionError, resample, resample_batches_async, resolution_options
+from warmup import request_log, warmer
+
+# ASGI entry point: the routes of app.py as coroutines, so a request waiting on Oracle suspends
+# instead of holding a worker thread. Queries run through async_backend.py and share the caches
+# of app.py and the request checks and response shapes of route_helpers.py.
+# Run with: hypercorn asgi:app --workers 4 (see make start-asgi)
+
+app = cors(Quart(__name__))
+
+# jsonify, timed as the serialize stage of the request
+def json_response(result):
+    with stage("serialize"):
+        return jsonify(result)
+
+@app.before_request
+async def start_request_timings():
+    metrics.begin_request()
+
+# Same timings and Server-Timing header as app.py
+@app.after_request
+async def record_request_timings(response):
+    timings = metrics.current_timings()
+    if timings is None or request.url_rule is None or request.url_rule.rule == '/metrics':
+        return response
+
+    total = metrics.record_request(request.url_rule.rule, timings, response.content_length)
+    response.headers['Server-Timing'] = timings.server_timing(total)
+    response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+# Conditional requests as in app.py. The data version is only read from the database on the
+# first request, on a worker thread.
+@app.before_request
+async def check_not_modified():
+    if request.method not in http_cache.CONDITIONAL_METHODS:
+        return None
+    if request.url_rule is None or request.url_rule.rule not in http_cache.CONDITIONAL_ROUTES:
+        return None
+    loaded_at = await run_blocking(data_version.get)
+    if loaded_at is None:
+        return None
+
+    data = await request_data()
+    g.etag = http_cache.make_etag(loaded_at, request.url_rule.rule, data, request.headers.get('Accept'))
+    g.loaded_at = loaded_at
+    if http_cache.is_not_modified(request, g.etag, loaded_at):
+        return Response("", status=304)
+    return None
+
+@app.after_request
+async def add_validators(response):
+    if 'etag' in g and response.status_code in (200, 304):
+        http_cache.set_validators(response, g.etag, g.loaded_at)
+    return response
+
+# Same request counts for the warm-up as app.py
+@app.after_request
+async def log_query_request(response):
+    if request.endpoint in DASHBOARD_QUERIES and response.status_code in (200, 304):
+        params = warmup_params(request.endpoint, await request_data(), request.accept_mimetypes)
+        if params is not None:
+            request_log.record(request.endpoint, params)
+    return response
+
+# The statements look states up in the dimension cache, so it is loaded before the first request
+# instead of on the event loop. If the database is not reachable yet it is loaded on first use.
+@app.before_serving
+async def load_dimensions():
+    try:
+        await run_blocking(dimensions.reload)
+    except Exception as e:
+        print("Loading the state dimensions failed: {}".format(e))
+
+# Every worker process has caches of its own, so each warms them up. The warm-up thread runs the
+# queries as coroutines on the event loop of the worker.
+@app.before_serving
+async def start_warmup():
+    loop = asyncio.get_running_loop()
+
+    # Same cache entries as warm_up_query in app.py
+    async def warm_up(name, params):
+        encoding = params.get('format')
+        if encoding in binary_response.ENCODINGS:
+            await encoded_result(name, params, encoding, COLUMN_QUERIES[name])
+        else:
+            await cached_result_async(name, params, DASHBOARD_QUERIES[name])
+
+    def warm_up_query(name, params):
+        asyncio.run_coroutine_threadsafe(warm_up(name, params), loop).result()
+
+    warmer.start(warm_up_query)
+
+@app.after_serving
+async def close_session_pool():
+    await close_pool()
+
+async def request_data():
+    if request.method in ('GET', 'HEAD'):
+        return http_cache.query_string_data(request.args)
+    return await request.get_json()
+
+def ndjson_response(record_batches):
+    async def generate():
+        async for records in record_batches:
+            if records:
+                yield "".join(app.json.dumps(record) + "\n" for record in records)
+
+    return Response(generate(), mimetype=NDJSON_MIMETYPE)
+
+async def encoded_response(endpoint, data, encoding, compute_columns):
+    body = await encoded_result(endpoint, data, encoding, compute_columns)
+    return Response(body, mimetype=binary_response.mimetype(encoding))
+
+async def encoded_result(endpoint, data, encoding, compute_columns):
+    async def compute(data):
+        columns = await compute_columns(data)
+        with stage("serialize"):
+            return binary_response.encode(encoding, columns)
+
+    params = {name: value for name, value in data.items() if name != 'format'}
+    return await cached_result_async(endpoint + "." + encoding, params, compute)
+
+async def fetch_query1_rows(input_states, start_date, end_date, mobility_types):
+    return await collect_rows(async_backend.iter_query1_batches(input_states, start_date, end_date, mobility_types))
+
+async def query1_rows(data):
+    input_state = data.get('state')
+    mobility_types = selected_mobility_types(data)
+    result = await range_cache.get_rows_async(
+        ('query1', input_state, mobility_types), data.get('start_date'), data.get('end_date'),
+        lambda start, end: fetch_query1_rows([input_state], start, end, mobility_types)
+    )
+    return resample('query1', data, result)
+
+async def run_query1(data):
+    result = await query1_rows(data)
+    with stage("shape"):
+        return shape_query1_rows(result, data.get('state'), selected_mobility_types(data), data.get('format', 'rows'))
+
+async def run_query1_columns(data):
+    result = await query1_rows(data)
+    with stage("shape"):
+        return query1_columns(result, selected_mobility_types(data))
+
+async def stream_query1(input_states, data):
+    mobility_types = selected_mobility_types(data)
+    keys = query1_keys(mobility_types)
+    batches = async_backend.iter_query1_batches(input_states, data.get('start_date'), data.get('end_date'), mobility_types)
+    async for batch in resample_batches_async('query1', data, batches):
+        yield [dict(zip(keys, row)) for row in batch]
+
+@app.route('/query1', methods=['GET', 'POST'])
+async def query1():
+    data = await request_data()
+    await run_blocking(check_states, [data.get('state')])
+    resolution_options('query1', data)
+    if wants_ndjson(data, request.accept_mimetypes):
+        return ndjson_response(stream_query1([data.get('state')], data))
+    encoding = binary_response.requested_encoding(data, request.accept_mimetypes)
+    if encoding is not None:
+        return await encoded_response('query1', data, encoding, run_query1_columns)
+    return json_response(await cached_result_async('query1', data, run_query1))
+
+async def fetch_query2_rows(input_states, start_date, end_date):
+    return await collect_rows(async_backend.iter_query2_batches(input_states, start_date, end_date))
+
+async def query2_rows(data):
+    result = await fetch_query2_rows([data.get('state')], data.get('start_date'), data.get('end_date'))
+    return resample('query2', data, result)
+
+async def run_query2(data):
+    result = await query2_rows(data)
+    with stage("shape"):
+        return shape_query2_rows(result)
+
+async def run_query2_columns(data):
+    result = await query2_rows(data)
+    with stage("shape"):
+        return query2_columns(result)
+
+async def stream_query2(input_states, data):
+    batches = async_backend.iter_query2_batches(input_states, data.get('start_date'), data.get('end_date'))
+    async for batch in resample_batches_async('query2', data, batches):
+        yield shape_query2_rows(batch)
+
+@app.route('/query2', methods=['GET', 'POST'])
+async def query2():
+    data = await request_data()
+    await run_blocking(check_states, [data.get('state')])
+    resolution_options('query2', data)
+    if wants_ndjson(data, request.accept_mimetypes):
+        return ndjson_response(stream_query2([data.get('state')], data))
+    encoding = binary_response.requested_encoding(data, request.accept_mimetypes)
+    if encoding is not None:
+        return await encoded_response('query2', data, encoding, run_query2_columns)
+    return json_response(await cached_result_async('query2', data, run_query2))
+
+async def run_query1_batch(data):
+    mobility_types = selected_mobility_types(data)
+    response_format = data.get('format', 'rows')
+    result = await fetch_query1_rows(batch_states(data), data.get('start_date'), data.get('end_date'), mobility_types)
+    result = resample('query1', data, result)
+
+    with stage("shape"):
+        res_map = {}
+        for state, rows in group_rows_by_state(result):
+            res_map[state] = shape_query1_rows(list(rows), state, mobility_types, response_format)
+
+    return res_map
+
+@app.route('/query1_batch', methods=['GET', 'POST'])
+async def query1_batch():
+    data = await request_data()
+    await run_blocking(check_states, batch_states(data))
+    resolution_options('query1', data)
+    if wants_ndjson(data, request.accept_mimetypes):
+        return ndjson_response(stream_query1(batch_states(data), data))
+    return json_response(await cached_result_async('query1_batch', data, run_query1_batch))
+
+async def run_query2_batch(data):
+    result = await fetch_query2_rows(batch_states(data), data.get('start_date'), data.get('end_date'))
+    result = resample('query2', data, result)
+
+    with stage("shape"):
+        res_map = {}
+        for state, rows in group_rows_by_state(result):
+            res_map[state] = shape_query2_rows(rows)
+
+    return res_map
+
+@app.route('/query2_batch', methods=['GET', 'POST'])
+async def query2_batch():
+    data = await request_data()
+    await run_blocking(check_states, batch_states(data))
+    resolution_options('query2', data)
+    if wants_ndjson(data, request.accept_mimetypes):
+        return ndjson_response(stream_query2(batch_states(data), data))
+    return json_response(await cached_result_async('query2_batch', data, run_query2_batch))
+
+async def fetch_query3_rows(sectors, start_date, end_date, statistic, profit_threshold):
+    return await collect_rows(
+        async_backend.iter_query3_batches(sectors, start_date, end_date, statistic, profit_threshold))
+
+async def run_query3(data):
+    sectors = data.get('sectors', [])
+    statistic, profit_threshold = query3_options(data)
+
+    result = await range_cache.get_rows_async(
+        ('query3', tuple(sorted(sectors)), statistic, profit_threshold), data.get('start_date'), data.get('end_date'),
+        lambda start, end: fetch_query3_rows(sectors, start, end, statistic, profit_threshold),
+        whole_months=True
+    )
+    result = resample('query3', data, result)
+
+    with stage("shape"):
+        return shape_query3_rows(result, statistic)
+
+@app.route('/query3', methods=['GET', 'POST'])
+async def query3():
+    data = await request_data()
+    try:
+        query3_options(data)
+        resolution_options('query3', data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return json_response(await cached_result_async('query3', data, run_query3))
+
+async def query4_rows(data):
+    result = await collect_rows(async_backend.iter_query4_batches(
+        data.get('physician_categories', []), data.get('start_date'), data.get('end_date')))
+    return resample('query4', data, result)
+
+async def run_query4(data):
+    result = await query4_rows(data)
+    with stage("shape"):
+        return shape_query4_rows(result)
+
+async def run_query4_columns(data):
+    result = await query4_rows(data)
+    with stage("shape"):
+        return query4_columns(result)
+
+# Rows are ordered by month, so a month is written out as soon as the first row of the next month arrives.
+async def stream_query4(data):
+    current = None
+    batches = async_backend.iter_query4_batches(
+        data.get('physician_categories', []), data.get('start_date'), data.get('end_date'))
+    async for batch in resample_batches_async('query4', data, batches):
+        records = []
+        for row in batch:
+            if current is not None and current["date"] != row[0]:
+                records.append(current)
+                current = None
+            if current is None:
+                current = {"date": row[0]}
+            current[row[1]] = row[2]
+        yield records
+
+    if current is not None:
+        yield [current]
+
+@app.route('/query4', methods=['GET', 'POST'])
+async def query4():
+    data = await request_data()
+    resolution_options('query4', data)
+    if wants_ndjson(data, request.accept_mimetypes):
+        return ndjson_response(stream_query4(data))
+    encoding = binary_response.requested_encoding(data, request.accept_mimetypes)
+    if encoding is not None:
+        return await encoded_response('query4', data, encoding, run_query4_columns)
+    return json_response(await cached_result_async('query4', data, run_query4))
+
+async def fetch_query5_rows(party, start_date, end_date):
+    return await collect_rows(async_backend.iter_query5_batches(party, start_date, end_date))
+
+async def run_query5(data):
+    party = data.get('party')
+
+    result = await range_cache.get_rows_async(
+        ('query5', party), data.get('start_date'), data.get('end_date'),
+        lambda start, end: fetch_query5_rows(party, start, end)
+    )
+    result = resample('query5', data, result)
+
+    with stage("shape"):
+        return shape_query5_rows(result)
+
+@app.route('/query5', methods=['GET', 'POST'])
+async def query5():
+    data = await request_data()
+    resolution_options('query5', data)
+    return json_response(await cached_result_async('query5', data, run_query5))
+
+# The row counts are served from memory by row_counts.py, only mode=exact waits for the COUNT(*)
+# scans, on a worker thread.
+@app.route('/row_count', methods=['GET'])
+async def total_row_count():
+    return json_response(await run_blocking(run_row_count, {"mode": request.args.get('mode', 'fast')}))
+
+# The export partitions are fetched on threads of their own (see export.py), the chunks of the file
+# are handed to the event loop one at a time.
+@app.route('/export/<query_name>', methods=['GET'])
+async def export_query(query_name):
+    file_format = request.args.get('format', 'csv')
+    try:
+        chunks = iter_export(
+            query_name, file_format, request.args.get('start_date'), request.args.get('end_date'),
+            request.args.get('partition_months', EXPORT_PARTITION_MONTHS, type=int)
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return Response(iter_blocking_batches(chunks), mimetype=EXPORT_FORMATS[file_format], headers={
+        "Content-Disposition": 'attachment; filename="{}.{}"'.format(query_name, file_format)
+    })
+
+DASHBOARD_QUERIES = {
+    "query1": run_query1,
+    "query2": run_query2,
+    "query3": run_query3,
+    "query4": run_query4,
+    "query5": run_query5,
+    "query1_batch": run_query1_batch,
+    "query2_batch": run_query2_batch,
+}
+
+COLUMN_QUERIES = {
+    "query1": run_query1_columns,
+    "query2": run_query2_columns,
+    "query4": run_query4_columns,
+}
+
+async def run_dashboard_query(name, params):
+    start = time.perf_counter()
+    try:
+        if name == "row_count":
+            result = await run_blocking(run_row_count, params)
+        else:
+            result = await cached_result_async(name, params, DASHBOARD_QUERIES[name])
+            request_log.record(name, params)
+        error = None
+    except Exception as e:
+        result = None
+        error = dashboard_error(name, e)
+    return result, error, round((time.perf_counter() - start) * 1000, 3)
+
+# The computation of a query that times out is shielded (see cache.py), so it still finishes into
+# the result cache.
+async def run_dashboard_query_with_timeout(name, params):
+    start = time.perf_counter()
+    try:
+        return await asyncio.wait_for(run_dashboard_query(name, params), DASHBOARD_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        return None, DASHBOARD_TIMEOUT_ERROR, round((time.perf_counter() - start) * 1000, 3)
+
+# Same as /dashboard in app.py, with the queries running as concurrent tasks instead of threads.
+# Checking the states can read the state dimensions on first use, so it runs on a worker thread.
+@app.route('/dashboard', methods=['POST'])
+async def dashboard():
+    data = await request.get_json()
+    start = time.perf_counter()
+    try:
+        queries = await run_blocking(dashboard_params, data, DASHBOARD_QUERIES)
+    except DashboardRequestError as e:
+        return jsonify({"error": str(e)}), 400
+
+    names = list(queries)
+    results = await asyncio.gather(*(run_dashboard_query_with_timeout(name, queries[name]) for name in names))
+
+    res_map = {"results": {}, "timings_ms": {}, "errors": {}}
+    for name, (result, error, elapsed_ms) in zip(names, results):
+        res_map["results"][name] = result
+        res_map["timings_ms"][name] = elapsed_ms
+        if error is not None:
+            res_map["errors"][name] = error
+    res_map["timings_ms"]["total"] = round((time.perf_counter() - start) * 1000, 3)
+
+    return json_response(res_map)
+
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Usage of the asyncio session pool of this worker
+@app.route('/pool_stats', methods=['GET'])
+async def get_pool_stats():
+    return jsonify(pool_stats())
+
+@app.route('/cache_stats', methods=['GET'])
+async def get_cache_stats():
+    return jsonify({
+        "results": result_cache.stats(),
+        "ranges": range_cache.stats(),
+        "in_flight": in_flight.stats(),
+        "warmup": warmer.stats(),
+    })
+
+@app.route('/invalidate_cache', methods=['POST'])
+async def invalidate_cache():
+    if not await run_blocking(data_version.check):
+        await run_blocking(dimensions.reload)
+        result_cache.invalidate()
+        range_cache.invalidate()
+        warmer.schedule()
+    return jsonify({"results": result_cache.stats(), "ranges": range_cache.stats()})
+
+@app.errorhandler(PoolTimeoutError)
+async def handle_pool_timeout(e):
+    return jsonify({"error": str(e)}), 503
+
+@app.errorhandler(UnknownStatesError)
+async def handle_unknown_states(e):
+    return jsonify({"error": str(e)}), 400
+
+@app.errorhandler(InvalidStatesError)
+async def handle_invalid_states(e):
+    return jsonify({"error": str(e)}), 400
+
+@app.errorhandler(ResolutionError)
+async def handle_resolution_error(e):
+    return jsonify({"error": str(e)}), 400
+
+if __name__ == '__main__':
+    app.run(debug=True)
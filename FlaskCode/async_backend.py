@@ -0,0 +1,95 @@
+import asyncio
+
+from data_access import DATA_BACKEND, backend
+
+# The backend interface of data_access.py as async generators, for the ASGI app (asgi.py).
+# With DATA_BACKEND=oracle the statements of oracle_backend.py run on the asyncio session pool
+# (async_db.py). The local backends compute in-process, so their batches are produced on a worker
+# thread one at a time, which keeps the event loop free and still lets results stream.
+
+_SENTINEL = object()
+
+
+# Run a blocking function on a worker thread. The context is copied, so its stage timings are
+# recorded for the current request.
+async def run_blocking(function, *args):
+    return await asyncio.to_thread(function, *args)
+
+
+async def iter_blocking_batches(batches):
+    try:
+        while True:
+            batch = await run_blocking(next, batches, _SENTINEL)
+            if batch is _SENTINEL:
+                break
+            yield batch
+    finally:
+        # Closing can wait for a fetch in progress, so it happens on a worker thread too
+        await run_blocking(batches.close)
+
+
+if DATA_BACKEND == "oracle":
+    from async_db import get_connection, iter_batches, string_list_type
+    from db_settings import DB_ARRAYSIZE
+    from metrics import stage
+    from oracle_backend import (
+        query1_batch, query1_statement, query2_batch, query2_statement, query3_statement, query4_rows,
+        query4_statement, query5_rows, query5_statement, statement_binds,
+    )
+
+    # Run a statement on a session of the asyncio pool and yield its rows in batches of DB_ARRAYSIZE.
+    async def run_statement(query, binds):
+        async with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.arraysize = DB_ARRAYSIZE
+            list_type = await string_list_type(connection)
+            binds = statement_binds(query, binds, lambda values: list_type.newobject([str(v) for v in values]))
+            with stage("execute"):
+                await cursor.execute(query, binds)
+            async for batch in iter_batches(cursor):
+                yield batch
+            cursor.close()
+
+    # The rows are turned into the rows of the backend interface with the dimension lookups of
+    # oracle_backend.py, as on the threaded pool.
+    async def iter_query1_batches(input_states, start_date, end_date, mobility_types):
+        async for batch in run_statement(*query1_statement(input_states, start_date, end_date, mobility_types)):
+            yield query1_batch(batch)
+
+    async def iter_query2_batches(input_states, start_date, end_date):
+        async for batch in run_statement(*query2_statement(input_states, start_date, end_date)):
+            yield query2_batch(batch)
+
+    def iter_query3_batches(sectors, start_date, end_date, statistic="percent_in_profit", profit_threshold=0):
+        return run_statement(*query3_statement(sectors, start_date, end_date, statistic, profit_threshold))
+
+    async def iter_query4_batches(physician_categories, start_date, end_date):
+        statement = query4_statement(physician_categories, start_date, end_date)
+        yield query4_rows(await collect_rows(run_statement(*statement)))
+
+    async def iter_query5_batches(party, start_date, end_date):
+        yield query5_rows(await collect_rows(run_statement(*query5_statement(party, start_date, end_date))))
+
+else:
+    def iter_query1_batches(input_states, start_date, end_date, mobility_types):
+        return iter_blocking_batches(backend.iter_query1_batches(input_states, start_date, end_date, mobility_types))
+
+    def iter_query2_batches(input_states, start_date, end_date):
+        return iter_blocking_batches(backend.iter_query2_batches(input_states, start_date, end_date))
+
+    def iter_query3_batches(sectors, start_date, end_date, statistic="percent_in_profit", profit_threshold=0):
+        return iter_blocking_batches(
+            backend.iter_query3_batches(sectors, start_date, end_date, statistic, profit_threshold))
+
+    def iter_query4_batches(physician_categories, start_date, end_date):
+        return iter_blocking_batches(backend.iter_query4_batches(physician_categories, start_date, end_date))
+
+    def iter_query5_batches(party, start_date, end_date):
+        return iter_blocking_batches(backend.iter_query5_batches(party, start_date, end_date))
+
+
+async def collect_rows(batches):
+    rows = []
+    async for batch in batches:
+        rows.extend(batch)
+    return rows
@@ -0,0 +1,121 @@
+import time
+from contextlib import asynccontextmanager
+
+import oracledb
+
+from db_settings import (
+    DB_HOST, DB_PASSWORD, DB_PORT, DB_SERVICE_NAME, DB_STMT_CACHE_SIZE, DB_USERNAME, POOL_IDLE_TIMEOUT,
+    POOL_INCREMENT, POOL_MAX, POOL_MIN, POOL_PING_INTERVAL, POOL_WAIT_TIMEOUT, PoolTimeoutError,
+)
+from metrics import add_rows, stage
+
+# asyncio counterpart of db.py for the ASGI app (asgi.py). python-oracledb in thin mode talks to
+# the server without blocking the event loop, so a request waiting on Oracle costs a suspended
+# coroutine instead of a thread. The pool uses the same DB_POOL_* settings, per worker process.
+
+# DPY-4005: timed out waiting for the connection pool to return a connection
+POOL_WAIT_TIMEOUT_ERROR = "DPY-4005"
+
+dsn = oracledb.makedsn(DB_HOST, DB_PORT, service_name=DB_SERVICE_NAME)
+
+_pool = None
+
+_stats = {
+    "acquires": 0,
+    "acquire_timeouts": 0,
+    "total_wait_ms": 0.0,
+    "max_wait_ms": 0.0,
+}
+
+
+# The pool belongs to the event loop of the worker, so it is created on first use inside it.
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = oracledb.create_pool_async(
+            user=DB_USERNAME,
+            password=DB_PASSWORD,
+            dsn=dsn,
+            min=POOL_MIN,
+            max=POOL_MAX,
+            increment=POOL_INCREMENT,
+            getmode=oracledb.POOL_GETMODE_TIMEDWAIT,
+            wait_timeout=int(POOL_WAIT_TIMEOUT * 1000),
+            timeout=POOL_IDLE_TIMEOUT,
+            ping_interval=POOL_PING_INTERVAL,
+            stmtcachesize=DB_STMT_CACHE_SIZE,
+        )
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+# Borrow a session from the pool for the duration of the async with block.
+# The session is always given back, even when the query raises.
+@asynccontextmanager
+async def get_connection():
+    pool = get_pool()
+    start = time.perf_counter()
+    try:
+        with stage("acquire"):
+            connection = await pool.acquire()
+    except oracledb.DatabaseError as e:
+        error, = e.args
+        if getattr(error, "full_code", None) == POOL_WAIT_TIMEOUT_ERROR:
+            _stats["acquire_timeouts"] += 1
+            raise PoolTimeoutError(
+                "No database session became free within {} seconds".format(POOL_WAIT_TIMEOUT)
+            ) from e
+        raise
+    wait_ms = (time.perf_counter() - start) * 1000
+    _stats["acquires"] += 1
+    _stats["total_wait_ms"] += wait_ms
+    _stats["max_wait_ms"] = max(_stats["max_wait_ms"], wait_ms)
+
+    try:
+        yield connection
+    finally:
+        await pool.release(connection)
+
+
+def pool_stats():
+    stats = dict(_stats)
+    stats["avg_wait_ms"] = round(stats["total_wait_ms"] / stats["acquires"], 3) if stats["acquires"] else 0
+    stats["total_wait_ms"] = round(stats["total_wait_ms"], 3)
+    stats["max_wait_ms"] = round(stats["max_wait_ms"], 3)
+
+    if _pool is None:
+        stats.update({"busy": 0, "open": 0, "min": POOL_MIN, "max": POOL_MAX, "increment": POOL_INCREMENT})
+    else:
+        stats.update({
+            "busy": _pool.busy,
+            "open": _pool.opened,
+            "min": _pool.min,
+            "max": _pool.max,
+            "increment": _pool.increment,
+        })
+    stats["wait_timeout_seconds"] = POOL_WAIT_TIMEOUT
+    stats["stmt_cache_size"] = DB_STMT_CACHE_SIZE
+    return stats
+
+
+# Type to bind a list of strings as a single SYS.ODCIVARCHAR2LIST collection, like db.string_list:
+# string_list_type(connection).newobject(values)
+async def string_list_type(connection):
+    return await connection.gettype("SYS.ODCIVARCHAR2LIST")
+
+
+# Read a cursor in batches of cursor.arraysize rows instead of loading the whole result at once.
+async def iter_batches(cursor):
+    while True:
+        with stage("fetch"):
+            rows = await cursor.fetchmany()
+        if not rows:
+            break
+        add_rows(len(rows))
+        yield rows
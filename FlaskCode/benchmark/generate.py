@@ -0,0 +1,132 @@
+import argparse
+import os
+from datetime import datetime
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from dataset import MOBILITY_TYPES, SNAPSHOT_DIR
+
+# Writes a synthetic snapshot with the same tables and columns that snapshot.py exports from Oracle,
+# at a configurable scale, so the local backends can be benchmarked without the real data.
+# Usage: python -m benchmark.generate --counties-per-state 60 --days 900 --output benchmark/data
+
+STATES = [
+    ("AL", "Alabama"), ("AK", "Alaska"), ("AZ", "Arizona"), ("AR", "Arkansas"), ("CA", "California"),
+    ("CO", "Colorado"), ("CT", "Connecticut"), ("DE", "Delaware"), ("FL", "Florida"), ("GA", "Georgia"),
+    ("HI", "Hawaii"), ("ID", "Idaho"), ("IL", "Illinois"), ("IN", "Indiana"), ("IA", "Iowa"),
+    ("KS", "Kansas"), ("KY", "Kentucky"), ("LA", "Louisiana"), ("ME", "Maine"), ("MD", "Maryland"),
+    ("MA", "Massachusetts"), ("MI", "Michigan"), ("MN", "Minnesota"), ("MS", "Mississippi"), ("MO", "Missouri"),
+    ("MT", "Montana"), ("NE", "Nebraska"), ("NV", "Nevada"), ("NH", "New Hampshire"), ("NJ", "New Jersey"),
+    ("NM", "New Mexico"), ("NY", "New York"), ("NC", "North Carolina"), ("ND", "North Dakota"), ("OH", "Ohio"),
+    ("OK", "Oklahoma"), ("OR", "Oregon"), ("PA", "Pennsylvania"), ("RI", "Rhode Island"), ("SC", "South Carolina"),
+    ("SD", "South Dakota"), ("TN", "Tennessee"), ("TX", "Texas"), ("UT", "Utah"), ("VT", "Vermont"),
+    ("VA", "Virginia"), ("WA", "Washington"), ("WV", "West Virginia"), ("WI", "Wisconsin"), ("WY", "Wyoming"),
+]
+
+SECTORS = [
+    "Communication Services", "Consumer Discretionary", "Consumer Staples", "Energy", "Financials",
+    "Health Care", "Industrials", "Information Technology", "Materials", "Real Estate", "Utilities",
+]
+
+FIRST_DAY = datetime(2020, 1, 1)
+
+
+def write(output, name, columns):
+    table = pa.table(columns)
+    pq.write_table(table, os.path.join(output, name + ".parquet"))
+    print("{}: {} rows".format(name, table.num_rows))
+
+
+# One row per (day, location), days varying slowest, like a table loaded day by day
+def daily_rows(days, location_keys):
+    return {
+        "date_key": np.repeat(days, len(location_keys)),
+        "location_key": np.tile(np.asarray(location_keys, dtype=object), len(days)),
+    }
+
+
+def generate(output, states, counties_per_state, days, tickers, seed):
+    rng = np.random.default_rng(seed)
+    os.makedirs(output, exist_ok=True)
+
+    # New York is always included, query4 sums its county rows instead of the state row.
+    chosen = [s for s in STATES if s[0] == "NY"] + [s for s in STATES if s[0] != "NY"][:states - 1]
+    state_keys = ["US_" + code for code, _ in chosen]
+    county_keys = ["{}_{:05d}".format(key, i) for key in state_keys for i in range(counties_per_state)]
+    dates = np.array([np.datetime64(FIRST_DAY, "D") + i for i in range(days)]).astype("datetime64[s]")
+    population = rng.integers(500_000, 40_000_000, len(state_keys))
+
+    write(output, "code_to_state", {
+        "state_code": state_keys,
+        "state_name": [name for _, name in chosen],
+        "ruling_party": rng.choice(["D", "R"], len(chosen)),
+    })
+    write(output, "code_to_country", {"location_key": ["US"], "country_name": ["United States of America"]})
+    write(output, "demographics", {"location_key": state_keys, "population": population})
+    write(output, "health_stats", {
+        "location_key": state_keys,
+        "physicians_per_100000": rng.uniform(150, 450, len(state_keys)).round(1),
+    })
+
+    locations = county_keys + state_keys
+    rows = daily_rows(dates, locations)
+    count = len(rows["date_key"])
+    rows.update(
+        new_confirmed=rng.poisson(40, count),
+        new_deceased=rng.poisson(1, count),
+        new_tested=rng.poisson(400, count),
+    )
+    write(output, "us_epidemiology", rows)
+
+    rows = daily_rows(dates, county_keys)
+    count = len(rows["date_key"])
+    rows.update((mobility_type, rng.normal(-10, 20, count).round(2)) for mobility_type in MOBILITY_TYPES)
+    write(output, "us_mobility", rows)
+
+    rows = daily_rows(dates, county_keys)
+    count = len(rows["date_key"])
+    rows.update(
+        sni_covid19_vaccination=rng.uniform(0, 100, count).round(3),
+        sni_vaccination_intent=rng.uniform(0, 100, count).round(3),
+        sni_safety_side_effects=rng.uniform(0, 100, count).round(3),
+    )
+    write(output, "vaccination_search", rows)
+
+    rows = daily_rows(dates, state_keys)
+    rows["new_persons_vaccinated"] = rng.poisson(20_000, len(rows["date_key"]))
+    write(output, "us_vaccinations", rows)
+
+    ny_counties = [key for key in county_keys if key.startswith("US_NY_")]
+    rows = daily_rows(dates, state_keys + ny_counties)
+    rows["new_hospitalized_patients"] = rng.poisson(60, len(rows["date_key"]))
+    write(output, "hospitalizations", rows)
+
+    rows = daily_rows(dates, state_keys)
+    rows["stringency_index"] = rng.uniform(0, 100, len(rows["date_key"])).round(2)
+    write(output, "government_responses", rows)
+
+    ticker_names = ["T{:04d}".format(i) for i in range(tickers)]
+    write(output, "snp500_company_info", {"ticker": ticker_names, "sector": rng.choice(SECTORS, tickers)})
+    # Stocks only trade on weekdays
+    trading_days = dates[(dates.astype("datetime64[D]").view("int64") + 3) % 7 < 5]
+    rows = {
+        "date_key": np.repeat(trading_days, tickers),
+        "ticker": np.tile(np.asarray(ticker_names, dtype=object), len(trading_days)),
+    }
+    opens = rng.uniform(10, 500, len(rows["date_key"]))
+    rows.update(open=opens.round(2), close=(opens * rng.normal(1, 0.02, len(opens))).round(2))
+    write(output, "snp500", rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic snapshot for the local backends")
+    parser.add_argument("--output", default=SNAPSHOT_DIR)
+    parser.add_argument("--states", type=int, default=len(STATES))
+    parser.add_argument("--counties-per-state", type=int, default=60)
+    parser.add_argument("--days", type=int, default=900)
+    parser.add_argument("--tickers", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    generate(args.output, min(args.states, len(STATES)), args.counties_per_state, args.days, args.tickers, args.seed)
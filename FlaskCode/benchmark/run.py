@@ -0,0 +1,292 @@
+import argparse
+import json
+import math
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Drives /query1-/query5 and /row_count at a fixed concurrency and reports latency percentiles,
+# requests/sec and peak RSS per endpoint. Results are written as JSON so runs can be compared.
+# By default the app runs in this process against a snapshot (see benchmark/generate.py), with the
+# result and range caches turned off so every request reaches the backend.
+# Usage: python -m benchmark.run --backend memory --concurrency 8 --requests 200
+# The app's modules read their settings when imported, so they are only imported once main() has
+# set the environment.
+
+ENDPOINTS = ("query1", "query2", "query3", "query4", "query5", "row_count")
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+RSS_SAMPLE_SECONDS = 0.01
+
+
+# Values the generated requests pick from, read from the snapshot so they always match the data
+class RequestFactory:
+    def __init__(self, snapshot_dir, seed):
+        from dataset import PHYSICIAN_CATEGORIES
+        self.physician_categories = PHYSICIAN_CATEGORIES
+        self.random = random.Random(seed)
+        self.state_names = pq.read_table(os.path.join(snapshot_dir, "code_to_state.parquet"),
+                                         columns=["state_name"])["state_name"].to_pylist()
+        self.sectors = sorted(set(pq.read_table(os.path.join(snapshot_dir, "snp500_company_info.parquet"),
+                                                columns=["sector"])["sector"].to_pylist()))
+        dates = pq.read_table(os.path.join(snapshot_dir, "government_responses.parquet"), columns=["date_key"])
+        bounds = pc.min_max(dates["date_key"]).as_py()
+        self.first_day, self.last_day = bounds["min"], bounds["max"]
+
+    # A random range of at least 30 days, formatted like the React app sends it
+    def date_range(self):
+        days = (self.last_day - self.first_day).days
+        length = self.random.randint(min(30, days), days)
+        start = self.first_day + timedelta(days=self.random.randint(0, days - length))
+        end = start + timedelta(days=length)
+        return start.strftime("%d-%b-%y").upper(), end.strftime("%d-%b-%y").upper()
+
+    def sample(self, values):
+        return self.random.sample(values, self.random.randint(1, len(values)))
+
+    # (method, path, JSON body) for one request to the endpoint
+    def make(self, endpoint):
+        if endpoint == "row_count":
+            return "GET", "/row_count", None
+
+        start_date, end_date = self.date_range()
+        body = {"start_date": start_date, "end_date": end_date}
+        if endpoint in ("query1", "query2"):
+            body["state"] = self.random.choice(self.state_names)
+        elif endpoint == "query3":
+            body["sectors"] = self.sample(self.sectors)
+        elif endpoint == "query4":
+            body["physician_categories"] = self.sample(self.physician_categories)
+        elif endpoint == "query5":
+            body["party"] = self.random.choice(["R", "D"])
+        return "POST", "/" + endpoint, body
+
+
+# Calls the Flask app directly, one test client per worker thread
+class InProcessClient:
+    def __init__(self):
+        from app import app
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, body):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code
+
+
+# Calls a running server over HTTP
+class HttpClient:
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def request(self, method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+# Resident set size of a process in bytes, or None when it can't be read
+def rss_bytes(pid):
+    try:
+        with open("/proc/{}/status".format(pid)) as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid == os.getpid():
+        # Peak since the process started rather than current, ru_maxrss is in bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+    return None
+
+
+# Samples the RSS of a process in the background and keeps the highest value seen
+class RssSampler:
+    def __init__(self, pid):
+        self.pid = pid
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = rss_bytes(self.pid)
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+# Nearest-rank percentile of an already sorted list
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def run_endpoint(client, requests, concurrency, warmup, pid):
+    # Warm-up requests load the snapshot and fill per-connection state, they are not measured
+    for method, path, body in requests[:warmup]:
+        client.request(method, path, body)
+
+    def timed(request):
+        started = time.perf_counter()
+        status = client.request(*request)
+        return time.perf_counter() - started, status
+
+    with RssSampler(pid) as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(timed, requests[warmup:]))
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(seconds * 1000 for seconds, _ in results)
+    return {
+        "requests": len(results),
+        "errors": sum(1 for _, status in results if status != 200),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(results) / elapsed, 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3),
+        "peak_rss_mb": round(sampler.peak / 2 ** 20, 1) if sampler.peak is not None else None,
+    }
+
+
+# Row count of every snapshot table, from the Parquet footers, to record the scale of the run
+def snapshot_scale(snapshot_dir):
+    from dataset import DATASET_TABLES, LOOKUP_TABLES
+    scale = {}
+    for name, _, _ in DATASET_TABLES + LOOKUP_TABLES:
+        path = os.path.join(snapshot_dir, name + ".parquet")
+        if os.path.exists(path):
+            scale[name] = pq.ParquetFile(path).metadata.num_rows
+    return scale
+
+
+# Prints how each endpoint changed against an earlier run, as new / old
+def compare(results, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print("\nCompared with {}:".format(previous_path))
+    for endpoint, stats in results["endpoints"].items():
+        old = previous.get("endpoints", {}).get(endpoint)
+        if not old:
+            continue
+        ratios = ["{} x{:.2f}".format(key, stats[key] / old[key])
+                  for key in ("p50_ms", "p95_ms", "p99_ms", "requests_per_second") if old.get(key)]
+        print("  {:<10} {}".format(endpoint, "  ".join(ratios)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the query endpoints")
+    parser.add_argument("--backend", default="duckdb", help="DATA_BACKEND for the in-process app")
+    parser.add_argument("--snapshot-dir", default=DEFAULT_DATA_DIR)
+    parser.add_argument("--url", help="benchmark a running server instead of the app in this process")
+    parser.add_argument("--server-pid", type=int, help="process to sample RSS from when using --url")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--with-cache", action="store_true", help="keep the result and range caches on")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="JSON file to write, defaults to benchmark/results/")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    endpoints = [endpoint for endpoint in args.endpoints.split(",") if endpoint]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error("unknown endpoints: {}".format(", ".join(sorted(unknown))))
+
+    if args.url:
+        client = HttpClient(args.url)
+        pid = args.server_pid
+    else:
+        # Read by data_access.py and cache.py when the app is imported
+        os.environ["DATA_BACKEND"] = args.backend
+        os.environ["SNAPSHOT_DIR"] = args.snapshot_dir
+        if not args.with_cache:
+            os.environ["RESULT_CACHE_MAX_ENTRIES"] = "0"
+            os.environ["RANGE_CACHE_MAX_SERIES"] = "0"
+        client = InProcessClient()
+        pid = os.getpid()
+
+    factory = RequestFactory(args.snapshot_dir, args.seed)
+    results = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "target": args.url or "in-process",
+        "backend": None if args.url else args.backend,
+        "snapshot_dir": args.snapshot_dir,
+        "scale": snapshot_scale(args.snapshot_dir),
+        "concurrency": args.concurrency,
+        "requests_per_endpoint": args.requests,
+        "warmup": args.warmup,
+        "caches": bool(args.url or args.with_cache),
+        "seed": args.seed,
+        "endpoints": {},
+    }
+
+    print("{:<10} {:>8} {:>9} {:>9} {:>9} {:>8} {:>9}".format(
+        "endpoint", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors", "rss MB"))
+    for endpoint in endpoints:
+        requests = [factory.make(endpoint) for _ in range(args.warmup + args.requests)]
+        # The app logs every request, which would drown out the table
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            stats = run_endpoint(client, requests, args.concurrency, args.warmup, pid)
+        results["endpoints"][endpoint] = stats
+        print("{:<10} {:>8} {:>9} {:>9} {:>9} {:>8} {:>9}".format(
+            endpoint, stats["requests_per_second"], stats["p50_ms"], stats["p95_ms"], stats["p99_ms"],
+            stats["errors"], stats["peak_rss_mb"] if stats["peak_rss_mb"] is not None else "-"))
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, "{}-{}.json".format(results["backend"] or "http", datetime.now().strftime("%Y%m%d-%H%M%S")))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Results written to {}".format(output))
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
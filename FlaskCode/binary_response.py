@@ -0,0 +1,91 @@
+from datetime import timezone
+
+import msgpack
+import pyarrow as pa
+
+# Columnar binary encodings of the chart series of query1, query2 and query4. Instead of a list of
+# records that repeats every key on every row, the response holds one typed column per series:
+#   arrow   - an Arrow IPC stream with a single record batch (date32, float64 and dictionary
+#             encoded string columns), readable with apache-arrow in the browser
+#   msgpack - a MessagePack map of column name to array, dates as MessagePack timestamps and
+#             numbers as float64
+# A column is given as (name, type, values) with type one of DATE, FLOAT, INTEGER or STRING.
+
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+MSGPACK_MIMETYPE = "application/vnd.msgpack"
+
+DATE = "date"
+FLOAT = "float"
+INTEGER = "integer"
+STRING = "string"
+
+ARROW_TYPES = {
+    DATE: pa.date32(),
+    FLOAT: pa.float64(),
+    INTEGER: pa.int64(),
+    STRING: pa.dictionary(pa.int32(), pa.string()),
+}
+
+
+def arrow_array(column_type, values):
+    if column_type == DATE:
+        # The backends return datetimes (pandas Timestamps for memory), the series only need the day
+        return pa.array(values, pa.timestamp("s")).cast(pa.date32())
+    if column_type == STRING:
+        return pa.array(values, pa.string()).dictionary_encode()
+    return pa.array(values, ARROW_TYPES[column_type])
+
+
+def arrow_schema(columns):
+    return pa.schema([(name, ARROW_TYPES[column_type]) for name, column_type, *_ in columns])
+
+
+def encode_arrow(columns):
+    schema = arrow_schema(columns)
+    batch = pa.record_batch([arrow_array(column_type, values) for _, column_type, values in columns], schema=schema)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def msgpack_timestamp(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return msgpack.Timestamp.from_datetime(value)
+
+
+def encode_msgpack(columns):
+    packed = {}
+    for name, column_type, values in columns:
+        if column_type == DATE:
+            values = [msgpack_timestamp(value) for value in values]
+        packed[name] = list(values)
+    return msgpack.packb(packed)
+
+
+# format value -> (mimetype, encoder)
+ENCODINGS = {
+    "arrow": (ARROW_MIMETYPE, encode_arrow),
+    "msgpack": (MSGPACK_MIMETYPE, encode_msgpack),
+}
+
+
+# The binary encoding a request asks for, with "format": "arrow" / "msgpack" in the body or its
+# mimetype in the Accept header. None when the client wants JSON.
+def requested_encoding(data, accept_mimetypes):
+    if data.get('format') in ENCODINGS:
+        return data.get('format')
+
+    mimetypes = {mimetype: name for name, (mimetype, _) in ENCODINGS.items()}
+    mimetypes["application/x-msgpack"] = "msgpack"
+    best = accept_mimetypes.best_match(['application/json'] + list(mimetypes))
+    return mimetypes.get(best)
+
+
+def encode(encoding, columns):
+    return ENCODINGS[encoding][1](columns)
+
+
+def mimetype(encoding):
+    return ENCODINGS[encoding][0]
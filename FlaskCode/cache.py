@@ -0,0 +1,393 @@
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+# Result cache settings. Entries are evicted least-recently-used first once either limit is hit,
+# and expire RESULT_CACHE_TTL seconds after they were computed.
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '512'))
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', '3600'))
+
+# Number of (endpoint, state/party/sectors) time series kept by the range cache.
+RANGE_CACHE_MAX_SERIES = int(os.getenv('RANGE_CACHE_MAX_SERIES', '128'))
+
+# Date formats accepted in start_date/end_date. The React app sends DD-MON-YY.
+DATE_FORMATS = ("%d-%b-%y", "%d-%b-%Y", "%Y-%m-%d")
+
+ONE_DAY = timedelta(days=1)
+
+# Request parameters that are lists whose order does not change the result.
+UNORDERED_LIST_PARAMS = ("mobility_types", "sectors", "physician_categories", "states")
+
+
+# Bytes counted for a number, date or None in estimate_size, about what it takes up in JSON
+SCALAR_BYTES = 16
+
+
+# About the length of value as JSON, which is a good enough measure of how much memory a result
+# takes up. The rows of a list all have the same shape, so a list counts as its first item times
+# its length instead of serializing every row on each store. Encoded responses (see
+# binary_response.py) are cached as bytes and take up their length.
+def estimate_size(value):
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, str):
+        return len(value) + 2
+    if isinstance(value, dict):
+        return 2 + sum(len(str(name)) + 4 + estimate_size(item) for name, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return 2 + (len(value) * (estimate_size(value[0]) + 1) if value else 0)
+    return SCALAR_BYTES
+
+
+class TTLCache:
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Bumped by invalidate(), so a result computed from the data from before is not stored
+        self.generation = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+
+            expires_at, size, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    # generation is the one the computation of value started in, when it is not stored if the
+    # cache has been invalidated since.
+    def set(self, key, value, generation=None):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.generation += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+                "evictions": self.evictions,
+            }
+
+
+result_cache = TTLCache(RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL)
+
+
+# Coalesces identical computations that are in flight at the same time: the first caller of a key
+# runs it and every caller that arrives before it finishes waits for its result (or its exception)
+# instead of running the same query again. Nothing is kept once the computation has finished, that
+# is what the result cache is for.
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}  # key -> Future of the running computation
+        self._async_calls = {}  # key -> asyncio.Task, for the asyncio app (asgi.py)
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def run(self, key, compute):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return call.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    # Same as run for a coroutine compute(), which runs as a task of its own. Every caller waits on
+    # it through a shield, so a request that goes away does not cancel it for the others.
+    # Only used from the event loop, so it needs no lock.
+    async def run_async(self, key, compute):
+        task = self._async_calls.get(key)
+        if task is None:
+            task = self._async_calls[key] = asyncio.ensure_future(compute())
+            task.add_done_callback(lambda _: self._async_calls.pop(key, None))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls) + len(self._async_calls),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+            }
+
+
+in_flight = SingleFlight()
+
+
+# The request body with list order and date casing normalized, so that requests which only differ
+# in them share one cache entry.
+def normalize_params(data):
+    normalized = {}
+    for name, value in (data or {}).items():
+        if name in UNORDERED_LIST_PARAMS and isinstance(value, list):
+            # Sorted as strings, so a list of mixed types gets a key and the route can reject it
+            value = sorted(value, key=str)
+        elif isinstance(value, str):
+            value = value.strip().upper() if name.endswith("_date") else value.strip()
+        normalized[name] = value
+    return normalized
+
+
+# Build a cache key from the endpoint and normalized request body
+def make_key(endpoint, data):
+    return endpoint + ":" + json.dumps(normalize_params(data), sort_keys=True, default=str)
+
+
+# Return the cached result for this request, computing and storing it on a miss. Identical
+# requests that miss at the same time share one computation. The cache generation is part of the
+# in-flight key, so a request that arrives after the cache was invalidated does not wait for a
+# computation on the data from before, and that computation's result is not stored.
+def cached_result(endpoint, data, compute):
+    generation = result_cache.generation
+    key = make_key(endpoint, data)
+    hit, value = result_cache.get(key)
+    if hit:
+        return value
+
+    def compute_and_store():
+        value = compute(data)
+        result_cache.set(key, value, generation)
+        return value
+
+    return in_flight.run("{}@{}".format(generation, key), compute_and_store)
+
+
+# Same as cached_result for a coroutine compute(data), used by the asyncio app (asgi.py)
+async def cached_result_async(endpoint, data, compute):
+    generation = result_cache.generation
+    key = make_key(endpoint, data)
+    hit, value = result_cache.get(key)
+    if hit:
+        return value
+
+    async def compute_and_store():
+        value = await compute(data)
+        result_cache.set(key, value, generation)
+        return value
+
+    return await in_flight.run_async("{}@{}".format(generation, key), compute_and_store)
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        return value
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format)
+        except (AttributeError, ValueError):
+            continue
+    return None
+
+
+def _end_of_month(date):
+    next_month = (date.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return next_month - ONE_DAY
+
+
+class _Series:
+    def __init__(self, start, end, rows):
+        self.start = start
+        self.end = end
+        self.rows = rows
+        self.dates = [row[0] for row in rows]
+        self.expires_at = time.monotonic() + RESULT_CACHE_TTL
+
+
+# Caches one time series per (endpoint, state/party/sectors) together with the date range it
+# covers. Rows must be ordered by date and have the date in the first column. A request whose
+# range is inside the covered range is answered by slicing in memory. A request that overlaps or
+# touches the covered range only fetches the missing edges and extends the cached series.
+class RangeCache:
+    def __init__(self, max_series):
+        self.max_series = max_series
+        self._series = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        # Bumped by invalidate(), so rows fetched from the data from before are not stored
+        self.generation = 0
+
+    # fetch(start, end) must return the rows whose date lies in [start, end], both inclusive.
+    # With whole_months=True, rows are dated by the first day of a month but their values depend
+    # on the exact days requested (query3 averages only the days inside the range), so only
+    # complete months are cached and partial months at the edges are always fetched.
+    def get_rows(self, key, start_date, end_date, fetch, whole_months=False):
+        steps = self._rows(key, start_date, end_date, whole_months)
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(fetch(*request))
+        except StopIteration as done:
+            return done.value
+
+    # Same as get_rows for a coroutine fetch(start, end), used by the asyncio app (asgi.py)
+    async def get_rows_async(self, key, start_date, end_date, fetch, whole_months=False):
+        steps = self._rows(key, start_date, end_date, whole_months)
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(await fetch(*request))
+        except StopIteration as done:
+            return done.value
+
+    # The cache lookup as a generator, so that it works with blocking and with async fetches:
+    # it yields every (start, end) range it needs fetched, is sent back the rows, and returns
+    # the rows of the whole requested range.
+    def _rows(self, key, start_date, end_date, whole_months):
+        start = parse_date(start_date)
+        end = parse_date(end_date)
+        if start is None or end is None or start > end:
+            return (yield start_date, end_date)
+
+        if not whole_months:
+            return (yield from self._get_range(key, start, end))
+
+        full_start = start if start.day == 1 else _end_of_month(start) + ONE_DAY
+        full_end = end if end == _end_of_month(end) else end.replace(day=1) - ONE_DAY
+        if full_start > full_end:
+            return (yield start, end)
+
+        rows = []
+        if start < full_start:
+            rows += yield start, full_start - ONE_DAY
+        rows += yield from self._get_range(key, full_start, full_end)
+        if end > full_end:
+            rows += yield full_end + ONE_DAY, end
+        return rows
+
+    def _get_range(self, key, start, end):
+        with self._lock:
+            generation = self.generation
+            series = self._series.get(key)
+            if series is not None and series.expires_at < time.monotonic():
+                del self._series[key]
+                series = None
+
+        if series is not None and series.start <= start and end <= series.end:
+            with self._lock:
+                self.hits += 1
+                if self._series.get(key) is series:
+                    self._series.move_to_end(key)
+            return self._slice(series, start, end)
+
+        if series is not None and start <= series.end + ONE_DAY and end >= series.start - ONE_DAY:
+            left = (yield start, series.start - ONE_DAY) if start < series.start else []
+            right = (yield series.end + ONE_DAY, end) if end > series.end else []
+            extended = _Series(min(start, series.start), max(end, series.end), left + series.rows + right)
+            extended.expires_at = series.expires_at
+            series = extended
+            with self._lock:
+                self.partial_hits += 1
+        else:
+            series = _Series(start, end, (yield start, end))
+            with self._lock:
+                self.misses += 1
+
+        with self._lock:
+            if generation != self.generation:
+                return self._slice(series, start, end)
+            self._series[key] = series
+            self._series.move_to_end(key)
+            while len(self._series) > self.max_series:
+                self._series.popitem(last=False)
+
+        return self._slice(series, start, end)
+
+    @staticmethod
+    def _slice(series, start, end):
+        lo = bisect.bisect_left(series.dates, start)
+        hi = bisect.bisect_right(series.dates, end)
+        return series.rows[lo:hi]
+
+    def invalidate(self):
+        with self._lock:
+            self._series.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "series": len(self._series),
+                "max_series": self.max_series,
+                "hits": self.hits,
+                "partial_hits": self.partial_hits,
+                "misses": self.misses,
+            }
+
+
+range_cache = RangeCache(RANGE_CACHE_MAX_SERIES)
@@ -0,0 +1,43 @@
+import importlib
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Where query1-query5 and the row counts are read from:
+#   oracle - the shared Oracle database (oracle_backend.py)
+#   duckdb - a local Parquet snapshot of the same tables, queried in-process (local_backend.py)
+#   memory - the same snapshot loaded into NumPy arrays, with the results precomputed (memory_backend.py)
+DATA_BACKEND = os.getenv('DATA_BACKEND', 'oracle').lower()
+
+BACKEND_MODULES = {
+    "oracle": "oracle_backend",
+    "duckdb": "local_backend",
+    "memory": "memory_backend",
+}
+
+# Every backend module provides the same functions, returning rows with the same columns in the
+# same order:
+#   iter_query1_batches(input_states, start_date, end_date, mobility_types)
+#   iter_query2_batches(input_states, start_date, end_date)
+#   iter_query3_batches(sectors, start_date, end_date, statistic, profit_threshold)
+#   iter_query4_batches(physician_categories, start_date, end_date)
+#   iter_query5_batches(party, start_date, end_date)
+#   exact_row_counts()
+#   statistics_row_counts()
+#   last_loaded_at()
+#   state_dimensions()
+# input_states is a list of state names, or None for all states. The query functions yield lists
+# of rows so that results can be streamed. last_loaded_at() is when the data the queries read last
+# changed, as a UTC datetime (see data_version.py). state_dimensions() returns the rows of
+# code_to_state with each state's population and physicians per 100000 (see dimensions.py).
+
+
+def load_backend(name):
+    if name not in BACKEND_MODULES:
+        raise ValueError("Unknown DATA_BACKEND '{}', expected one of: {}".format(name, ", ".join(BACKEND_MODULES)))
+    return importlib.import_module(BACKEND_MODULES[name])
+
+
+backend = load_backend(DATA_BACKEND)
@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+
+from cache import range_cache, result_cache
+from data_access import backend
+from dimensions import dimensions
+from row_counts import row_count_cache
+from warmup import warmer
+
+# How often the backend is asked whether the data has been reloaded.
+DATA_VERSION_CHECK_SECONDS = int(os.getenv('DATA_VERSION_CHECK_SECONDS', '60'))
+
+
+# The version of the data behind the queries is the time its tables were last loaded (see
+# last_loaded_at() in the backends). It is kept in memory and checked again on a background thread,
+# so answering a conditional request never waits for the database. When it changes, every cached
+# result is dropped, the state dimensions are read again, the exact row counts are recomputed and
+# the popular queries are warmed up again (see warmup.py).
+class DataVersion:
+    def __init__(self, check_seconds):
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._checked_at = None
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='data-version-check', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.check_seconds)
+            try:
+                self.check()
+            except Exception as e:
+                print("Data version check failed: {}".format(e))
+
+    # Whether the version changed, in which case the caches have been dropped
+    def check(self):
+        loaded_at = backend.last_loaded_at()
+        with self._lock:
+            previous = self._loaded_at
+            self._loaded_at = loaded_at
+            self._checked_at = time.monotonic()
+
+        if previous is not None and loaded_at != previous:
+            print("Data reloaded at {}, dropping cached results".format(loaded_at))
+            dimensions.reload()
+            result_cache.invalidate()
+            range_cache.invalidate()
+            row_count_cache.refresh_soon()
+            warmer.schedule()
+            return True
+        return False
+
+    # The last load time seen, checked right away only the first time. None when it is unknown,
+    # in which case responses go out without validators.
+    def get(self):
+        self.start()
+        with self._lock:
+            if self._checked_at is not None:
+                return self._loaded_at
+        try:
+            self.check()
+            with self._lock:
+                return self._loaded_at
+        except Exception as e:
+            print("Data version check failed: {}".format(e))
+            return None
+
+
+data_version = DataVersion(DATA_VERSION_CHECK_SECONDS)
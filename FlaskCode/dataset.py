@@ -0,0 +1,66 @@
+import os
+from datetime import datetime, timezone
+
+# Directory of the Parquet snapshot of every table below, one <name>.parquet file per table.
+# Written by `python snapshot.py export` and read by the local backend (DATA_BACKEND=duckdb).
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshot'))
+
+# (name, owner, table name) of every table in the dataset, in the order /row_count reports them
+DATASET_TABLES = [
+    ("code_to_country", "RGUGALE", "CODE_TO_COUNTRY"),
+    ("demographics", "RGUGALE", "DEMOGRAPHICS"),
+    ("snp500", "AMMAR.AMJAD", "SNP500"),
+    ("snp500_company_info", "RGUGALE", "SNP500_COMPANY_INFO"),
+    ("us_epidemiology", "RGUGALE", "US_EPIDEMIOLOGY"),
+    ("us_mobility", "AMMAR.AMJAD", "US_MOBILITY"),
+    ("government_responses", "AMMAR.AMJAD", "GOVERNMENT_RESPONSES"),
+    ("hospitalizations", "AMMAR.AMJAD", "HOSPITALIZATIONS"),
+    ("vaccination_search", "AMMAR.AMJAD", "VACCINATION_SEARCH"),
+    ("us_vaccinations", "AMMAR.AMJAD", "US_VACCINATIONS"),
+]
+
+# Lookup tables the queries join with. They are not counted by /row_count.
+LOOKUP_TABLES = [
+    ("code_to_state", "RGUGALE", "CODE_TO_STATE"),
+    ("health_stats", "RGUGALE", "HEALTH_STATS"),
+]
+
+
+# When the snapshot files of the given tables were last written, in UTC
+def snapshot_modified_at(tables):
+    modified = max(os.path.getmtime(os.path.join(SNAPSHOT_DIR, name + '.parquet')) for name, _, _ in tables)
+    return datetime.fromtimestamp(modified, timezone.utc)
+
+# Mobility series available in query1, in the order they are returned
+MOBILITY_TYPES = (
+    "mobility_retail_and_recreation",
+    "mobility_grocery_and_pharmacy",
+    "mobility_parks",
+    "mobility_transit_stations",
+    "mobility_workplaces",
+    "mobility_residential",
+)
+
+# Monthly series of query2, in the order they are returned after the date and the state
+QUERY2_SERIES = (
+    "avg_monthly_sni_covid19_vaccination",
+    "avg_monthly_sni_vaccination_intent",
+    "avg_monthly_sni_safety_side_effects",
+    "vaccination_rate",
+)
+
+# Groups of states by physicians per 100000 people in query4
+PHYSICIAN_CATEGORIES = ["Low (<200)", "Decent (200-300)", "Good (300-400)", "Very good (>400)"]
+
+
+# Statistics query3 can report for each sector and month. Each is the average over the month's
+# trading days of a daily value, where the return of a company is (close - open) / open in percent:
+#   percent_in_profit - share of the sector's companies with a return of at least profit_threshold.
+#                       Days on which none reached it are left out, as in the original query3.
+#   median_return     - median return of the sector's companies
+#   breadth           - advancing minus declining companies, as a percentage of those traded
+SECTOR_STATISTICS = ("percent_in_profit", "median_return", "breadth")
+
+# Returns are indexed in buckets of this many percentage points (see SECTOR_DAILY_RETURNS in
+# aggregates.py), so a profit threshold has to be a multiple of it.
+PROFIT_THRESHOLD_STEP = 0.1
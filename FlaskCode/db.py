@@ -0,0 +1,128 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import cx_Oracle
+
+from db_settings import (
+    DB_HOST, DB_PASSWORD, DB_PORT, DB_SERVICE_NAME, DB_STMT_CACHE_SIZE, DB_USERNAME, POOL_IDLE_TIMEOUT,
+    POOL_INCREMENT, POOL_MAX, POOL_MIN, POOL_PING_INTERVAL, POOL_WAIT_TIMEOUT, PoolTimeoutError,
+)
+from metrics import add_rows, stage
+
+dsn = cx_Oracle.makedsn(DB_HOST, DB_PORT, service_name=DB_SERVICE_NAME)
+
+# ORA-24457: OCISessionGet() could not find a free session in the specified timeout period
+ORA_POOL_WAIT_TIMEOUT = 24457
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {
+    "acquires": 0,
+    "acquire_timeouts": 0,
+    "total_wait_ms": 0.0,
+    "max_wait_ms": 0.0,
+}
+
+
+def get_pool():
+    global _pool
+    # The pool is created on first use so that importing this module never needs a live database.
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = cx_Oracle.SessionPool(
+                    user=DB_USERNAME,
+                    password=DB_PASSWORD,
+                    dsn=dsn,
+                    min=POOL_MIN,
+                    max=POOL_MAX,
+                    increment=POOL_INCREMENT,
+                    threaded=True,
+                    getmode=cx_Oracle.SPOOL_ATTRVAL_TIMEDWAIT,
+                    wait_timeout=int(POOL_WAIT_TIMEOUT * 1000),
+                    timeout=POOL_IDLE_TIMEOUT,
+                    ping_interval=POOL_PING_INTERVAL,
+                    stmtcachesize=DB_STMT_CACHE_SIZE,
+                )
+    return _pool
+
+
+def _record_wait(wait_ms, timed_out=False):
+    with _stats_lock:
+        if timed_out:
+            _stats["acquire_timeouts"] += 1
+            return
+        _stats["acquires"] += 1
+        _stats["total_wait_ms"] += wait_ms
+        _stats["max_wait_ms"] = max(_stats["max_wait_ms"], wait_ms)
+
+
+# Borrow a session from the pool for the duration of the with block.
+# The session is always given back, even when the query raises.
+@contextmanager
+def get_connection():
+    pool = get_pool()
+    start = time.perf_counter()
+    try:
+        with stage("acquire"):
+            connection = pool.acquire()
+    except cx_Oracle.DatabaseError as e:
+        error, = e.args
+        if getattr(error, "code", None) == ORA_POOL_WAIT_TIMEOUT:
+            _record_wait(0, timed_out=True)
+            raise PoolTimeoutError(
+                "No database session became free within {} seconds".format(POOL_WAIT_TIMEOUT)
+            ) from e
+        raise
+    _record_wait((time.perf_counter() - start) * 1000)
+
+    try:
+        yield connection
+    finally:
+        pool.release(connection)
+
+
+def pool_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+
+    stats["avg_wait_ms"] = round(stats["total_wait_ms"] / stats["acquires"], 3) if stats["acquires"] else 0
+    stats["total_wait_ms"] = round(stats["total_wait_ms"], 3)
+    stats["max_wait_ms"] = round(stats["max_wait_ms"], 3)
+
+    if _pool is None:
+        stats.update({"busy": 0, "open": 0, "min": POOL_MIN, "max": POOL_MAX, "increment": POOL_INCREMENT})
+    else:
+        stats.update({
+            "busy": _pool.busy,
+            "open": _pool.opened,
+            "min": _pool.min,
+            "max": _pool.max,
+            "increment": _pool.increment,
+        })
+    stats["wait_timeout_seconds"] = POOL_WAIT_TIMEOUT
+    stats["stmt_cache_size"] = DB_STMT_CACHE_SIZE
+    return stats
+
+
+# Bind a list of strings as a single SYS.ODCIVARCHAR2LIST collection, for use in
+# `IN (SELECT column_value FROM TABLE(:values))`. The SQL text stays the same whatever the
+# number of values, so the statement is parsed once and reused from the statement cache.
+def string_list(connection, values):
+    list_type = connection.gettype("SYS.ODCIVARCHAR2LIST")
+    return list_type.newobject([str(value) for value in values])
+
+
+# Read a cursor in batches of cursor.arraysize rows instead of loading the whole result at once.
+def iter_batches(cursor):
+    while True:
+        with stage("fetch"):
+            rows = cursor.fetchmany()
+        if not rows:
+            break
+        add_rows(len(rows))
+        yield rows
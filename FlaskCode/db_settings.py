@@ -0,0 +1,44 @@
+import os
+
+from dotenv import load_dotenv
+
+# Connection and session pool settings of db.py (cx_Oracle, app.py) and async_db.py
+# (python-oracledb, asgi.py). This module imports neither driver, so the apps and export.py can
+# read the pool size and catch PoolTimeoutError without loading one.
+
+load_dotenv()
+
+DB_USERNAME = os.getenv('DB_USERNAME')
+DB_PASSWORD = os.getenv('DB_PASSWORD')
+
+# Database connection settings
+DB_HOST = os.getenv('DB_HOST', 'oracle.cise.ufl.edu')
+DB_PORT = os.getenv('DB_PORT', '1521')
+DB_SERVICE_NAME = os.getenv('DB_SERVICE_NAME', 'orcl')
+
+# Session pool settings. Every route borrows a session from one app-wide pool instead of
+# doing a full TCP/auth handshake per request. POOL_MAX should stay below the per-user session
+# limit on the server.
+POOL_MIN = int(os.getenv('DB_POOL_MIN', '2'))
+POOL_MAX = int(os.getenv('DB_POOL_MAX', '8'))
+POOL_INCREMENT = int(os.getenv('DB_POOL_INCREMENT', '1'))
+# Seconds a request waits for a free session before giving up.
+POOL_WAIT_TIMEOUT = float(os.getenv('DB_POOL_WAIT_TIMEOUT', '10'))
+# Seconds an idle session is kept open before the pool closes it (0 = never).
+POOL_IDLE_TIMEOUT = int(os.getenv('DB_POOL_IDLE_TIMEOUT', '300'))
+# Sessions idle for longer than this many seconds are pinged before being handed out,
+# so dead sessions (network drops, server restarts) are replaced transparently.
+POOL_PING_INTERVAL = int(os.getenv('DB_POOL_PING_INTERVAL', '60'))
+
+# Rows fetched from the server per round trip when reading query results.
+DB_ARRAYSIZE = int(os.getenv('DB_ARRAYSIZE', '1000'))
+
+# Parsed statements kept open per session. Every query has a fixed SQL text (lists are bound as
+# collections, never formatted into the SQL), so a repeated request reuses the cursor from this
+# cache instead of parsing again. query1 has one text per combination of mobility types.
+DB_STMT_CACHE_SIZE = int(os.getenv('DB_STMT_CACHE_SIZE', '100'))
+
+
+# Raised by get_connection() of either pool when no session became free within DB_POOL_WAIT_TIMEOUT
+class PoolTimeoutError(Exception):
+    pass
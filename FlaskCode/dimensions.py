@@ -0,0 +1,84 @@
+import threading
+from collections import namedtuple
+
+import data_access
+from dataset import PHYSICIAN_CATEGORIES
+
+# code_to_state, demographics and health_stats are a few rows per state that only change when the
+# dataset is reloaded. They are read once into in-process maps, so the queries only aggregate the
+# fact tables: state names are resolved to codes before the SQL runs, and names, populations,
+# ruling parties and physician categories are looked up on the rows it returns. Unknown states are
+# rejected without a database round trip. reload() reads the tables again; it runs when the data
+# version changes (see data_version.py) and on /invalidate_cache.
+
+State = namedtuple("State", ["code", "name", "ruling_party", "population", "physician_category"])
+
+
+# Raised for state names that are not in code_to_state. The routes answer it with a 400.
+class UnknownStatesError(ValueError):
+    def __init__(self, names):
+        super().__init__("Unknown states: {}".format(", ".join(sorted(str(name) for name in names))))
+        self.names = names
+
+
+# Same bands as the CASE the query4 SQL used. NULL falls through to 'Unknown'.
+def physician_category(physicians_per_100000):
+    if physicians_per_100000 is None:
+        return "Unknown"
+    if physicians_per_100000 < 200:
+        return PHYSICIAN_CATEGORIES[0]
+    if physicians_per_100000 < 300:
+        return PHYSICIAN_CATEGORIES[1]
+    if physicians_per_100000 < 400:
+        return PHYSICIAN_CATEGORIES[2]
+    return PHYSICIAN_CATEGORIES[3]
+
+
+class StateDimensions:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_code = None
+        self._by_name = None
+
+    # Rows of state_dimensions() in the backend: (state_code, state_name, ruling_party, population,
+    # physicians_per_100000), with population and physicians None when the state has none.
+    def reload(self):
+        by_code = {}
+        for code, name, ruling_party, population, physicians_per_100000 in data_access.backend.state_dimensions():
+            if code not in by_code:
+                by_code[code] = State(code, name, ruling_party, population, physician_category(physicians_per_100000))
+        by_name = {}
+        for state in by_code.values():
+            by_name.setdefault(state.name, []).append(state.code)
+
+        with self._lock:
+            self._by_code = by_code
+            self._by_name = by_name
+        print("Loaded {} states".format(len(by_code)))
+        return len(by_code)
+
+    # Loaded on first use
+    def _maps(self):
+        with self._lock:
+            if self._by_code is not None:
+                return self._by_code, self._by_name
+        self.reload()
+        with self._lock:
+            return self._by_code, self._by_name
+
+    def get(self, state_code):
+        return self._maps()[0].get(state_code)
+
+    # The state codes of a list of state names. Raises UnknownStatesError if any is not a state.
+    def state_codes(self, state_names):
+        by_name = self._maps()[1]
+        unknown = [name for name in state_names if name not in by_name]
+        if unknown:
+            raise UnknownStatesError(unknown)
+        return sorted({code for name in state_names for code in by_name[name]})
+
+    def codes_where(self, predicate):
+        return sorted(code for code, state in self._maps()[0].items() if predicate(state))
+
+
+dimensions = StateDimensions()
@@ -0,0 +1,131 @@
+import argparse
+import os
+
+from dataset import MOBILITY_TYPES
+from db import get_connection, string_list
+from oracle_backend import (
+    query1_statement,
+    query2_statement,
+    query3_statement,
+    query4_statement,
+    query5_statement,
+    statement_binds,
+)
+
+# Captures the execution plans of query1-query5 with DBMS_XPLAN, to check what the schema migrations
+# (see migrations.py) change. Each statement runs once on a pooled session, then the plan it ran with
+# is read back from the cursor cache, with the partitions it read (Pstart/Pstop). Reading it needs
+# SELECT on V$SQL, V$SQL_PLAN and V$SESSION.
+# Usage:
+#   python explain_plans.py capture --label before
+#   python migrations.py migrate
+#   python explain_plans.py capture --label after
+#   python explain_plans.py compare before after
+# Plans are written to plans/<label>/<case>.txt.
+
+PLANS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plans')
+
+# Plan operations that read a whole table, index or every partition
+FULL_SCAN_OPERATIONS = ("TABLE ACCESS FULL", "TABLE ACCESS STORAGE FULL", "INDEX FULL SCAN", "INDEX FAST FULL SCAN",
+                        "PARTITION RANGE ALL", "PARTITION LIST ALL")
+
+DISPLAY_CURSOR = "SELECT plan_table_output FROM TABLE(DBMS_XPLAN.DISPLAY_CURSOR(NULL, NULL, 'TYPICAL'))"
+
+
+# case name -> statement, for the sample parameters given on the command line. query1 is captured
+# for the requested states and for all of them, as /query1 and the bulk routes run it.
+def plan_cases(args):
+    states = args.states.split(",")
+    return {
+        "query1": query1_statement(states, args.start_date, args.end_date, MOBILITY_TYPES),
+        "query1_all_states": query1_statement(None, args.start_date, args.end_date, MOBILITY_TYPES),
+        "query2": query2_statement(states, args.start_date, args.end_date),
+        "query3": query3_statement(args.sectors.split(","), args.start_date, args.end_date),
+        "query4": query4_statement([], args.start_date, args.end_date),
+        "query5": query5_statement(args.party, args.start_date, args.end_date),
+    }
+
+
+# Run a statement and return the lines of the plan it ran with
+def capture_plan(connection, query, binds):
+    cursor = connection.cursor()
+    cursor.execute(query, statement_binds(query, binds, lambda values: string_list(connection, values)))
+    cursor.fetchall()
+    cursor.execute(DISPLAY_CURSOR)
+    lines = [line for line, in cursor.fetchall()]
+    cursor.close()
+    return lines
+
+
+def capture(args):
+    directory = os.path.join(args.output, args.label)
+    os.makedirs(directory, exist_ok=True)
+    with get_connection() as connection:
+        for name, (query, binds) in plan_cases(args).items():
+            lines = capture_plan(connection, query, binds)
+            with open(os.path.join(directory, name + ".txt"), "w") as f:
+                f.write("\n".join(lines) + "\n")
+            print("{}: {} full scans".format(name, len(full_scans(lines))))
+
+
+# (operation, object) of the full scans in the lines of a plan. The plan table has the columns
+# | Id | Operation | Name | ...
+def full_scans(lines):
+    scans = []
+    for line in lines:
+        columns = [column.strip() for column in line.split("|")]
+        if len(columns) > 3 and columns[2].startswith(FULL_SCAN_OPERATIONS):
+            scans.append((columns[2], columns[3]))
+    return scans
+
+
+def read_plan(directory, name):
+    path = os.path.join(directory, name + ".txt")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+# Full scans per case in the plans of two labels
+def compare(args):
+    before_dir = os.path.join(args.output, args.before)
+    after_dir = os.path.join(args.output, args.after)
+    names = sorted({name[:-4] for directory in (before_dir, after_dir) if os.path.isdir(directory)
+                    for name in os.listdir(directory) if name.endswith(".txt")})
+    print("{:<20} {:>10} {:>10}".format("case", args.before, args.after))
+    for name in names:
+        before = read_plan(before_dir, name)
+        after = read_plan(after_dir, name)
+        print("{:<20} {:>10} {:>10}".format(
+            name,
+            "-" if before is None else len(full_scans(before)),
+            "-" if after is None else len(full_scans(after)),
+        ))
+        for operation, table in full_scans(after or []):
+            print("    {} {}".format(operation, table))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Capture and compare the execution plans of query1-query5")
+    parser.add_argument("--output", default=PLANS_DIR, help="defaults to {}".format(PLANS_DIR))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    capture_parser = commands.add_parser("capture", help="run the queries and save their plans")
+    capture_parser.add_argument("--label", required=True, help="e.g. before or after")
+    capture_parser.add_argument("--states", default="New York,California", help="comma separated state names")
+    capture_parser.add_argument("--sectors", default="Information Technology,Health Care",
+                                help="comma separated sectors")
+    capture_parser.add_argument("--party", default="D")
+    capture_parser.add_argument("--start-date", default="01-JAN-21")
+    capture_parser.add_argument("--end-date", default="30-JUN-21")
+
+    compare_parser = commands.add_parser("compare", help="count the full scans in two sets of plans")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    args = parser.parse_args()
+
+    if args.command == "capture":
+        capture(args)
+    else:
+        compare(args)
@@ -0,0 +1,270 @@
+import argparse
+import csv
+import io
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from binary_response import DATE, FLOAT, INTEGER, STRING, arrow_array, arrow_schema
+from cache import parse_date
+from data_access import backend
+from dataset import MOBILITY_TYPES, QUERY2_SERIES
+from db_settings import POOL_MAX
+
+# Bulk export of query1, query2, query4 and query5 for every state (every party for query5) over a
+# whole date range, as CSV or Parquet. The range is split into partitions of a few months, which are
+# fetched in parallel, each on its own pooled session, and written out in order as their batches
+# arrive, so an export never holds more than a few batches per partition in memory.
+# Usage: python export.py query1 --format parquet --output query1.parquet
+# The app serves the same files at /export/<query>?format=csv|parquet (see app.py).
+
+# Partitions fetched at the same time. More than the pool size would only queue on the pool.
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', str(POOL_MAX)))
+
+# Default start of an export. The end defaults to today.
+EXPORT_FIRST_DAY = os.getenv('EXPORT_FIRST_DAY', '2020-01-01')
+
+# Months per partition
+EXPORT_PARTITION_MONTHS = int(os.getenv('EXPORT_PARTITION_MONTHS', '3'))
+
+# Batches a partition can fetch ahead of the writer before its worker waits
+QUEUE_BATCHES = 8
+
+# Rows per Parquet row group. The batches from the backends are much smaller.
+PARQUET_ROW_GROUP_ROWS = 64 * 1024
+
+FORMATS = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+PARTIES = ("D", "R")
+
+_DONE = object()
+
+
+def query1_partitions(ranges):
+    return [
+        lambda start=start, end=end: backend.iter_query1_batches(None, start, end, MOBILITY_TYPES)
+        for start, end in ranges
+    ]
+
+
+def query2_partitions(ranges):
+    return [lambda start=start, end=end: backend.iter_query2_batches(None, start, end) for start, end in ranges]
+
+
+def query4_partitions(ranges):
+    return [lambda start=start, end=end: backend.iter_query4_batches([], start, end) for start, end in ranges]
+
+
+# query5 is asked per party and its rows do not say which, so the party is added as the first column
+def query5_partitions(ranges):
+    def with_party(party, start, end):
+        for batch in backend.iter_query5_batches(party, start, end):
+            yield [(party,) + tuple(row) for row in batch]
+
+    return [
+        lambda party=party, start=start, end=end: with_party(party, start, end)
+        for party in PARTIES for start, end in ranges
+    ]
+
+
+# query name -> (columns as (name, type), partitions(date ranges))
+EXPORTS = {
+    "query1": (
+        (("date", DATE), ("state", STRING), ("infected_population_percent", FLOAT))
+        + tuple((mobility_type, FLOAT) for mobility_type in MOBILITY_TYPES),
+        query1_partitions,
+    ),
+    "query2": ((("date", DATE), ("state", STRING)) + tuple((name, FLOAT) for name in QUERY2_SERIES), query2_partitions),
+    "query4": (
+        (("date", DATE), ("physician_category", STRING), ("avg_ratio_of_deaths_to_hospitalized_people", FLOAT)),
+        query4_partitions,
+    ),
+    "query5": (
+        (("party", STRING), ("date", DATE), ("stringency_category", STRING), ("no_of_states", INTEGER),
+         ("mortality_rate_100000", FLOAT)),
+        query5_partitions,
+    ),
+}
+
+
+def _add_months(date, months):
+    month = date.month - 1 + months
+    return date.replace(year=date.year + month // 12, month=month % 12 + 1, day=1)
+
+
+# Consecutive (start, end) date ranges of `months` months covering start_date to end_date, as the
+# DD-MON-YY strings the routes receive. The queries filter on the start of each week or month, so
+# a period is always computed whole, in the partition its start falls in.
+def date_ranges(start_date, end_date, months):
+    start = parse_date(start_date)
+    end = parse_date(end_date)
+    if start is None or end is None or start > end:
+        raise ValueError("Invalid date range: {} - {}".format(start_date, end_date))
+
+    ranges = []
+    while start <= end:
+        next_start = _add_months(start, months)
+        ranges.append((start, min(next_start - timedelta(days=1), end)))
+        start = next_start
+    return [(s.strftime("%d-%b-%y").upper(), e.strftime("%d-%b-%y").upper()) for s, e in ranges]
+
+
+# Yield the batches of every partition, partition after partition. Up to `workers` partitions are
+# fetched at once. Each hands its batches over through a small queue, so a partition that is ahead
+# of the writer waits instead of piling up rows. Closing the generator stops the workers.
+def iter_partition_batches(partitions, workers):
+    queues = [queue.Queue(QUEUE_BATCHES) for _ in partitions]
+    stopped = threading.Event()
+
+    def put(q, item):
+        while not stopped.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch(i):
+        if stopped.is_set():
+            return
+        batches = partitions[i]()
+        try:
+            for batch in batches:
+                if not put(queues[i], batch):
+                    return
+            put(queues[i], _DONE)
+        except Exception as e:
+            put(queues[i], e)
+        finally:
+            batches.close()
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export')
+    try:
+        for i in range(len(partitions)):
+            executor.submit(fetch, i)
+        for q in queues:
+            while True:
+                item = q.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+    finally:
+        stopped.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    return value
+
+
+def iter_csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    for batch in batches:
+        writer.writerows([_csv_value(value) for value in row] for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# Collects what the Parquet writer writes, so it can be handed on after every row group
+class _ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_parquet(columns, batches):
+    schema = arrow_schema(columns)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+
+    def row_group(rows):
+        values = list(zip(*rows))
+        arrays = [arrow_array(column_type, values[i]) for i, (_, column_type) in enumerate(columns)]
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        return sink.take()
+
+    rows = []
+    for batch in batches:
+        rows.extend(batch)
+        if len(rows) >= PARQUET_ROW_GROUP_ROWS:
+            yield row_group(rows)
+            rows = []
+    if rows:
+        yield row_group(rows)
+    writer.close()
+    yield sink.take()
+
+
+# The file of an export, in chunks of str (csv) or bytes (parquet)
+def iter_export(query_name, file_format, start_date=None, end_date=None,
+                partition_months=EXPORT_PARTITION_MONTHS, workers=EXPORT_WORKERS):
+    if query_name not in EXPORTS:
+        raise ValueError("query must be one of: {}".format(", ".join(EXPORTS)))
+    if file_format not in FORMATS:
+        raise ValueError("format must be one of: {}".format(", ".join(FORMATS)))
+    if partition_months < 1:
+        raise ValueError("partition_months must be at least 1")
+
+    ranges = date_ranges(start_date or EXPORT_FIRST_DAY, end_date or datetime.now().strftime("%Y-%m-%d"),
+                         partition_months)
+    columns, make_partitions = EXPORTS[query_name]
+    batches = iter_partition_batches(make_partitions(ranges), workers)
+    if file_format == "csv":
+        return iter_csv(columns, batches)
+    return iter_parquet(columns, batches)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export a query for every state and the whole date range")
+    parser.add_argument("query", choices=sorted(EXPORTS))
+    parser.add_argument("--format", default="csv", choices=sorted(FORMATS))
+    parser.add_argument("--output", help="file to write, defaults to <query>.<format>")
+    parser.add_argument("--start-date", help="defaults to EXPORT_FIRST_DAY ({})".format(EXPORT_FIRST_DAY))
+    parser.add_argument("--end-date", help="defaults to today")
+    parser.add_argument("--partition-months", type=int, default=EXPORT_PARTITION_MONTHS)
+    parser.add_argument("--workers", type=int, default=EXPORT_WORKERS)
+    args = parser.parse_args()
+
+    output = args.output or "{}.{}".format(args.query, args.format)
+    chunks = iter_export(args.query, args.format, args.start_date, args.end_date, args.partition_months, args.workers)
+    # Written next to the output and renamed at the end, so a failed export leaves no partial file
+    text = args.format == 'csv'
+    with open(output + '.tmp', 'w' if text else 'wb', newline='' if text else None) as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(output + '.tmp', output)
+    print("{}: written".format(output))
@@ -0,0 +1,71 @@
+import hashlib
+import os
+
+from cache import UNORDERED_LIST_PARAMS, make_key
+
+# HTTP conditional caching for the query routes. Responses carry an ETag derived from the data
+# version and the request, and a Last-Modified of the data version, so a browser, CDN or reverse
+# proxy can revalidate with If-None-Match / If-Modified-Since and get a 304 without the query
+# running again. Used by app.py and asgi.py.
+
+# max-age sent in Cache-Control. 0 lets caches store responses but makes them revalidate every time.
+HTTP_CACHE_MAX_AGE = int(os.getenv('HTTP_CACHE_MAX_AGE', '0'))
+
+# Routes whose responses only depend on the request and the data version. /row_count is not one of
+# them: its counts are refreshed on a schedule of their own and it reports their age.
+CONDITIONAL_ROUTES = (
+    '/query1', '/query2', '/query3', '/query4', '/query5', '/query1_batch', '/query2_batch',
+)
+
+# Only safe requests are revalidated. A POST with If-None-Match runs the query like any other POST,
+# and its response gets no validators, since caches do not store POST responses for later GETs.
+CONDITIONAL_METHODS = ('GET', 'HEAD')
+
+
+# The parameters of a GET request to a query route, in the shape of the JSON body of a POST.
+# List parameters can be repeated or comma separated: ?sectors=Energy,Utilities
+def query_string_data(args):
+    data = {}
+    for name in args:
+        values = args.getlist(name)
+        if name == 'states' and values == ['all']:
+            data[name] = 'all'
+        elif name in UNORDERED_LIST_PARAMS:
+            data[name] = [item for value in values for item in value.split(',') if item]
+        elif name == 'profit_threshold':
+            try:
+                data[name] = float(values[-1])
+            except ValueError:
+                data[name] = values[-1]
+        elif name == 'max_points':
+            try:
+                data[name] = int(values[-1])
+            except ValueError:
+                data[name] = values[-1]
+        else:
+            data[name] = values[-1]
+    return data
+
+
+# Weak, since the same data can be written out differently (a streamed and a cached body). The
+# Accept header is part of it because the routes negotiate JSON, NDJSON, Arrow and MessagePack.
+def make_etag(loaded_at, route, data, accept):
+    key = "{}|{}|{}".format(loaded_at.isoformat(), make_key(route, data), accept or "")
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def is_not_modified(request, etag, loaded_at):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since is not None:
+        return loaded_at.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def set_validators(response, etag, loaded_at):
+    response.set_etag(etag, weak=True)
+    response.last_modified = loaded_at
+    response.vary.add('Accept')
+    response.headers['Cache-Control'] = (
+        "public, max-age={}".format(HTTP_CACHE_MAX_AGE) if HTTP_CACHE_MAX_AGE > 0 else "no-cache"
+    )
@@ -0,0 +1,554 @@
+import os
+import threading
+
+import duckdb
+
+from cache import parse_date
+from dataset import DATASET_TABLES, LOOKUP_TABLES, PHYSICIAN_CATEGORIES, SNAPSHOT_DIR, snapshot_modified_at
+from metrics import add_rows, stage
+
+# Local columnar backend (DATA_BACKEND=duckdb). The tables are read-only historical data, so a
+# Parquet snapshot of them (see snapshot.py) is loaded once into an in-process DuckDB database and
+# query1-query5 run against it with no network round trips and no session limits.
+
+# Rows per batch when reading results, the same setting as the Oracle fetch size
+BATCH_SIZE = int(os.getenv('DB_ARRAYSIZE', '1000'))
+
+_database = None
+_loaded_at = None
+_database_lock = threading.Lock()
+
+
+def snapshot_path(table_name):
+    return os.path.join(SNAPSHOT_DIR, table_name + '.parquet')
+
+
+def load_snapshot():
+    database = duckdb.connect(database=':memory:')
+    for table_name, _, _ in DATASET_TABLES + LOOKUP_TABLES:
+        path = snapshot_path(table_name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                "{} is missing. Run `python snapshot.py export` to write the snapshot.".format(path)
+            )
+        database.execute(
+            "CREATE TABLE {} AS SELECT * FROM read_parquet('{}')".format(table_name, path.replace("'", "''"))
+        )
+    print("Loaded snapshot from {}".format(SNAPSHOT_DIR))
+    return database
+
+
+# The snapshot is loaded on first use. A DuckDB connection must not be used by several threads at
+# once, so every query runs on its own cursor, which shares the loaded tables.
+def get_cursor():
+    global _database, _loaded_at
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                _loaded_at = snapshot_modified_at(DATASET_TABLES + LOOKUP_TABLES)
+                _database = load_snapshot()
+    return _database.cursor()
+
+
+def iter_query(query, binds):
+    cursor = get_cursor()
+    try:
+        with stage("execute"):
+            cursor.execute(query, binds)
+        while True:
+            with stage("fetch"):
+                rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            add_rows(len(rows))
+            yield rows
+    finally:
+        cursor.close()
+
+
+# start_date/end_date arrive as DD-MON-YY strings from the routes, or as datetimes from the range cache.
+def date_binds(start_date, end_date, binds=None):
+    binds = dict(binds or {})
+    for name, value in (("start_date", start_date), ("end_date", end_date)):
+        binds[name] = parse_date(value)
+        if binds[name] is None:
+            raise ValueError("Invalid {}: {}".format(name, value))
+    return binds
+
+
+# Alias of the monthly average of each query3 statistic
+SECTOR_STATISTIC_COLUMNS = {
+    "percent_in_profit": "percentOfCompaniesInProfit",
+    "median_return": "medianReturnPercent",
+    "breadth": "breadthPercent",
+}
+
+
+# Same as the Oracle STATE_FILTER, with the state names bound as a list
+STATE_FILTER = """SUBSTR({column}, 1, 5) IN (
+                SELECT state_code FROM code_to_state WHERE list_contains($input_states::VARCHAR[], state_name)
+            )"""
+
+
+def state_filter(column, input_states, keyword="AND"):
+    if input_states is None:
+        return ""
+    return keyword + " " + STATE_FILTER.format(column=column)
+
+
+def state_filter_binds(input_states, binds):
+    if input_states is not None:
+        binds["input_states"] = list(input_states)
+    return binds
+
+
+# Weekly infection rate vs mobility, computed the same way as the Oracle query1.
+def iter_query1_batches(input_states, start_date, end_date, mobility_types):
+    query = """WITH
+    DailyNewConfirmedPerState AS (
+        SELECT
+            date_key,
+            SUBSTR(location_key, 1, 5) AS state_code,
+            COALESCE(SUM(new_confirmed), 0) AS new_confirmed
+        FROM
+            us_epidemiology
+        WHERE
+            location_key LIKE 'US____%'
+            {state_filter}
+        GROUP BY
+            date_key, SUBSTR(location_key, 1, 5)
+    ),
+    DailyCurrentlyInfectedCountPerState AS (
+        SELECT
+            date_key,
+            state_code,
+            SUM(new_confirmed) OVER (PARTITION BY state_code ORDER BY date_key ROWS BETWEEN 13 PRECEDING AND CURRENT ROW) AS CurrentlyInfectedCount
+        FROM
+            DailyNewConfirmedPerState
+    ),
+    InfectionRatePerStatePerWeek AS (
+        SELECT
+            cic.state_code,
+            cic.date_key AS start_of_week,
+            ROUND((CurrentlyInfectedCount / population) * 100, 8) AS InfectionRatePerWeek
+        FROM
+            DailyCurrentlyInfectedCountPerState cic
+        JOIN
+            demographics demo ON cic.state_code = demo.location_key
+        WHERE
+            cic.date_key = DATE_TRUNC('week', cic.date_key)
+    ),
+    WeeklyMobilityInfoPerState AS (
+        SELECT
+            DATE_TRUNC('week', date_key) AS start_of_week,
+            SUBSTR(location_key, 1, 5) AS state_code{mobility_averages}
+        FROM
+            us_mobility
+        WHERE
+            location_key LIKE 'US____%'
+            {state_filter}
+        GROUP BY
+            DATE_TRUNC('week', date_key),
+            SUBSTR(location_key, 1, 5)
+    )
+    SELECT
+        mobi.start_of_week,
+        cts.state_name,
+        irpspw.InfectionRatePerWeek{mobility_columns}
+    FROM
+        InfectionRatePerStatePerWeek irpspw
+    JOIN
+        WeeklyMobilityInfoPerState mobi
+        ON irpspw.state_code = mobi.state_code
+            AND irpspw.start_of_week = mobi.start_of_week
+    JOIN
+        code_to_state cts
+        ON cts.state_code = irpspw.state_code
+    WHERE
+        mobi.start_of_week BETWEEN $start_date AND $end_date
+    ORDER BY mobi.state_code, mobi.start_of_week
+    """.format(
+        # mobility_types only ever holds names from MOBILITY_TYPES, never raw user input.
+        mobility_averages="".join(
+            ",\n            ROUND(AVG({0}), 4) AS {0}".format(mobility_type) for mobility_type in mobility_types
+        ),
+        mobility_columns="".join(",\n        mobi." + mobility_type for mobility_type in mobility_types),
+        state_filter=state_filter("location_key", input_states),
+    )
+
+    binds = state_filter_binds(input_states, date_binds(start_date, end_date))
+    yield from iter_query(query, binds)
+
+
+# Monthly vaccination search trends vs vaccination rate, computed the same way as the Oracle query2.
+def iter_query2_batches(input_states, start_date, end_date):
+    query = """
+    SELECT
+        searches.start_of_month,
+        cts.state_name,
+        avg_monthly_sni_covid19_vaccination,
+        avg_monthly_sni_vaccination_intent,
+        avg_monthly_sni_safety_side_effects,
+        vaccination_rate
+    FROM
+        (
+            SELECT
+                DATE_TRUNC('month', date_key) AS start_of_month,
+                SUBSTR(location_key, 1, 5) AS state_code,
+                ROUND(AVG(sni_covid19_vaccination), 4) AS avg_monthly_sni_covid19_vaccination,
+                ROUND(AVG(sni_vaccination_intent), 4) AS avg_monthly_sni_vaccination_intent,
+                ROUND(AVG(sni_safety_side_effects), 4) AS avg_monthly_sni_safety_side_effects
+            FROM
+                vaccination_search
+            WHERE
+                location_key LIKE 'US____%'
+                {search_state_filter}
+            GROUP BY
+                DATE_TRUNC('month', date_key), SUBSTR(location_key, 1, 5)
+        ) searches
+    JOIN
+        (
+            SELECT
+                vaccinations.start_of_month,
+                vaccinations.state_code,
+                ROUND(vaccinations.new_persons_vaccinated / demo.population, 8) AS vaccination_rate
+            FROM
+                (
+                    SELECT
+                        DATE_TRUNC('month', date_key) AS start_of_month,
+                        location_key AS state_code,
+                        ROUND(SUM(new_persons_vaccinated), 4) AS new_persons_vaccinated
+                    FROM
+                        us_vaccinations
+                    {vaccination_state_filter}
+                    GROUP BY
+                        DATE_TRUNC('month', date_key), location_key
+                ) vaccinations
+            JOIN
+                demographics demo ON vaccinations.state_code = demo.location_key
+        ) rates
+    ON searches.start_of_month = rates.start_of_month
+        AND searches.state_code = rates.state_code
+    JOIN code_to_state cts ON cts.state_code = searches.state_code
+    WHERE
+        searches.start_of_month BETWEEN $start_date AND $end_date
+    ORDER BY searches.state_code, searches.start_of_month
+    """.format(
+        search_state_filter=state_filter("location_key", input_states),
+        vaccination_state_filter=state_filter("location_key", input_states, keyword="WHERE"),
+    )
+
+    binds = state_filter_binds(input_states, date_binds(start_date, end_date))
+    yield from iter_query(query, binds)
+
+
+# Monthly testing rate for the whole US vs a statistic of the daily stock returns of each sector,
+# computed the same way as the Oracle query3.
+def iter_query3_batches(sectors, start_date, end_date, statistic="percent_in_profit", profit_threshold=0):
+    query = """
+    WITH NoOfCompaniesPerSector AS (
+        SELECT
+            sector,
+            COUNT(ticker) AS noOfCompaniesInSector
+        FROM
+            snp500_company_info
+        GROUP BY
+            sector
+    ),
+    DailyStockInfoPerSector AS (
+        SELECT
+            date_key,
+            sector,
+            COUNT(CASE WHEN profit_or_loss_percent >= $profit_threshold THEN 1 END) AS noOfCompaniesInProfitInSector,
+            MEDIAN(profit_or_loss_percent) AS medianReturnPercent,
+            (COUNT(CASE WHEN profit_or_loss_percent > 0 THEN 1 END) - COUNT(CASE WHEN profit_or_loss_percent < 0 THEN 1 END))
+                / NULLIF(COUNT(profit_or_loss_percent), 0) * 100 AS breadthPercent
+        FROM (
+            SELECT
+                date_key,
+                info.sector,
+                ROUND((("close" - "open") / "open") * 100, 4) AS profit_or_loss_percent
+            FROM
+                snp500
+                JOIN snp500_company_info info ON snp500.ticker = info.ticker
+            WHERE
+                list_contains($sectors::VARCHAR[], info.sector)
+                AND date_key >= DATE_TRUNC('month', $start_date)
+                AND date_key < DATE_TRUNC('month', $end_date) + INTERVAL 1 MONTH
+        ) StockPriceWithSector
+        GROUP BY
+            date_key, sector
+    ),
+    MonthlyStockInfoPerSector AS (
+        SELECT
+            DATE_TRUNC('month', date_key) AS start_of_month,
+            dailyInfo.sector,
+            ROUND(AVG(CASE WHEN noOfCompaniesInProfitInSector > 0 THEN (noOfCompaniesInProfitInSector / noOfCompaniesInSector) * 100 END), 4) AS percentOfCompaniesInProfit,
+            ROUND(AVG(medianReturnPercent), 4) AS medianReturnPercent,
+            ROUND(AVG(breadthPercent), 4) AS breadthPercent
+        FROM
+            DailyStockInfoPerSector dailyInfo
+            JOIN NoOfCompaniesPerSector sectorCount ON dailyInfo.sector = sectorCount.sector
+        GROUP BY
+            DATE_TRUNC('month', date_key), dailyInfo.sector
+    ),
+    PerMonthTestingInfoWholeUS AS (
+        SELECT
+            DATE_TRUNC('month', date_key) AS start_of_month,
+            ROUND(AVG(no_of_tested_per_100000), 5) AS no_of_tested_per_100000
+        FROM
+            (
+                SELECT
+                    date_key,
+                    COALESCE(100000 * new_tested / population, 0) AS no_of_tested_per_100000
+                FROM
+                    us_epidemiology epi
+                    JOIN demographics demo ON demo.location_key = epi.location_key
+                WHERE
+                    epi.location_key LIKE 'US___' AND date_key BETWEEN $start_date AND $end_date
+            ) PerDayTestingInfoWholeUS
+        GROUP BY
+            DATE_TRUNC('month', date_key)
+    )
+    SELECT
+        stockTab.start_of_month,
+        no_of_tested_per_100000,
+        {statistic_column},
+        sector
+    FROM
+        MonthlyStockInfoPerSector stockTab
+        JOIN PerMonthTestingInfoWholeUS testingTab ON stockTab.start_of_month = testingTab.start_of_month
+    ORDER BY stockTab.start_of_month, sector
+    """.format(statistic_column=SECTOR_STATISTIC_COLUMNS[statistic])
+
+    binds = {"sectors": list(sectors), "profit_threshold": profit_threshold}
+    yield from iter_query(query, date_binds(start_date, end_date, binds))
+
+
+# Monthly ratio of deaths to newly hospitalized patients per physician category,
+# computed the same way as the Oracle query4.
+def iter_query4_batches(physician_categories, start_date, end_date):
+    query = """
+    WITH
+    DailyHospitalizationInfoPerState AS (
+        (
+            SELECT
+                date_key,
+                location_key AS state_code,
+                new_hospitalized_patients
+            FROM
+                hospitalizations
+            WHERE
+                location_key LIKE 'US___'
+        )
+        EXCEPT
+        -- Get rid of US_NY values as they are incomplete
+        (
+            SELECT
+                date_key,
+                location_key,
+                new_hospitalized_patients
+            FROM
+                hospitalizations
+            WHERE
+                location_key LIKE 'US_NY'
+        )
+        UNION
+        -- Sum up county data for NY
+        (
+            SELECT
+                date_key,
+                SUBSTR(location_key, 1, 5) AS state_code,
+                SUM(new_hospitalized_patients) AS new_hospitalized_patients
+            FROM
+                hospitalizations
+            WHERE
+                location_key LIKE 'US_NY_%'
+            GROUP BY
+                date_key,
+                SUBSTR(location_key, 1, 5)
+        )
+    ),
+    MonthlyHospitalizationInfoPerState AS (
+        SELECT
+            DATE_TRUNC('month', date_key) AS start_of_month,
+            state_code,
+            SUM(new_hospitalized_patients) AS new_hospitalized_patients
+        FROM DailyHospitalizationInfoPerState
+        GROUP BY
+            DATE_TRUNC('month', date_key), state_code
+    ),
+    MonthlyDeceasedPerState AS (
+        SELECT
+            DATE_TRUNC('month', date_key) AS start_of_month,
+            SUBSTR(location_key, 1, 5) AS state_code,
+            SUM(new_deceased) AS new_deceased
+        FROM
+            us_epidemiology
+        WHERE
+            location_key LIKE 'US____%'
+        GROUP BY
+            DATE_TRUNC('month', date_key), SUBSTR(location_key, 1, 5)
+    ),
+    RatioOfDeathsToHospitalizedPeoplePerMonthPerState AS (
+        SELECT
+            monthlyHosp.start_of_month,
+            monthlyHosp.state_code,
+            (new_deceased / NULLIF(new_hospitalized_patients, 0)) AS ratio_of_deaths
+        FROM
+            MonthlyHospitalizationInfoPerState monthlyHosp
+        JOIN
+            MonthlyDeceasedPerState
+        ON
+            monthlyHosp.start_of_month = MonthlyDeceasedPerState.start_of_month
+            AND monthlyHosp.state_code = MonthlyDeceasedPerState.state_code
+        WHERE
+            monthlyHosp.start_of_month BETWEEN $start_date AND $end_date
+    ),
+    StateCategoryByNoOfPhysicians AS (
+        SELECT
+            location_key AS state_code,
+            physicians_per_100000,
+            CASE
+                WHEN physicians_per_100000 < 200 THEN 'Low (<200)'
+                WHEN physicians_per_100000 >= 200 AND physicians_per_100000 < 300 THEN 'Decent (200-300)'
+                WHEN physicians_per_100000 >= 300 AND physicians_per_100000 < 400 THEN 'Good (300-400)'
+                WHEN physicians_per_100000 >= 400 THEN 'Very good (>400)'
+                ELSE 'Unknown'
+            END AS physician_category
+        FROM
+            health_stats
+        WHERE
+            location_key LIKE 'US___'
+    )
+    SELECT
+        deathsToHosp.start_of_month,
+        physician_category,
+        GREATEST(COALESCE(ROUND(AVG(deathsToHosp.ratio_of_deaths), 8), 0), 0) AS AvgRatioOfDeathsToHospitalizedPeople
+    FROM
+        RatioOfDeathsToHospitalizedPeoplePerMonthPerState deathsToHosp
+    JOIN
+        StateCategoryByNoOfPhysicians phy ON deathsToHosp.state_code = phy.state_code
+    JOIN
+        code_to_state ON code_to_state.state_code = phy.state_code
+    WHERE list_contains($physician_categories::VARCHAR[], physician_category)
+    GROUP BY
+        start_of_month, physician_category
+    ORDER BY start_of_month, physician_category
+    """
+
+    binds = {"physician_categories": list(physician_categories or PHYSICIAN_CATEGORIES)}
+    yield from iter_query(query, date_binds(start_date, end_date, binds))
+
+
+# Monthly mortality rate vs stringency categories for one ruling party,
+# computed the same way as the Oracle query5.
+def iter_query5_batches(party, start_date, end_date):
+    query = """
+    WITH MonthlyStringencyPerState AS (
+        SELECT
+            DATE_TRUNC('month', date_key) AS start_of_month,
+            location_key AS state_code,
+            ROUND(AVG(stringency_index), 4) AS monthly_avg_stringency_index
+        FROM government_responses
+        WHERE location_key LIKE 'US___'
+        GROUP BY DATE_TRUNC('month', date_key), location_key
+    ),
+    MonthlyStringencyPerStateWithCategory AS (
+        SELECT
+            start_of_month,
+            state_code,
+            monthly_avg_stringency_index,
+            CASE
+                WHEN monthly_avg_stringency_index < 20 THEN '0-19'
+                WHEN monthly_avg_stringency_index >= 20 AND monthly_avg_stringency_index < 40 THEN '20-39'
+                WHEN monthly_avg_stringency_index >= 40 AND monthly_avg_stringency_index < 60 THEN '40-59'
+                WHEN monthly_avg_stringency_index >= 60 AND monthly_avg_stringency_index < 80 THEN '60-79'
+                WHEN monthly_avg_stringency_index >= 80 AND monthly_avg_stringency_index < 100 THEN '80-100'
+                ELSE 'Unknown'
+            END AS stringency_category
+        FROM MonthlyStringencyPerState
+    ),
+    NoOfStatesInEachStringencyCategoryPerParty AS (
+        SELECT
+            start_of_month,
+            ruling_party,
+            stringency_category,
+            COUNT(monStrin.state_code) AS noOfStatesInCategory
+        FROM MonthlyStringencyPerStateWithCategory monStrin
+        JOIN code_to_state ON code_to_state.state_code = monStrin.state_code
+        GROUP BY start_of_month, ruling_party, stringency_category
+    ),
+    MonthlyDeceasedPerState AS (
+        SELECT
+            DATE_TRUNC('month', date_key) AS start_of_month,
+            location_key AS state_code,
+            SUM(new_deceased) AS monthly_avg_deceased
+        FROM us_epidemiology
+        WHERE location_key LIKE 'US___'
+        GROUP BY DATE_TRUNC('month', date_key), location_key
+    ),
+    MortalityRatePerMonthPerRulingParty AS (
+        SELECT
+            start_of_month,
+            ruling_party,
+            AVG(GREATEST(ROUND(monthly_avg_deceased * 100000 / population, 8), 0)) AS mortality_rate_100000
+        FROM
+            MonthlyDeceasedPerState
+            JOIN demographics ON MonthlyDeceasedPerState.state_code = demographics.location_key
+            JOIN code_to_state ON code_to_state.state_code = demographics.location_key
+        GROUP BY start_of_month, ruling_party
+    )
+    SELECT
+        mor.start_of_month,
+        stringency_category,
+        noOfStatesInCategory,
+        ROUND(mortality_rate_100000, 8) AS mortality_rate_100000
+    FROM
+        NoOfStatesInEachStringencyCategoryPerParty strinCat
+    JOIN MortalityRatePerMonthPerRulingParty mor ON mor.start_of_month = strinCat.start_of_month AND mor.ruling_party = strinCat.ruling_party
+    WHERE mor.start_of_month BETWEEN $start_date AND $end_date AND mor.ruling_party = $party
+    ORDER BY mor.start_of_month, mor.ruling_party, stringency_category
+    """
+
+    yield from iter_query(query, date_binds(start_date, end_date, {"party": party}))
+
+
+def exact_row_counts():
+    query = "SELECT {}".format(
+        ", ".join("(SELECT COUNT(*) FROM {})".format(table_name) for table_name, _, _ in DATASET_TABLES)
+    )
+    cursor = get_cursor()
+    try:
+        result = cursor.execute(query).fetchone()
+    finally:
+        cursor.close()
+
+    counts = {key: result[i] for i, (key, _, _) in enumerate(DATASET_TABLES)}
+    counts["total_row_count"] = sum(result)
+    return counts
+
+
+# The snapshot never changes while it is loaded, so its counts are exact as of when it was exported.
+def statistics_row_counts():
+    return exact_row_counts(), snapshot_modified_at(DATASET_TABLES)
+
+
+# The data is as of when the loaded snapshot was exported. A newer export is only read on restart.
+def last_loaded_at():
+    get_cursor().close()
+    return _loaded_at
+
+
+def state_dimensions():
+    query = """
+    SELECT cts.state_code, cts.state_name, cts.ruling_party, demo.population, hs.physicians_per_100000
+    FROM code_to_state cts
+    LEFT JOIN demographics demo ON demo.location_key = cts.state_code
+    LEFT JOIN health_stats hs ON hs.location_key = cts.state_code
+    """
+    cursor = get_cursor()
+    try:
+        return cursor.execute(query).fetchall()
+    finally:
+        cursor.close()
@@ -0,0 +1,502 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from cache import parse_date
+from dataset import DATASET_TABLES, LOOKUP_TABLES, MOBILITY_TYPES, PHYSICIAN_CATEGORIES, SNAPSHOT_DIR, snapshot_modified_at
+from metrics import add_rows, stage
+
+# In-memory backend (DATA_BACKEND=memory). The base series of the Parquet snapshot (see snapshot.py)
+# are loaded once into state x day matrices, and every query result that does not depend on the
+# requested range is computed for all states and all dates in one vectorized pass. A request then
+# only filters precomputed rows, and a batch export of every state is a single slice.
+
+# Rows per batch when reading results, the same setting as the Oracle fetch size
+BATCH_SIZE = int(os.getenv('DB_ARRAYSIZE', '1000'))
+
+SNI_COLUMNS = ("sni_covid19_vaccination", "sni_vaccination_intent", "sni_safety_side_effects")
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def snapshot_path(table_name):
+    return os.path.join(SNAPSHOT_DIR, table_name + '.parquet')
+
+
+def read_table(table_name, columns):
+    path = snapshot_path(table_name)
+    if not os.path.exists(path):
+        raise FileNotFoundError("{} is missing. Run `python snapshot.py export` to write the snapshot.".format(path))
+    frame = pd.read_parquet(path, columns=columns)
+    if "date_key" in frame:
+        frame["date_key"] = pd.to_datetime(frame["date_key"]).dt.normalize()
+    return frame
+
+
+# location_key LIKE 'US___'
+def state_level(frame):
+    keys = frame["location_key"]
+    return frame[keys.str.startswith("US") & (keys.str.len() == 5)]
+
+
+# location_key LIKE 'US____%'
+def county_level(frame):
+    keys = frame["location_key"]
+    return frame[keys.str.startswith("US") & (keys.str.len() >= 6)]
+
+
+# Every day between the first and the last date of the snapshot, and the weeks (starting on
+# Monday, like TRUNC(date, 'IW')) and months they fall in.
+class Calendar:
+    def __init__(self, first_day, last_day):
+        self.days = pd.date_range(first_day, last_day, freq="D")
+        self.week_starts, self.week_bounds = self._periods(self.days - pd.to_timedelta(self.days.dayofweek, unit="D"))
+        self.month_starts, self.month_bounds = self._periods(self.days.to_period("M").to_timestamp())
+
+    # Start date of every period and the index of its first day
+    @staticmethod
+    def _periods(period_of_day):
+        values = period_of_day.values
+        bounds = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+        return period_of_day[bounds], bounds
+
+    def day_index(self, dates):
+        return ((dates.values - self.days[0].to_datetime64()) // np.timedelta64(1, "D")).astype(np.int64)
+
+    # Sum a key x day matrix over the days of each week or month
+    def per_week(self, matrix):
+        return np.add.reduceat(matrix, self.week_bounds, axis=-1)
+
+    def per_month(self, matrix):
+        return np.add.reduceat(matrix, self.month_bounds, axis=-1)
+
+
+# SUM, COUNT and COUNT(*) of values grouped by (key, day), as key x day matrices. Rows whose key is
+# not on the axis (key_index -1) are dropped, like an inner join on the key.
+def accumulate(key_index, day_index, values, shape):
+    keep = key_index >= 0
+    flat = key_index[keep] * shape[1] + day_index[keep]
+    values = np.asarray(values, dtype=float)[keep]
+    present = ~np.isnan(values)
+    size = shape[0] * shape[1]
+    sums = np.bincount(flat, weights=np.where(present, values, 0), minlength=size).reshape(shape)
+    counts = np.bincount(flat[present], minlength=size).reshape(shape)
+    rows = np.bincount(flat, minlength=size).reshape(shape)
+    return sums, counts, rows
+
+
+# SUM / COUNT with SQL NULL semantics: NaN where no value was summed
+def null_if_empty(sums, counts):
+    return np.where(counts > 0, sums, np.nan)
+
+
+def average(sums, counts):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+# GREATEST(x, 0), which is NULL when x is NULL
+def greatest_zero(values):
+    return np.where(np.isnan(values), np.nan, np.maximum(values, 0))
+
+
+def stringency_category(values):
+    return np.select(
+        [values < 20, values < 40, values < 60, values < 80, values < 100],
+        ["0-19", "20-39", "40-59", "60-79", "80-100"],
+        default="Unknown",
+    )
+
+
+def physician_category(values):
+    return np.select(
+        [values < 200, values < 300, values < 400, values >= 400],
+        PHYSICIAN_CATEGORIES,
+        default="Unknown",
+    )
+
+
+class Engine:
+    def __init__(self):
+        self.loaded_at = snapshot_modified_at(DATASET_TABLES + LOOKUP_TABLES)
+        states = read_table("code_to_state", ["state_code", "state_name", "ruling_party"])
+        states = states.drop_duplicates("state_code").sort_values("state_code")
+        self.state_codes = states["state_code"].to_numpy()
+        self.state_names = states["state_name"].to_numpy()
+        self.ruling_parties = states["ruling_party"].to_numpy()
+
+        demographics = read_table("demographics", ["location_key", "population"]).drop_duplicates("location_key")
+        self.population = demographics.set_index("location_key")["population"].reindex(self.state_codes).to_numpy(float)
+        self.population_by_key = demographics
+
+        self.epidemiology = read_table("us_epidemiology", ["date_key", "location_key", "new_confirmed", "new_deceased", "new_tested"])
+        self.mobility = read_table("us_mobility", ["date_key", "location_key"] + list(MOBILITY_TYPES))
+        self.searches = read_table("vaccination_search", ["date_key", "location_key"] + list(SNI_COLUMNS))
+        self.vaccinations = read_table("us_vaccinations", ["date_key", "location_key", "new_persons_vaccinated"])
+        self.hospitalizations = read_table("hospitalizations", ["date_key", "location_key", "new_hospitalized_patients"])
+        self.responses = read_table("government_responses", ["date_key", "location_key", "stringency_index"])
+        self.prices = read_table("snp500", ["date_key", "ticker", "open", "close"])
+        self.companies = read_table("snp500_company_info", ["ticker", "sector"])
+        self.health_stats = read_table("health_stats", ["location_key", "physicians_per_100000"])
+
+        series = (self.epidemiology, self.mobility, self.searches, self.vaccinations,
+                  self.hospitalizations, self.responses, self.prices)
+        self.calendar = Calendar(
+            min(frame["date_key"].min() for frame in series), max(frame["date_key"].max() for frame in series)
+        )
+
+        self.query1 = self.build_query1()
+        self.query2 = self.build_query2()
+        self.build_query3_series()
+        self.query4 = self.build_query4()
+        self.query5 = self.build_query5()
+        self.state_dimensions = self.build_state_dimensions()
+
+        # The raw rows are not needed once the results are built
+        del self.epidemiology, self.mobility, self.searches, self.vaccinations
+        del self.hospitalizations, self.responses, self.prices, self.companies, self.health_stats
+        print("Loaded snapshot from {} into memory".format(SNAPSHOT_DIR))
+
+    # Rows of code_to_state with the population and physicians per 100000 of each state, None where
+    # a state has none (see dimensions.py)
+    def build_state_dimensions(self):
+        physicians = self.health_stats.drop_duplicates("location_key").set_index("location_key")["physicians_per_100000"]
+        physicians = physicians.reindex(self.state_codes).to_numpy(float)
+        return [
+            (code, name, party, None if np.isnan(population) else population, None if np.isnan(physician) else physician)
+            for code, name, party, population, physician
+            in zip(self.state_codes, self.state_names, self.ruling_parties, self.population, physicians)
+        ]
+
+    # State x day matrices of the given columns. The state is the first 5 characters of location_key.
+    def state_day(self, frame, columns):
+        key_index = pd.Categorical(frame["location_key"].str[:5], categories=self.state_codes).codes.astype(np.int64)
+        day_index = self.calendar.day_index(frame["date_key"])
+        shape = (len(self.state_codes), len(self.calendar.days))
+        return {column: accumulate(key_index, day_index, frame[column].to_numpy(float), shape) for column in columns}
+
+    def state_rows(self, state_index, period_index, period_starts, columns):
+        data = {"start_of_period": period_starts[period_index], "state_code": self.state_codes[state_index]}
+        data.update(columns)
+        return pd.DataFrame(data)
+
+    # Weekly infection rate vs mobility for every state and week.
+    # 1. Sum the daily new_confirmed of the counties of each state.
+    # 2. Currently infected = rolling 14 day sum. The day axis has no gaps, so days without any rows
+    #    count as 0 here, where the SQL window counts rows.
+    # 3. Keep the value on the Monday of each week and divide by the state population.
+    # 4. Average every mobility series over the county rows of each state and week.
+    # 5. Keep the weeks that have both, like the join in the SQL.
+    def build_query1(self):
+        calendar = self.calendar
+        confirmed_sums, _, confirmed_rows = self.state_day(county_level(self.epidemiology), ["new_confirmed"])["new_confirmed"]
+        cumulative = np.cumsum(confirmed_sums, axis=1)
+        currently_infected = cumulative.copy()
+        currently_infected[:, 14:] -= cumulative[:, :-14]
+
+        mondays = calendar.day_index(calendar.week_starts)
+        on_axis = mondays >= 0
+        monday_index = np.where(on_axis, mondays, 0)
+        infected = np.where(on_axis, currently_infected[:, monday_index], np.nan)
+        has_monday_row = on_axis & (confirmed_rows[:, monday_index] > 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            infection_rate = np.round(infected / self.population[:, None] * 100, 8)
+
+        mobility = self.state_day(county_level(self.mobility), MOBILITY_TYPES)
+        weekly_rows = calendar.per_week(mobility[MOBILITY_TYPES[0]][2])
+        averages = {
+            mobility_type: np.round(average(calendar.per_week(sums), calendar.per_week(counts)), 4)
+            for mobility_type, (sums, counts, _) in mobility.items()
+        }
+
+        valid = has_monday_row & ~np.isnan(self.population)[:, None] & (weekly_rows > 0)
+        state_index, week_index = np.nonzero(valid)
+        columns = {"state_name": self.state_names[state_index], "infection_rate": infection_rate[state_index, week_index]}
+        columns.update((m, averages[m][state_index, week_index]) for m in MOBILITY_TYPES)
+        return self.state_rows(state_index, week_index, calendar.week_starts, columns)
+
+    # Monthly vaccination search averages vs vaccination rate for every state and month.
+    def build_query2(self):
+        calendar = self.calendar
+        searches = self.state_day(county_level(self.searches), SNI_COLUMNS)
+        search_rows = calendar.per_month(searches[SNI_COLUMNS[0]][2])
+        search_averages = {
+            column: np.round(average(calendar.per_month(sums), calendar.per_month(counts)), 4)
+            for column, (sums, counts, _) in searches.items()
+        }
+
+        # us_vaccinations is joined on the full location_key, so only state level rows count
+        vaccinations = self.vaccinations[self.vaccinations["location_key"].str.len() == 5]
+        sums, counts, rows = self.state_day(vaccinations, ["new_persons_vaccinated"])["new_persons_vaccinated"]
+        vaccinated = np.round(null_if_empty(calendar.per_month(sums), calendar.per_month(counts)), 4)
+        vaccination_rows = calendar.per_month(rows)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            vaccination_rate = np.round(vaccinated / self.population[:, None], 8)
+
+        valid = (search_rows > 0) & (vaccination_rows > 0) & ~np.isnan(self.population)[:, None]
+        state_index, month_index = np.nonzero(valid)
+        columns = {"state_name": self.state_names[state_index]}
+        columns.update(
+            ("avg_monthly_" + column, search_averages[column][state_index, month_index]) for column in SNI_COLUMNS
+        )
+        columns["vaccination_rate"] = vaccination_rate[state_index, month_index]
+        return self.state_rows(state_index, month_index, calendar.month_starts, columns)
+
+    # query3 averages the testing rate over the requested days only, so it keeps daily series:
+    # the testing rate per day, and per sector the monthly value of every statistic in
+    # SECTOR_STATISTICS. The daily return of every price row is kept as well, to count the
+    # companies in profit at thresholds other than 0.
+    def build_query3_series(self):
+        calendar = self.calendar
+        companies = self.companies.dropna(subset=["sector"])
+        self.sectors = np.sort(companies["sector"].unique())
+        self.companies_per_sector = companies.groupby("sector")["ticker"].count().reindex(self.sectors).to_numpy(float)
+
+        prices = self.prices.merge(companies, on="ticker")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.returns = np.round((prices["close"] - prices["open"]) / prices["open"] * 100, 4).to_numpy(float)
+        self.return_sector_index = pd.Categorical(prices["sector"], categories=self.sectors).codes.astype(np.int64)
+        self.return_day_index = calendar.day_index(prices["date_key"])
+
+        # A (sector, month) row exists when the sector has prices on any day of the month
+        self.sector_months = calendar.per_month(self.count_companies(np.ones(len(prices), dtype=bool))) > 0
+
+        with np.errstate(invalid="ignore"):
+            traded = self.count_companies(~np.isnan(self.returns))
+            advancing = self.count_companies(self.returns > 0) - self.count_companies(self.returns < 0)
+        breadth = average(advancing * 100, traded)
+
+        medians = np.full(traded.shape, np.nan)
+        has_return = ~np.isnan(self.returns)
+        daily_medians = pd.Series(self.returns[has_return]).groupby(
+            [self.return_sector_index[has_return], self.return_day_index[has_return]]
+        ).median()
+        medians[daily_medians.index.get_level_values(0), daily_medians.index.get_level_values(1)] = daily_medians.to_numpy()
+
+        self.sector_statistics = {
+            "percent_in_profit": self.profit_percent(0),
+            "median_return": self.monthly_average(medians),
+            "breadth": self.monthly_average(breadth),
+        }
+
+        testing = state_level(self.epidemiology).merge(self.population_by_key, on="location_key")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            tested = (100000 * testing["new_tested"] / testing["population"]).fillna(0).to_numpy(float)
+        days = calendar.day_index(testing["date_key"])
+        self.tested_per_day = np.bincount(days, weights=tested, minlength=len(calendar.days))
+        self.testing_rows_per_day = np.bincount(days, minlength=len(calendar.days))
+
+    # Number of price rows per sector and day for which selected is true, as a sector x day matrix
+    def count_companies(self, selected):
+        days = len(self.calendar.days)
+        flat = self.return_sector_index[selected] * days + self.return_day_index[selected]
+        return np.bincount(flat, minlength=len(self.sectors) * days).reshape(len(self.sectors), days)
+
+    # Monthly percentage of companies with a return of at least profit_threshold. Days on which no
+    # company of a sector reached it have no row in the SQL, so they are left out of the average.
+    def profit_percent(self, profit_threshold):
+        with np.errstate(invalid="ignore"):
+            in_profit = self.count_companies(self.returns >= profit_threshold)
+        percent = in_profit / self.companies_per_sector[:, None] * 100
+        return self.monthly_average(np.where(in_profit > 0, percent, np.nan))
+
+    # AVG over the days of each month of a sector x day matrix, ignoring NULLs, rounded like the SQL
+    def monthly_average(self, daily):
+        present = ~np.isnan(daily)
+        calendar = self.calendar
+        return np.round(average(calendar.per_month(np.where(present, daily, 0)), calendar.per_month(present.astype(int))), 4)
+
+    # Monthly ratio of deaths to newly hospitalized patients, averaged over the states of each
+    # physician category.
+    def build_query4(self):
+        calendar = self.calendar
+        hospitalizations = self.hospitalizations
+        states = state_level(hospitalizations)
+        # State rows, with New York replaced by the sum of its counties
+        daily = pd.concat([
+            states[states["location_key"] != "US_NY"],
+            hospitalizations[hospitalizations["location_key"].str.startswith("US_NY_")],
+        ])
+        sums, counts, rows = self.state_day(daily, ["new_hospitalized_patients"])["new_hospitalized_patients"]
+        hospitalized = null_if_empty(calendar.per_month(sums), calendar.per_month(counts))
+        hospitalized_rows = calendar.per_month(rows)
+
+        sums, counts, rows = self.state_day(county_level(self.epidemiology), ["new_deceased"])["new_deceased"]
+        deceased = null_if_empty(calendar.per_month(sums), calendar.per_month(counts))
+        deceased_rows = calendar.per_month(rows)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ratio = np.where(hospitalized == 0, np.nan, deceased / hospitalized)
+
+        health_stats = state_level(self.health_stats).drop_duplicates("location_key").set_index("location_key")
+        categories = physician_category(health_stats["physicians_per_100000"].reindex(self.state_codes).to_numpy(float))
+        category_names = np.unique(categories)
+
+        # One row per category and one column per state, so that the per-category sums are matrix products
+        membership = (category_names[:, None] == categories[None, :]) & np.isin(self.state_codes, health_stats.index)
+        exists = (hospitalized_rows > 0) & (deceased_rows > 0)
+        has_ratio = exists & ~np.isnan(ratio)
+        ratio_sums = membership.astype(float) @ np.where(has_ratio, ratio, 0)
+        ratio_counts = membership.astype(float) @ has_ratio
+        category_rows = membership.astype(float) @ exists
+        average_ratio = greatest_zero(np.nan_to_num(np.round(average(ratio_sums, ratio_counts), 8), nan=0.0))
+
+        category_index, month_index = np.nonzero(category_rows > 0)
+        result = pd.DataFrame({
+            "start_of_month": calendar.month_starts[month_index],
+            "physician_category": category_names[category_index],
+            "avg_ratio": average_ratio[category_index, month_index],
+        })
+        return result.sort_values(["start_of_month", "physician_category"], ignore_index=True)
+
+    # Monthly number of states per stringency category and mortality rate, per ruling party.
+    def build_query5(self):
+        calendar = self.calendar
+        sums, counts, rows = self.state_day(state_level(self.responses), ["stringency_index"])["stringency_index"]
+        stringency = np.round(average(calendar.per_month(sums), calendar.per_month(counts)), 4)
+        state_index, month_index = np.nonzero(calendar.per_month(rows) > 0)
+        states_per_category = pd.DataFrame({
+            "start_of_month": calendar.month_starts[month_index],
+            "ruling_party": self.ruling_parties[state_index],
+            "stringency_category": stringency_category(stringency[state_index, month_index]),
+        }).groupby(["start_of_month", "ruling_party", "stringency_category"]).size().rename("states").reset_index()
+
+        sums, counts, rows = self.state_day(state_level(self.epidemiology), ["new_deceased"])["new_deceased"]
+        deceased = null_if_empty(calendar.per_month(sums), calendar.per_month(counts))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mortality = greatest_zero(np.round(deceased * 100000 / self.population[:, None], 8))
+        exists = (calendar.per_month(rows) > 0) & ~np.isnan(self.population)[:, None]
+        state_index, month_index = np.nonzero(exists)
+        mortality_per_party = pd.DataFrame({
+            "start_of_month": calendar.month_starts[month_index],
+            "ruling_party": self.ruling_parties[state_index],
+            "mortality_rate": mortality[state_index, month_index],
+        }).groupby(["start_of_month", "ruling_party"])["mortality_rate"].mean().round(8).reset_index()
+
+        result = states_per_category.merge(mortality_per_party, on=["start_of_month", "ruling_party"])
+        return result.sort_values(["start_of_month", "ruling_party", "stringency_category"], ignore_index=True)
+
+
+# The snapshot is loaded and the results are computed on first use.
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = Engine()
+    return _engine
+
+
+def date_range(start_date, end_date):
+    start = parse_date(start_date)
+    end = parse_date(end_date)
+    if start is None or end is None:
+        raise ValueError("Invalid date range: {} - {}".format(start_date, end_date))
+    return start, end
+
+
+# Yield the rows of a result frame in batches of tuples, with NaN as None like a NULL from the database.
+def iter_rows(frame):
+    for start in range(0, len(frame), BATCH_SIZE):
+        with stage("fetch"):
+            batch = frame.iloc[start:start + BATCH_SIZE].astype(object)
+            rows = list(batch.where(batch.notna(), None).itertuples(index=False, name=None))
+        add_rows(len(rows))
+        yield rows
+
+
+def select_rows(frame, start_date, end_date, mask=None):
+    start, end = date_range(start_date, end_date)
+    in_range = (frame["start_of_period"] >= start) & (frame["start_of_period"] <= end)
+    return frame[in_range if mask is None else in_range & mask]
+
+
+def iter_query1_batches(input_states, start_date, end_date, mobility_types):
+    engine = get_engine()
+    with stage("execute"):
+        frame = engine.query1
+        mask = None if input_states is None else frame["state_name"].isin(input_states)
+        frame = select_rows(frame, start_date, end_date, mask)
+        frame = frame[["start_of_period", "state_name", "infection_rate"] + list(mobility_types)]
+    yield from iter_rows(frame)
+
+
+def iter_query2_batches(input_states, start_date, end_date):
+    engine = get_engine()
+    with stage("execute"):
+        frame = engine.query2
+        mask = None if input_states is None else frame["state_name"].isin(input_states)
+        frame = select_rows(frame, start_date, end_date, mask).drop(columns="state_code")
+    yield from iter_rows(frame)
+
+
+def iter_query3_batches(sectors, start_date, end_date, statistic="percent_in_profit", profit_threshold=0):
+    engine = get_engine()
+    calendar = engine.calendar
+    with stage("execute"):
+        start, end = date_range(start_date, end_date)
+        in_range = (calendar.days >= start) & (calendar.days <= end)
+        testing_rows = calendar.per_month(np.where(in_range, engine.testing_rows_per_day, 0))
+        tested = np.round(average(calendar.per_month(np.where(in_range, engine.tested_per_day, 0)), testing_rows), 5)
+
+        if statistic == "percent_in_profit" and profit_threshold != 0:
+            values = engine.profit_percent(profit_threshold)
+        else:
+            values = engine.sector_statistics[statistic]
+        sector_index = np.flatnonzero(np.isin(engine.sectors, list(sectors)))
+        month_index, selected = np.nonzero(((testing_rows > 0)[None, :] & engine.sector_months[sector_index]).T)
+        frame = pd.DataFrame({
+            "start_of_month": calendar.month_starts[month_index],
+            "tested_per_100000": tested[month_index],
+            statistic: values[sector_index][selected, month_index],
+            "sector": engine.sectors[sector_index[selected]],
+        })
+    yield from iter_rows(frame)
+
+
+def iter_query4_batches(physician_categories, start_date, end_date):
+    engine = get_engine()
+    with stage("execute"):
+        start, end = date_range(start_date, end_date)
+        frame = engine.query4
+        frame = frame[
+            (frame["start_of_month"] >= start) & (frame["start_of_month"] <= end)
+            & frame["physician_category"].isin(physician_categories or PHYSICIAN_CATEGORIES)
+        ]
+    yield from iter_rows(frame)
+
+
+def iter_query5_batches(party, start_date, end_date):
+    engine = get_engine()
+    with stage("execute"):
+        start, end = date_range(start_date, end_date)
+        frame = engine.query5
+        frame = frame[
+            (frame["start_of_month"] >= start) & (frame["start_of_month"] <= end) & (frame["ruling_party"] == party)
+        ]
+        frame = frame[["start_of_month", "stringency_category", "states", "mortality_rate"]]
+    yield from iter_rows(frame)
+
+
+# Row counts are read from the Parquet footers, so they need no data to be loaded.
+def exact_row_counts():
+    counts = {key: pq.ParquetFile(snapshot_path(key)).metadata.num_rows for key, _, _ in DATASET_TABLES}
+    counts["total_row_count"] = sum(counts.values())
+    return counts
+
+
+def statistics_row_counts():
+    return exact_row_counts(), snapshot_modified_at(DATASET_TABLES)
+
+
+# The results are as of when the loaded snapshot was exported. A newer export is only read on restart.
+def last_loaded_at():
+    return get_engine().loaded_at
+
+
+def state_dimensions():
+    return get_engine().state_dimensions
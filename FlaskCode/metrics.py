@@ -0,0 +1,135 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Histogram buckets for stage durations (seconds), result sizes (rows) and response sizes (bytes)
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROW_BUCKETS = (0, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+BYTE_BUCKETS = (1000, 10000, 50000, 100000, 500000, 1000000, 5000000, 10000000, 50000000)
+
+# Stages of a request, in the order they happen
+STAGES = ("acquire", "execute", "fetch", "shape", "serialize")
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    # Prometheus text exposition format. Bucket counts are cumulative.
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.help_text),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        with self._lock:
+            series = sorted(self._series.items())
+        for label_values, counts in series:
+            labels = ",".join('{}="{}"'.format(n, v) for n, v in zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(self.name, labels, bound, cumulative))
+            lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(self.name, labels, counts[-1]))
+            lines.append("{}_sum{{{}}} {}".format(self.name, labels, round(counts[-2], 6)))
+            lines.append("{}_count{{{}}} {}".format(self.name, labels, counts[-1]))
+        return "\n".join(lines)
+
+
+stage_seconds = Histogram(
+    "covid_request_stage_seconds",
+    "Time spent in each stage of a request (acquire, execute, fetch, shape, serialize, total).",
+    ("route", "stage"),
+    DURATION_BUCKETS,
+)
+response_rows = Histogram(
+    "covid_response_rows", "Rows read from the database per request.", ("route",), ROW_BUCKETS
+)
+response_bytes = Histogram(
+    "covid_response_bytes", "Response body size per request.", ("route",), BYTE_BUCKETS
+)
+
+
+# Stage timings and row count for one request. The database and shaping code record into the
+# timings of the current request through the context variable, so they need no request object.
+class RequestTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def add(self, stage_name, seconds):
+        with self._lock:
+            self.stages[stage_name] = self.stages.get(stage_name, 0) + seconds
+
+    def add_rows(self, count):
+        with self._lock:
+            self.rows += count
+
+    def server_timing(self, total_seconds):
+        parts = ["{};dur={:.3f}".format(name, self.stages[name] * 1000) for name in STAGES if name in self.stages]
+        parts.append("total;dur={:.3f}".format(total_seconds * 1000))
+        return ", ".join(parts)
+
+
+_current = ContextVar("request_timings", default=None)
+
+
+def begin_request():
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def current_timings():
+    return _current.get()
+
+
+@contextmanager
+def stage(stage_name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _current.get()
+        if timings is not None:
+            timings.add(stage_name, time.perf_counter() - start)
+
+
+def add_rows(count):
+    timings = _current.get()
+    if timings is not None:
+        timings.add_rows(count)
+
+
+def record_request(route, timings, body_bytes):
+    total = time.perf_counter() - timings.start
+    for stage_name, seconds in timings.stages.items():
+        stage_seconds.observe((route, stage_name), seconds)
+    stage_seconds.observe((route, "total"), total)
+    response_rows.observe((route,), timings.rows)
+    if body_bytes is not None:
+        response_bytes.observe((route,), body_bytes)
+    return total
+
+
+def render():
+    return "\n".join(histogram.render() for histogram in (stage_seconds, response_rows, response_bytes)) + "\n"
@@ -0,0 +1,176 @@
+import argparse
+import os
+
+import cx_Oracle
+
+from aggregates import ORA_NAME_ALREADY_USED
+from dataset import DATASET_TABLES
+from db import get_connection
+
+# Versioned schema changes to the raw tables query1-query5 read, so that a request for a few states
+# and a date range reads only their rows instead of scanning every table in full:
+#   1. state_code and location_level virtual columns, derived from location_key
+#   2. range partitioning by month on date_key, subpartitioned by location_level
+#   3. local indexes on (state_code, date_key)
+#   4. fresh optimizer statistics
+# The applied versions are recorded in SCHEMA_MIGRATIONS in the application user's schema.
+# Usage: python migrations.py status | migrate [--to VERSION]
+# Turn on USE_LOCATION_COLUMNS once version 1 is applied, so the queries filter on location_level.
+# explain_plans.py captures the plans of query1-query5 to compare before and after migrating.
+# Partitioning an existing table online (version 2) needs Oracle 12.2 or later.
+
+USE_LOCATION_COLUMNS = os.getenv('USE_LOCATION_COLUMNS', 'false').lower() == 'true'
+
+# Errors of a statement that already ran, when a migration that failed half way is run again:
+# ORA-00955: name is already used by an existing object
+# ORA-01408: such column list already indexed
+# ORA-01430: column being added already exists in table
+# Partitioning a table that is already partitioned the same way just rebuilds it.
+ALREADY_APPLIED_ERRORS = (ORA_NAME_ALREADY_USED, 1408, 1430)
+
+# Tables query1-query5 aggregate from, as (owner, table). The migrations below are written out for
+# these tables, so once a version is applied it must not change; add another version instead.
+MIGRATED_TABLES = [
+    (owner, table) for name, owner, table in DATASET_TABLES
+    if name in ("us_epidemiology", "us_mobility", "vaccination_search", "hospitalizations", "government_responses")
+]
+
+CREATE_MIGRATIONS_TABLE = """
+    CREATE TABLE SCHEMA_MIGRATIONS (
+        version NUMBER PRIMARY KEY,
+        description VARCHAR2(200),
+        applied_at DATE
+    )
+"""
+
+
+def _qualified(owner, table):
+    return '"{}".{}'.format(owner, table)
+
+
+# County rows have a location_key of US_XX_NNNNN, state rows of US_XX
+def add_location_columns():
+    return [
+        """
+        ALTER TABLE {} ADD (
+            state_code VARCHAR2(5) AS (SUBSTR(location_key, 1, 5)) VIRTUAL,
+            location_level VARCHAR2(7) AS (
+                CASE
+                    WHEN location_key LIKE 'US____%' THEN 'COUNTY'
+                    WHEN location_key LIKE 'US___' THEN 'STATE'
+                    ELSE 'OTHER'
+                END
+            ) VIRTUAL
+        )
+        """.format(_qualified(owner, table))
+        for owner, table in MIGRATED_TABLES
+    ]
+
+
+# One partition per month, created as rows arrive, each split into county, state and other rows, so
+# a date range reads only its months and a query on county rows skips the state rows and back.
+def partition_by_month():
+    return [
+        """
+        ALTER TABLE {} MODIFY
+            PARTITION BY RANGE (date_key) INTERVAL (NUMTOYMINTERVAL(1, 'MONTH'))
+            SUBPARTITION BY LIST (location_level)
+            SUBPARTITION TEMPLATE (
+                SUBPARTITION county VALUES ('COUNTY'),
+                SUBPARTITION state VALUES ('STATE'),
+                SUBPARTITION other VALUES (DEFAULT)
+            )
+            (PARTITION before_2020 VALUES LESS THAN (DATE '2020-01-01'))
+            ONLINE
+        """.format(_qualified(owner, table))
+        for owner, table in MIGRATED_TABLES
+    ]
+
+
+# The state filters are on SUBSTR(location_key, 1, 5), which is the state_code expression, so the
+# optimizer uses these indexes for them without the queries naming the column.
+def index_state_and_date():
+    return [
+        "CREATE INDEX {} ON {} (state_code, date_key) LOCAL".format(
+            _qualified(owner, table + "_STATE_IX"), _qualified(owner, table))
+        for owner, table in MIGRATED_TABLES
+    ]
+
+
+def gather_statistics():
+    return [
+        "BEGIN DBMS_STATS.GATHER_TABLE_STATS('{}', '{}', cascade => TRUE); END;".format(owner, table)
+        for owner, table in MIGRATED_TABLES
+    ]
+
+
+# (version, description, statements), in the order they are applied
+MIGRATIONS = [
+    (1, "Add state_code and location_level columns", add_location_columns()),
+    (2, "Partition by month of date_key and location_level", partition_by_month()),
+    (3, "Index state_code and date_key", index_state_and_date()),
+    (4, "Gather statistics", gather_statistics()),
+]
+
+
+def create_migrations_table(cursor):
+    try:
+        cursor.execute(CREATE_MIGRATIONS_TABLE)
+    except cx_Oracle.DatabaseError as e:
+        error, = e.args
+        if error.code != ORA_NAME_ALREADY_USED:
+            raise
+
+
+def applied_versions(cursor):
+    create_migrations_table(cursor)
+    cursor.execute("SELECT version, applied_at FROM SCHEMA_MIGRATIONS")
+    return dict(cursor.fetchall())
+
+
+def status():
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        applied = applied_versions(cursor)
+        cursor.close()
+    for version, description, _ in MIGRATIONS:
+        state = "applied {}".format(applied[version].strftime("%Y-%m-%d %H:%M")) if version in applied else "pending"
+        print("{:>3}  {:<55} {}".format(version, description, state))
+
+
+# Apply the pending migrations up to `target` (all of them when None). DDL commits as it runs, so a
+# migration that fails is left half applied and is not recorded; running it again skips the
+# statements that already went through.
+def migrate(target=None):
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        applied = applied_versions(cursor)
+        for version, description, statements in MIGRATIONS:
+            if version in applied or (target is not None and version > target):
+                continue
+            print("Applying {}: {}".format(version, description))
+            for statement in statements:
+                try:
+                    cursor.execute(statement)
+                except cx_Oracle.DatabaseError as e:
+                    error, = e.args
+                    if error.code not in ALREADY_APPLIED_ERRORS:
+                        raise
+                    print("  skipped, already applied: {}".format(error.message.strip()))
+            cursor.execute(
+                "INSERT INTO SCHEMA_MIGRATIONS (version, description, applied_at) VALUES (:version, :description, SYSDATE)",
+                version=version, description=description)
+            connection.commit()
+        cursor.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Apply the schema migrations of the raw tables")
+    parser.add_argument("command", choices=["status", "migrate"])
+    parser.add_argument("--to", type=int, help="last version to apply, defaults to all")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        status()
+    else:
+        migrate(args.to)
@@ -0,0 +1,797 @@
+from collections import Counter, defaultdict
+from datetime import timezone
+
+import aggregates
+import migrations
+from dataset import DATASET_TABLES, LOOKUP_TABLES, PHYSICIAN_CATEGORIES
+from db import get_connection, iter_batches, string_list
+from db_settings import DB_ARRAYSIZE
+from dimensions import dimensions
+from metrics import stage
+
+# Alias of the weekly average of each mobility series in query1
+MOBILITY_AVERAGES = {
+    "mobility_retail_and_recreation": "AvgMobilityRetailAndRecreation",
+    "mobility_grocery_and_pharmacy": "AvgMobilityGroceryAndPharmacy",
+    "mobility_parks": "AvgMobilityParks",
+    "mobility_transit_stations": "AvgMobilityTransitStations",
+    "mobility_workplaces": "AvgMobilityWorkplaces",
+    "mobility_residential": "AvgMobilityResidential",
+}
+
+# Alias of the monthly average of each query3 statistic
+SECTOR_STATISTIC_COLUMNS = {
+    "percent_in_profit": "percentOfCompaniesInProfit",
+    "median_return": "medianReturnPercent",
+    "breadth": "breadthPercent",
+}
+
+
+# Restricts county/state level rows to the states in the :state_codes collection bind. The codes
+# are resolved from the requested state names in process (see dimensions.py), so the filter does
+# not look them up in CODE_TO_STATE. Applied inside the per-state rollups so that only the
+# requested states are aggregated.
+STATE_FILTER = "SUBSTR({column}, 1, 5) IN (SELECT column_value FROM TABLE(:state_codes))"
+
+
+# Rows of one level of location_key: county rows are US_XX_NNNNN and state rows US_XX. With
+# USE_LOCATION_COLUMNS they are read by the location_level column that migrations.py adds, which
+# the tables are subpartitioned on, instead of matching location_key.
+LOCATION_LEVEL_PATTERNS = {
+    "COUNTY": "US____%",
+    "STATE": "US___",
+}
+
+
+def location_level(level, table=None):
+    prefix = table + "." if table else ""
+    if migrations.USE_LOCATION_COLUMNS:
+        return "{}location_level = '{}'".format(prefix, level)
+    return "{}location_key LIKE '{}'".format(prefix, LOCATION_LEVEL_PATTERNS[level])
+
+
+# Bounds on the daily rows a monthly or weekly rollup reads, so that only the partitions of the
+# requested months are scanned once the tables are partitioned by date_key. They take in the whole
+# first month or week; the rollups still keep only the periods that start in the date range.
+MONTH_RANGE = ("date_key >= TRUNC(CAST(:start_date AS DATE), 'MM') "
+               "AND date_key < ADD_MONTHS(TRUNC(CAST(:end_date AS DATE), 'MM'), 1)")
+WEEK_RANGE = ("date_key >= TRUNC(CAST(:start_date AS DATE), 'IW') "
+              "AND date_key < TRUNC(CAST(:end_date AS DATE), 'IW') + 7")
+
+
+# input_states is None for all states, in which case the filter is left out of the query.
+def state_filter(column, input_states, keyword="AND"):
+    if input_states is None:
+        return ""
+    return keyword + " " + STATE_FILTER.format(column=column)
+
+
+# Raises UnknownStatesError for names that are not states
+def state_filter_binds(input_states, binds):
+    if input_states is not None:
+        binds["state_codes"] = dimensions.state_codes(input_states)
+    return binds
+
+
+# Every query is built by a queryN_statement function as its SQL text and binds, so that the same
+# statement can run on the threaded session pool here or on the asyncio pool (async_db.py).
+# Lists in the binds are bound as string collections. Binds the SQL does not use are left out,
+# since the summary table variants do not always need all of them.
+def statement_binds(query, binds, to_collection):
+    return {
+        name: to_collection(value) if isinstance(value, list) else value
+        for name, value in binds.items() if ":" + name in query
+    }
+
+
+# Run a statement on a pooled session and yield its rows in batches of DB_ARRAYSIZE.
+def run_statement(query, binds):
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.arraysize = DB_ARRAYSIZE
+        binds = statement_binds(query, binds, lambda values: string_list(connection, values))
+        with stage("execute"):
+            cursor.execute(query, binds)
+        yield from iter_batches(cursor)
+        cursor.close()
+
+
+# Weekly infection rate vs mobility for a list of states (None for all states).
+def query1_statement(input_states, start_date, end_date, mobility_types):
+    # The query works as follows:
+    # 1. Sum the daily new_confirmed from each county to get the new_confirmed for the state.
+    # 2. Calculate the number of people currently infected on the day in the state by aggregating the new_confirmed values 
+    # for the past 2 weeks. This is because an infected person takes around 2 weeks to be free of infection.
+    # 3. Keep only the currently_infected values for the start of the week for each state.
+    # 4. Calculate the aggregate weekly mobility values for each state for each week  from the per day county mobility values.
+    # 5. Join the infection and mobility values to get values for each state for each week.
+    # 6. Filter by date. The state filter is applied in steps 1 and 4 so only the requested states are aggregated.
+    # The date range bounds the mobility rows only: the 2 week window of step 2 counts rows, not days.
+    # The rows carry the state code and the currently infected count. query1_batch() turns them into the
+    # state_name and the "weekly infection rate" (currently_infected/state_population) from the dimension cache.
+    query = """WITH 
+    DailyNewConfirmedPerState AS (
+        SELECT 
+            date_key,
+            SUBSTR(location_key, 1, 5) AS state_code,
+            NVL(SUM(new_confirmed), 0) AS new_confirmed
+        FROM
+            rgugale.US_Epidemiology
+        WHERE
+            {county_rows}
+            {state_filter}
+        GROUP BY
+            date_key, SUBSTR(location_key, 1, 5)
+    ),
+    DailyCurrentlyInfectedCountPerState AS (
+        SELECT
+            date_key,
+            state_code,
+            SUM(new_confirmed) OVER (PARTITION BY state_code ORDER BY date_key ROWS BETWEEN 13 PRECEDING AND CURRENT ROW) AS CurrentlyInfectedCount
+        FROM
+            DailyNewConfirmedPerState
+    ),
+    CurrentlyInfectedCountPerStatePerWeek AS (
+        SELECT 
+            date_key AS start_of_week,
+            state_code,
+            CurrentlyInfectedCount
+        FROM
+            DailyCurrentlyInfectedCountPerState
+        WHERE
+            date_key = TRUNC(date_key, 'IW')
+    ),
+    WeeklyMobilityInfoPerState AS (
+        SELECT
+            TRUNC(date_key, 'IW') AS start_of_week,
+            SUBSTR(location_key, 1, 5) AS state_code{mobility_averages}
+        FROM
+            "AMMAR.AMJAD".US_Mobility
+        WHERE
+            {county_rows}
+            AND {week_range}
+            {state_filter}
+        GROUP BY
+            TRUNC(date_key, 'IW'),
+            SUBSTR(location_key, 1, 5)
+    )
+    SELECT
+        mobi.start_of_week,
+        mobi.state_code,
+        cicpspw.CurrentlyInfectedCount{mobility_columns}
+    FROM
+        CurrentlyInfectedCountPerStatePerWeek cicpspw
+    JOIN
+        WeeklyMobilityInfoPerState mobi 
+        ON cicpspw.state_code = mobi.state_code 
+            AND cicpspw.start_of_week = mobi.start_of_week
+    WHERE
+        mobi.start_of_week BETWEEN :start_date AND :end_date
+    ORDER BY mobi.state_code, mobi.start_of_week
+    """
+
+    # Only the requested mobility averages are selected, so unused AVGs over US_Mobility are never computed.
+    # mobility_types only ever holds keys of MOBILITY_AVERAGES, never raw user input.
+    query = query.format(
+        mobility_averages="".join(
+            ",\n            ROUND(AVG({}), 4) AS {}".format(mobility_type, MOBILITY_AVERAGES[mobility_type])
+            for mobility_type in mobility_types
+        ),
+        mobility_columns="".join(",\n        " + MOBILITY_AVERAGES[mobility_type] for mobility_type in mobility_types),
+        state_filter=state_filter("location_key", input_states),
+        county_rows=location_level("COUNTY"),
+        week_range=WEEK_RANGE,
+    )
+
+    if aggregates.USE_AGGREGATES:
+        query = aggregates.QUERY1.format(
+            mobility_columns="".join(",\n        s.avg_" + mobility_type for mobility_type in mobility_types),
+            state_filter=state_filter("s.state_code", input_states),
+        )
+
+    return query, state_filter_binds(input_states, {"start_date": start_date, "end_date": end_date})
+
+
+# Monthly vaccination search trends vs infection rate for a list of states (None for all states).
+def query2_statement(input_states, start_date, end_date):
+    # This query works as follows:
+    # 1. Get the monthly vaccination search data by aggregating the daily data for every county of the state 
+    # and computing its average.
+    # 2. Get the monthly vaccination data for each state by aggregating the daily data.
+    # 3. Join the vaccination search data with the vaccination data.
+    # 4. Filter by date. The state filter is applied in steps 1 and 2 so only the requested states are aggregated.
+    # The rows carry the state code and new_persons_vaccinated. query2_batch() turns them into the state_name
+    # and the monthly vaccination rate (new_persons_vaccinated/population) from the dimension cache.
+    query = """
+    SELECT
+        MonthlyGoogleSearchesPerState.start_of_month,
+        MonthlyGoogleSearchesPerState.state_code,
+        avg_monthly_sni_covid19_vaccination,
+        avg_monthly_sni_vaccination_intent,
+        avg_monthly_sni_safety_side_effects,
+        new_persons_vaccinated
+    FROM
+        (
+            SELECT
+                TRUNC(date_key, 'MM') AS start_of_month,
+                SUBSTR(location_key, 1, 5) AS state_code,
+                ROUND(AVG(sni_covid19_vaccination), 4) as avg_monthly_sni_covid19_vaccination,
+                ROUND(AVG(sni_vaccination_intent), 4) as avg_monthly_sni_vaccination_intent,
+                ROUND(AVG(sni_safety_side_effects), 4) as avg_monthly_sni_safety_side_effects
+            FROM
+                "AMMAR.AMJAD".vaccination_search
+            WHERE
+                {county_rows}
+                AND {month_range}
+                {search_state_filter}
+            GROUP BY
+                TRUNC(date_key, 'MM'), SUBSTR(location_key, 1, 5) --Aggregating county data for each state for each month
+        ) MonthlyGoogleSearchesPerState
+    JOIN
+        (
+            SELECT
+                TRUNC(date_key, 'MM') AS start_of_month,
+                location_key as state_code,
+                ROUND(SUM(new_persons_vaccinated), 4) AS new_persons_vaccinated
+            FROM
+                "AMMAR.AMJAD".us_vaccinations
+            WHERE
+                {month_range}
+                {vaccination_state_filter}
+            GROUP BY
+                TRUNC(date_key, 'MM'), location_key -- Aggregation on date. No aggregation on county data as suitable county data is not available. Directly used the state data.
+        ) MonthlyVacInfoPerState
+    ON MonthlyGoogleSearchesPerState.start_of_month = MonthlyVacInfoPerState.start_of_month
+        AND MonthlyGoogleSearchesPerState.state_code = MonthlyVacInfoPerState.state_code
+    WHERE
+        MonthlyGoogleSearchesPerState.start_of_month BETWEEN TO_DATE(:start_date, 'DD-MON-YY') AND TO_DATE(:end_date, 'DD-MON-YY')
+    ORDER BY MonthlyGoogleSearchesPerState.state_code, MonthlyGoogleSearchesPerState.start_of_month
+    """.format(
+        search_state_filter=state_filter("location_key", input_states),
+        vaccination_state_filter=state_filter("location_key", input_states),
+        county_rows=location_level("COUNTY"),
+        month_range=MONTH_RANGE,
+    )
+
+    if aggregates.USE_AGGREGATES:
+        query = aggregates.QUERY2.format(state_filter=state_filter("s.state_code", input_states))
+
+    return query, state_filter_binds(input_states, {"start_date": start_date, "end_date": end_date})
+
+
+# This query shows the number of people tested per 100000 for the entire US vs 
+# a statistic of the daily stock returns of each sector for the month (see SECTOR_STATISTICS):
+# by default the average percentage of companies from a sector whose stocks made a profit.
+def query3_statement(sectors, start_date, end_date, statistic="percent_in_profit", profit_threshold=0):
+    # This query works as follows:
+    # 1. Get the number of companies present in each sector.
+    # 2. Get the daily return of the companies in the selected sectors, for the months of the date range.
+    # 3. Get the number of companies in profit (return >= profit_threshold), advancing and declining,
+    #    and the median return on a day in each sector.
+    # 4. Aggregate the data to get the monthly average of each daily statistic in each sector.
+    # 5. Get the monthly testing rate per 100000 people for the entire US by aggregating daily data for each state.
+    # 6. Join the stock and testing tables
+    query = """
+    WITH NoOfCompaniesPerSector AS (
+        SELECT 
+            sector, 
+            COUNT(ticker) AS noOfCompaniesInSector 
+        FROM 
+            RGUGALE.snp500_company_info
+        GROUP BY 
+            sector
+    ),
+    DailyStockInfoPerSector AS (
+        SELECT 
+            date_key, 
+            sector, 
+            COUNT(CASE WHEN profit_or_loss_percent >= :profit_threshold THEN 1 END) AS noOfCompaniesInProfitInSector,
+            MEDIAN(profit_or_loss_percent) AS medianReturnPercent,
+            (COUNT(CASE WHEN profit_or_loss_percent > 0 THEN 1 END) - COUNT(CASE WHEN profit_or_loss_percent < 0 THEN 1 END))
+                / NULLIF(COUNT(profit_or_loss_percent), 0) * 100 AS breadthPercent
+        FROM (
+            SELECT 
+                snp500.ticker,
+                date_key,
+                sector,
+                ROUND(((close - open) / open) * 100, 4) AS profit_or_loss_percent
+            FROM 
+                "AMMAR.AMJAD".snp500 
+                JOIN rgugale.snp500_company_info ON snp500.ticker = snp500_company_info.ticker
+            WHERE 
+                sector IN (SELECT column_value FROM TABLE(:sectors))
+                AND date_key >= TRUNC(CAST(:start_date AS DATE), 'MM')
+                AND date_key < ADD_MONTHS(TRUNC(CAST(:end_date AS DATE), 'MM'), 1)
+        ) StockPriceWithSector
+        GROUP BY 
+            date_key, sector
+    ),
+    MonthlyStockInfoPerSector AS (
+        SELECT 
+            TRUNC(date_key, 'MM') AS start_of_month,
+            dailyInfo.sector,
+            -- Days on which no company made a profit are left out of the average
+            ROUND(AVG(CASE WHEN noOfCompaniesInProfitInSector > 0 THEN (noOfCompaniesInProfitInSector/noOfCompaniesInSector)*100 END), 4) AS percentOfCompaniesInProfit,
+            ROUND(AVG(medianReturnPercent), 4) AS medianReturnPercent,
+            ROUND(AVG(breadthPercent), 4) AS breadthPercent
+        FROM
+            DailyStockInfoPerSector dailyInfo 
+            JOIN NoOfCompaniesPerSector sectorCount ON dailyInfo.sector = sectorCount.sector
+        GROUP BY
+            TRUNC(date_key, 'MM'), dailyInfo.sector
+    ),
+    PerMonthTestingInfoWholeUS AS (
+        SELECT 
+            TRUNC(date_key, 'MM') AS start_of_month, 
+            ROUND(AVG(no_of_tested_per_100000), 5) AS no_of_tested_per_100000 
+        FROM 
+            (
+                SELECT 
+                    date_key,
+                    US_Epidemiology.location_key,
+                    NVL(100000 * new_tested / population, 0) AS no_of_tested_per_100000
+                FROM
+                    rgugale.US_Epidemiology 
+                    JOIN rgugale.Demographics demo ON demo.location_key = US_Epidemiology.location_key
+                WHERE
+                    {state_rows} AND date_key BETWEEN :start_date AND :end_date
+            ) PerDayTestingInfoWholeUS
+        GROUP BY 
+            TRUNC(date_key, 'MM')
+    )
+    SELECT 
+        stockTab.start_of_month,
+        no_of_tested_per_100000,
+        {statistic_column},
+        sector
+    FROM 
+        MonthlyStockInfoPerSector stockTab 
+        JOIN PerMonthTestingInfoWholeUS testingTab ON stockTab.start_of_month = testingTab.start_of_month
+    ORDER BY stockTab.start_of_month, sector
+    """.format(statistic_column=SECTOR_STATISTIC_COLUMNS[statistic], state_rows=location_level("STATE", "US_Epidemiology"))
+
+    if aggregates.USE_AGGREGATES:
+        # The monthly rollup only holds percent_in_profit for a threshold of 0, other thresholds
+        # are summed from the daily return buckets.
+        if statistic == "percent_in_profit" and profit_threshold != 0:
+            query = aggregates.QUERY3_PROFIT_THRESHOLD
+        else:
+            query = aggregates.QUERY3.format(statistic_column=aggregates.SECTOR_STATISTIC_COLUMNS[statistic])
+
+    binds = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "sectors": list(sectors),
+        "profit_threshold": profit_threshold,
+    }
+    return query, binds
+
+
+# All categories when none are selected
+def selected_physician_categories(physician_categories):
+    if len(physician_categories) == 0:
+        return PHYSICIAN_CATEGORIES
+    return physician_categories
+
+
+# The states in the given physician categories, which are the only ones query4 has to aggregate
+def physician_category_state_codes(physician_categories):
+    physician_categories = set(selected_physician_categories(physician_categories))
+    return dimensions.codes_where(lambda state: state.physician_category in physician_categories)
+
+
+# Monthly ratio of no. of deaths vs no. of newly hospitalized patients for states 
+# grouped into 4 categories according to no. of physicians per 100000 people.
+def query4_statement(physician_categories, start_date, end_date):
+    # This query works as follows:
+    # 1. Filter and get the daily hospitalization data for US states from all the other hospitalization data.
+    # 2. The data for NY is just placeholder data. Actual data for NY is split into counties. 
+    # Subtract the NY data and add the aggregated county data to the hospitalization data to include data for NY.
+    # 3. For each state, get the number of people hospitalized monthly by aggregating data from daily hospitalization info.
+    # 4. For each state, get the number of deceased people for the month from epidemiology table by aggregating 
+    # new_deceased for all the counties of the state.
+    # 5. Calculate the ratio of deaths to hospitalized people for each state for each month.
+    # 6. Filter by date. Only the states in the requested noOfPhysician categories are aggregated.
+    # The states are divided into the 4 groups by number of physicians from the dimension cache, which is
+    # also where query4_rows() averages the ratio of deaths to hospitalized people for each group.
+    query = """
+    WITH 
+    DailyHospitalizationInfoPerState AS (
+        (
+            SELECT 
+                date_key,
+                location_key as state_code,
+                new_hospitalized_patients
+            FROM
+                "AMMAR.AMJAD".hospitalizations
+            WHERE
+                {state_rows}
+                AND {month_range}
+        )
+        MINUS
+        -- Get rid of US_NY values as they are incomplete
+        (
+            SELECT 
+                date_key,
+                location_key,
+                new_hospitalized_patients
+            FROM
+                "AMMAR.AMJAD".hospitalizations
+            WHERE
+                location_key LIKE 'US_NY'
+                AND {month_range}
+        )
+        UNION
+        -- Sum up county data for NY
+        (
+            SELECT 
+                date_key,
+                SUBSTR(location_key, 1, 5) AS state_code,
+                SUM(new_hospitalized_patients) AS new_hospitalized_patients
+            FROM
+                "AMMAR.AMJAD".hospitalizations
+            WHERE
+                location_key LIKE 'US_NY_%'
+                AND {month_range}
+            GROUP BY
+                date_key,
+                SUBSTR(location_key, 1, 5)
+        )
+    ),
+    MonthlyHospitalizationInfoPerState AS (
+        SELECT 
+            TRUNC(date_key, 'MM') as start_of_month,
+            state_code,
+            SUM(new_hospitalized_patients) as new_hospitalized_patients
+        FROM DailyHospitalizationInfoPerState
+        WHERE state_code IN (SELECT column_value FROM TABLE(:state_codes))
+        GROUP BY
+            TRUNC(date_key, 'MM'), state_code
+    ),
+    MonthlyDeceasedPerState AS (
+        SELECT
+            TRUNC(date_key, 'MM') as start_of_month,
+            SUBSTR(location_key, 1, 5) AS state_code,
+            SUM(new_deceased) AS new_deceased
+        FROM
+            RGUGALE.us_epidemiology
+        WHERE 
+            {county_rows}
+            AND {month_range}
+            AND {state_filter}
+        GROUP BY
+            TRUNC(date_key, 'MM'), SUBSTR(location_key, 1, 5)
+    ),
+    RatioOfDeathsToHospitalizedPeoplePerMonthPerState AS (
+        SELECT
+            monthlyHosp.start_of_month,
+            monthlyHosp.state_code,
+            (new_deceased / NULLIF(new_hospitalized_patients, 0)) AS ratio_of_deaths
+        FROM
+            MonthlyHospitalizationInfoPerState monthlyHosp
+        JOIN
+            MonthlyDeceasedPerState 
+        ON 
+            monthlyHosp.start_of_month = MonthlyDeceasedPerState.start_of_month 
+            AND monthlyHosp.state_code = MonthlyDeceasedPerState.state_code
+        WHERE 
+            monthlyHosp.start_of_month BETWEEN :start_date AND :end_date
+    )
+    SELECT 
+        start_of_month,
+        state_code,
+        ratio_of_deaths
+    FROM
+        RatioOfDeathsToHospitalizedPeoplePerMonthPerState
+    ORDER BY start_of_month, state_code
+    """.format(
+        state_filter=STATE_FILTER.format(column="location_key"),
+        state_rows=location_level("STATE"),
+        county_rows=location_level("COUNTY"),
+        month_range=MONTH_RANGE,
+    )
+
+    if aggregates.USE_AGGREGATES:
+        query = aggregates.QUERY4
+
+    binds = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "state_codes": physician_category_state_codes(physician_categories),
+    }
+    return query, binds
+
+
+# Query to compare the mortality rate in democratic vs republican states based on their stringency index per month.
+def query5_statement(party, start_date, end_date):
+    # How this query works:
+    # 1. Calculate the average monthly stringency_index for each state ruled by the party.
+    # 2. Get the monthly deceased count per state ruled by the party by aggregating the daily deceased count.
+    # 3. Filter by date.
+    # The ruling party of each state comes from the dimension cache, so only the party's states are
+    # aggregated. query5_rows() puts each state into one of the 5 stringency level categories, counts the
+    # states in each category and averages the mortality rate per 100000 people (from the state population)
+    # across the states for the month.
+    query = """
+    SELECT
+        'stringency' AS measure,
+        TRUNC(date_key, 'MM') AS start_of_month,
+        location_key AS state_code,
+        ROUND(AVG(stringency_index), 4) AS monthly_avg_stringency_index
+    FROM "AMMAR.AMJAD".government_responses
+    WHERE {state_rows}
+        AND location_key IN (SELECT column_value FROM TABLE(:state_codes))
+        AND {month_range}
+        AND TRUNC(date_key, 'MM') BETWEEN :start_date AND :end_date
+    GROUP BY TRUNC(date_key, 'MM'), location_key
+    UNION ALL
+    SELECT
+        'deceased' AS measure,
+        TRUNC(date_key, 'MM') AS start_of_month,
+        location_key AS state_code,
+        SUM(new_deceased) AS monthly_avg_deceased
+    FROM rgugale.US_Epidemiology
+    WHERE {state_rows}
+        AND location_key IN (SELECT column_value FROM TABLE(:state_codes))
+        AND {month_range}
+        AND TRUNC(date_key, 'MM') BETWEEN :start_date AND :end_date
+    GROUP BY TRUNC(date_key, 'MM'), location_key
+    """.format(state_rows=location_level("STATE"), month_range=MONTH_RANGE)
+
+    if aggregates.USE_AGGREGATES:
+        query = aggregates.QUERY5
+
+    binds = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "state_codes": dimensions.codes_where(lambda state: state.ruling_party == party),
+    }
+    return query, binds
+
+
+# The statements leave the dimension lookups to these functions, which turn their rows into the rows
+# of the backend interface. They are shared with the asyncio path (async_backend.py). Rows of states
+# that are not in code_to_state, or have no population where one is needed, are dropped, as the joins
+# with CODE_TO_STATE and Demographics did.
+def per_population(value, population, scale):
+    if value is None:
+        return None
+    return round(value * scale / population, 8)
+
+
+def query1_batch(batch):
+    rows = []
+    for row in batch:
+        state = dimensions.get(row[1])
+        if state is not None and state.population is not None:
+            rows.append((row[0], state.name, per_population(row[2], state.population, 100)) + tuple(row[3:]))
+    return rows
+
+
+def query2_batch(batch):
+    rows = []
+    for row in batch:
+        state = dimensions.get(row[1])
+        if state is not None and state.population is not None:
+            rows.append((row[0], state.name) + tuple(row[2:5]) + (per_population(row[5], state.population, 1),))
+    return rows
+
+
+# AVG of the states' ratios per month and physician category, ignoring NULLs, then
+# GREATEST(NVL(ROUND(avg, 8), 0), 0), ordered by month and category.
+def query4_rows(rows):
+    ratios = defaultdict(list)
+    for start_of_month, state_code, ratio_of_deaths in rows:
+        state = dimensions.get(state_code)
+        if state is not None:
+            ratios[(start_of_month, state.physician_category)].append(ratio_of_deaths)
+
+    result = []
+    for (start_of_month, physician_category), values in sorted(ratios.items()):
+        values = [value for value in values if value is not None]
+        average = round(sum(values) / len(values), 8) if values else 0
+        result.append((start_of_month, physician_category, max(average, 0)))
+    return result
+
+
+def stringency_category(monthly_avg_stringency_index):
+    if monthly_avg_stringency_index is None:
+        return "Unknown"
+    for upper, category in ((20, "0-19"), (40, "20-39"), (60, "40-59"), (80, "60-79"), (100, "80-100")):
+        if monthly_avg_stringency_index < upper:
+            return category
+    return "Unknown"
+
+
+# Per month: the number of states in each stringency category, and the average over the states of
+# GREATEST(ROUND(deceased * 100000 / population, 8), 0). Months missing either are left out.
+def query5_rows(rows):
+    states_per_category = defaultdict(Counter)
+    mortality_rates = defaultdict(list)
+    for measure, start_of_month, state_code, value in rows:
+        state = dimensions.get(state_code)
+        if state is None:
+            continue
+        if measure == "stringency":
+            states_per_category[start_of_month][stringency_category(value)] += 1
+        elif state.population is not None:
+            mortality_rate = per_population(value, state.population, 100000)
+            mortality_rates[start_of_month].append(None if mortality_rate is None else max(mortality_rate, 0))
+
+    result = []
+    for start_of_month in sorted(states_per_category):
+        if start_of_month not in mortality_rates:
+            continue
+        rates = [rate for rate in mortality_rates[start_of_month] if rate is not None]
+        mortality_rate = round(sum(rates) / len(rates), 8) if rates else None
+        for category, no_of_states in sorted(states_per_category[start_of_month].items()):
+            result.append((start_of_month, category, no_of_states, mortality_rate))
+    return result
+
+
+# The query functions of the backend interface (see data_access.py). Each yields the rows of its
+# statement in batches of DB_ARRAYSIZE. query4 and query5 aggregate all their rows, a few per state
+# and month, into one batch.
+def iter_query1_batches(input_states, start_date, end_date, mobility_types):
+    for batch in run_statement(*query1_statement(input_states, start_date, end_date, mobility_types)):
+        yield query1_batch(batch)
+
+
+def iter_query2_batches(input_states, start_date, end_date):
+    for batch in run_statement(*query2_statement(input_states, start_date, end_date)):
+        yield query2_batch(batch)
+
+
+def iter_query3_batches(sectors, start_date, end_date, statistic="percent_in_profit", profit_threshold=0):
+    yield from run_statement(*query3_statement(sectors, start_date, end_date, statistic, profit_threshold))
+
+
+def iter_query4_batches(physician_categories, start_date, end_date):
+    statement = query4_statement(physician_categories, start_date, end_date)
+    yield query4_rows([row for batch in run_statement(*statement) for row in batch])
+
+
+def iter_query5_batches(party, start_date, end_date):
+    yield query5_rows([row for batch in run_statement(*query5_statement(party, start_date, end_date)) for row in batch])
+
+
+# Exact row count of every dataset table, and their total
+EXACT_COUNT_QUERY = """
+    SELECT
+        count_code_to_country,
+        count_demographics,
+        count_snp500,
+        count_snp500_company_info,
+        count_us_epidemiology,
+        count_us_mobility,
+        count_government_responses,
+        count_hospitalizations,
+        count_vaccination_search,
+        count_us_vaccinations,
+        count_code_to_country + count_demographics + count_snp500 + count_snp500_company_info + count_us_epidemiology +
+        count_us_mobility + count_government_responses + count_hospitalizations + count_vaccination_search +
+        count_us_vaccinations AS total_count
+    FROM (
+        SELECT
+            (SELECT COUNT(*) FROM RGUGALE.code_to_country) AS count_code_to_country,
+            (SELECT COUNT(*) FROM RGUGALE.demographics) AS count_demographics,
+            (SELECT COUNT(*) FROM "AMMAR.AMJAD".snp500) AS count_snp500,
+            (SELECT COUNT(*) FROM RGUGALE.snp500_company_info) AS count_snp500_company_info,
+            (SELECT COUNT(*) FROM RGUGALE.us_epidemiology) AS count_us_epidemiology,
+            (SELECT COUNT(*) FROM "AMMAR.AMJAD".us_mobility) AS count_us_mobility,
+            (SELECT COUNT(*) FROM "AMMAR.AMJAD".government_responses) AS count_government_responses,
+            (SELECT COUNT(*) FROM "AMMAR.AMJAD".hospitalizations) AS count_hospitalizations,
+            (SELECT COUNT(*) FROM "AMMAR.AMJAD".vaccination_search) AS count_vaccination_search,
+            (SELECT COUNT(*) FROM "AMMAR.AMJAD".us_vaccinations) AS count_us_vaccinations
+        FROM dual
+    )
+    """
+
+# Optimizer statistics gathered by DBMS_STATS. NUM_ROWS is exact as of LAST_ANALYZED, which is
+# good enough for a homepage counter and costs one dictionary lookup instead of ten full scans.
+STATISTICS_QUERY = """
+    SELECT owner, table_name, NVL(num_rows, 0), last_analyzed
+    FROM ALL_TABLES
+    WHERE (owner, table_name) IN ({})
+    """
+
+
+def exact_row_counts():
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(EXACT_COUNT_QUERY)
+        result = cursor.fetchone()
+        cursor.close()
+
+    counts = {key: result[i] for i, (key, _, _) in enumerate(DATASET_TABLES)}
+    counts["total_row_count"] = result[len(DATASET_TABLES)]
+    return counts
+
+
+# "(:owner0, :table0), (:owner1, :table1), ..." and its binds, to select the given tables from
+# the data dictionary
+def table_list_binds(tables):
+    binds = {}
+    pairs = []
+    for i, (_, owner, table_name) in enumerate(tables):
+        binds["owner{}".format(i)] = owner
+        binds["table{}".format(i)] = table_name
+        pairs.append("(:owner{0}, :table{0})".format(i))
+    return ", ".join(pairs), binds
+
+
+# Counts from the optimizer statistics, and when the oldest of them was gathered
+def statistics_row_counts():
+    table_list, binds = table_list_binds(DATASET_TABLES)
+
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(STATISTICS_QUERY.format(table_list), binds)
+        result = cursor.fetchall()
+        cursor.close()
+
+    num_rows = {(owner, table_name): (rows, analyzed) for owner, table_name, rows, analyzed in result}
+    counts = {}
+    oldest_analyzed = None
+    for key, owner, table_name in DATASET_TABLES:
+        rows, analyzed = num_rows.get((owner, table_name), (0, None))
+        counts[key] = rows
+        if analyzed is not None and (oldest_analyzed is None or analyzed < oldest_analyzed):
+            oldest_analyzed = analyzed
+    counts["total_row_count"] = sum(counts[key] for key, _, _ in DATASET_TABLES)
+    return counts, oldest_analyzed
+
+
+# When the tables behind the queries last changed, from the data dictionary: the last DDL (a
+# truncate or a rebuild), the DML recorded by table monitoring in ALL_TAB_MODIFICATIONS, and
+# the last statistics gathering. With USE_AGGREGATES the summary tables are refreshed after every
+# load, so their watermarks are included too. The dictionary holds server-local times, which are
+# shifted to UTC by the offset of SYSDATE.
+LAST_LOADED_QUERY = """
+    SELECT MAX(changed_at) - (SYSDATE - CAST(SYS_EXTRACT_UTC(SYSTIMESTAMP) AS DATE))
+    FROM (
+        SELECT last_ddl_time AS changed_at
+        FROM ALL_OBJECTS
+        WHERE object_type = 'TABLE' AND (owner, object_name) IN ({table_list})
+        UNION ALL
+        SELECT timestamp
+        FROM ALL_TAB_MODIFICATIONS
+        WHERE partition_name IS NULL AND (table_owner, table_name) IN ({table_list})
+        UNION ALL
+        SELECT last_analyzed
+        FROM ALL_TABLES
+        WHERE (owner, table_name) IN ({table_list})
+        {watermarks}
+    )
+    """
+
+
+def last_loaded_at():
+    table_list, binds = table_list_binds(DATASET_TABLES + LOOKUP_TABLES)
+    watermarks = "UNION ALL SELECT refreshed_at FROM AGGREGATE_WATERMARKS" if aggregates.USE_AGGREGATES else ""
+
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(LAST_LOADED_QUERY.format(table_list=table_list, watermarks=watermarks), binds)
+        loaded_at, = cursor.fetchone()
+        cursor.close()
+
+    return loaded_at.replace(tzinfo=timezone.utc) if loaded_at is not None else None
+
+
+# code_to_state with the population and physicians per 100000 of each state, for dimensions.py
+STATE_DIMENSIONS_QUERY = """
+    SELECT cts.state_code, cts.state_name, cts.ruling_party, demo.population, hs.physicians_per_100000
+    FROM RGUGALE.CODE_TO_STATE cts
+    LEFT JOIN RGUGALE.Demographics demo ON demo.location_key = cts.state_code
+    LEFT JOIN RGUGALE.health_stats hs ON hs.location_key = cts.state_code
+    """
+
+
+def state_dimensions():
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(STATE_DIMENSIONS_QUERY)
+        result = cursor.fetchall()
+        cursor.close()
+    return result
@@ -0,0 +1,218 @@
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+# Server-side resolution control for the query routes, so that the size of a response is bounded
+# by the chart that draws it rather than by the date range:
+#   granularity - week, month or quarter. The rows are averaged over each period. A query can only
+#                 be coarsened, query1 has weekly values and query2-query5 monthly ones.
+#   max_points  - the most points kept per series, chosen with LTTB (Largest Triangle Three Buckets),
+#                 which keeps the peaks and dips a chart would show instead of every n-th point.
+# Both apply to the rows of the backend interface before they are shaped, so every response
+# format gets them, and are part of the cache key like every other parameter.
+
+GRANULARITIES = ("week", "month", "quarter")
+
+# How the rows of a query are laid out:
+#   granularity - the period of its rows as the backends compute them
+#   key         - column that tells series apart: the state for query1/query2, the sector for
+#                 query3 and the physician or stringency category for query4/query5
+#   per_key     - whether every key is a series of its own, with rows ordered by key then date,
+#                 or all keys share the dates, with rows ordered by date then key
+#   shared      - columns that have the same value for every key on a date
+#   counts      - columns averaged over every period of a coarser one, a period without a row
+#                 counting as 0
+Layout = namedtuple("Layout", ["granularity", "key", "per_key", "shared", "counts"])
+
+LAYOUTS = {
+    "query1": Layout("week", 1, True, (), ()),
+    "query2": Layout("month", 1, True, (), ()),
+    "query3": Layout("month", 3, False, (1,), ()),
+    "query4": Layout("month", 1, False, (), ()),
+    "query5": Layout("month", 1, False, (3,), (2,)),
+}
+
+
+# Raised for granularity/max_points values a query cannot answer. The routes answer it with a 400.
+class ResolutionError(ValueError):
+    pass
+
+
+# granularity and max_points of a request to a query route, None when not given
+def resolution_options(query_name, data):
+    layout = LAYOUTS[query_name]
+    granularity = data.get('granularity')
+    if granularity is not None:
+        if granularity not in GRANULARITIES:
+            raise ResolutionError("granularity must be one of: {}".format(", ".join(GRANULARITIES)))
+        if GRANULARITIES.index(granularity) < GRANULARITIES.index(layout.granularity):
+            coarser = GRANULARITIES[GRANULARITIES.index(layout.granularity):]
+            raise ResolutionError("{} is computed per {}, granularity must be one of: {}".format(
+                query_name, layout.granularity, ", ".join(coarser)))
+
+    max_points = data.get('max_points')
+    if max_points is not None and (isinstance(max_points, bool) or not isinstance(max_points, int) or max_points < 3):
+        raise ResolutionError("max_points must be an integer of at least 3")
+    return granularity, max_points
+
+
+def period_start(date, granularity):
+    if granularity == "week":
+        return date - timedelta(days=date.weekday())
+    if granularity == "month":
+        return date.replace(day=1)
+    return date.replace(month=date.month - (date.month - 1) % 3, day=1)
+
+
+def _mean(values):
+    values = [value for value in values if value is not None]
+    if not values:
+        return None
+    return round(sum(values) / len(values), 8)
+
+
+# Average the rows of every key over each period of the granularity. A week belongs to the month
+# and quarter its Monday is in.
+def coarsen(rows, layout, granularity):
+    buckets = {}
+    dates = defaultdict(dict)
+    for row in rows:
+        period = period_start(row[0], granularity)
+        buckets.setdefault((period, row[layout.key]), []).append(row)
+        dates[period].setdefault(row[0], row)
+
+    result = []
+    for (period, key), bucket in buckets.items():
+        values = [period]
+        for column in range(1, len(bucket[0])):
+            if column == layout.key:
+                values.append(key)
+            elif column in layout.shared:
+                values.append(_mean(row[column] for row in dates[period].values()))
+            elif column in layout.counts:
+                values.append(round(sum(row[column] or 0 for row in bucket) / len(dates[period]), 4))
+            else:
+                values.append(_mean(row[column] for row in bucket))
+        result.append(tuple(values))
+
+    # Buckets are in the order of the rows, which is already right for keys that are series of
+    # their own. Keys that share the dates are put back in key order within each period.
+    if not layout.per_key:
+        result.sort(key=lambda row: (row[0], row[layout.key]))
+    return result
+
+
+# Indices of the points LTTB keeps out of len(xs), for one or more series over the same xs. The
+# area of a triangle is summed over the series, each scaled to its own range, so a point is kept
+# when it stands out in any of them. None values are left out of the areas.
+def lttb_indices(xs, series, max_points):
+    count = len(xs)
+    if count <= max_points:
+        return list(range(count))
+
+    scaled = []
+    for values in series:
+        present = [value for value in values if value is not None]
+        if not present:
+            continue
+        low, span = min(present), (max(present) - min(present)) or 1
+        scaled.append([None if value is None else (value - low) / span for value in values])
+
+    def average(values):
+        present = [value for value in values if value is not None]
+        return sum(present) / len(present) if present else None
+
+    every = (count - 2) / (max_points - 2)
+    selected = [0]
+    a = 0
+    for i in range(max_points - 2):
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, count)
+        average_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        averages = [average(values[next_start:next_end]) for values in scaled]
+
+        best, best_area = next_start - 1, -1
+        for j in range(int(i * every) + 1, next_start):
+            area = 0
+            for values, average_y in zip(scaled, averages):
+                if values[a] is None or values[j] is None or average_y is None:
+                    continue
+                area += abs((xs[a] - average_x) * (values[j] - values[a]) - (xs[a] - xs[j]) * (average_y - values[a]))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(count - 1)
+    return selected
+
+
+def _value_columns(layout, width):
+    return [column for column in range(1, width) if column != layout.key]
+
+
+# Keep at most max_points dates per series. A key that is a series of its own is downsampled on
+# its own values; keys that share the dates keep the same dates, chosen on all of their values.
+def downsample(rows, layout, max_points):
+    if not rows:
+        return rows
+    columns = _value_columns(layout, len(rows[0]))
+
+    if layout.per_key:
+        result = []
+        for key_rows in _runs(rows, layout.key):
+            xs = [row[0].toordinal() for row in key_rows]
+            series = [[row[column] for row in key_rows] for column in columns]
+            result.extend(key_rows[i] for i in lttb_indices(xs, series, max_points))
+        return result
+
+    dates = list(dict.fromkeys(row[0] for row in rows))
+    index = {date: i for i, date in enumerate(dates)}
+    series = {}
+    for row in rows:
+        for column in columns:
+            name = column if column in layout.shared else (row[layout.key], column)
+            series.setdefault(name, [None] * len(dates))[index[row[0]]] = row[column]
+    kept = {dates[i] for i in lttb_indices([date.toordinal() for date in dates], series.values(), max_points)}
+    return [row for row in rows if row[0] in kept]
+
+
+# Consecutive rows with the same value in the key column
+def _runs(rows, key):
+    run = []
+    for row in rows:
+        if run and row[key] != run[0][key]:
+            yield run
+            run = []
+        run.append(row)
+    if run:
+        yield run
+
+
+# The rows of a query at the resolution the request asked for
+def resample(query_name, data, rows):
+    granularity, max_points = resolution_options(query_name, data)
+    layout = LAYOUTS[query_name]
+    if granularity is not None and granularity != layout.granularity:
+        rows = coarsen(rows, layout, granularity)
+    if max_points is not None:
+        rows = downsample(rows, layout, max_points)
+    return rows
+
+
+# Same for a streamed query. Resampling needs every row, so when it is asked for the rows are
+# collected and come out as one batch.
+def resample_batches(query_name, data, batches):
+    if resolution_options(query_name, data) == (None, None):
+        yield from batches
+        return
+    yield resample(query_name, data, [row for batch in batches for row in batch])
+
+
+async def resample_batches_async(query_name, data, batches):
+    if resolution_options(query_name, data) == (None, None):
+        async for batch in batches:
+            yield batch
+        return
+    rows = []
+    async for batch in batches:
+        rows.extend(batch)
+    yield resample(query_name, data, rows)
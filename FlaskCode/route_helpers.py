@@ -0,0 +1,289 @@
+from collections import defaultdict
+from itertools import groupby
+import math
+import os
+
+import binary_response
+from binary_response import DATE, FLOAT, STRING
+from dataset import MOBILITY_TYPES, PROFIT_THRESHOLD_STEP, QUERY2_SERIES, SECTOR_STATISTICS
+from db_settings import PoolTimeoutError
+from dimensions import UnknownStatesError, dimensions
+from resolution import ResolutionError, resolution_options
+from row_counts import row_count_cache
+
+# Request parsing and response shapes shared by app.py (Flask) and asgi.py (Quart), so both apps
+# validate a request the same way and send the same JSON. Imports neither web framework nor a
+# database driver.
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Queries whose routes can stream NDJSON, and those that can answer in a binary encoding
+NDJSON_QUERIES = ("query1", "query2", "query4", "query1_batch", "query2_batch")
+ENCODED_QUERIES = ("query1", "query2", "query4")
+
+# Seconds /dashboard waits for its queries. A query still running then is reported as timed out and
+# goes on in the background, so its result still lands in the result cache.
+DASHBOARD_TIMEOUT_SECONDS = float(os.getenv('DASHBOARD_TIMEOUT_SECONDS', '30'))
+DASHBOARD_TIMEOUT_ERROR = "Timed out after {} seconds".format(DASHBOARD_TIMEOUT_SECONDS)
+
+# Query whose granularity and max_points options apply to each /dashboard query
+RESOLUTION_QUERIES = {"query1_batch": "query1", "query2_batch": "query2"}
+
+
+# Streaming mode is requested with "format": "ndjson" in the body or an Accept: application/x-ndjson header.
+def wants_ndjson(data, accept_mimetypes):
+    if data.get('format') == 'ndjson':
+        return True
+    return accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+# The parameters a query request is counted with for the warm-up (see warmup.py), with the response
+# format negotiated as its route does: an encoding asked for in the Accept header is added as
+# "format", so the warm-up fills the cache entry the request reads. None for an NDJSON stream,
+# which does not go through the caches.
+def warmup_params(name, data, accept_mimetypes):
+    if name in NDJSON_QUERIES and wants_ndjson(data, accept_mimetypes):
+        return None
+    if name in ENCODED_QUERIES:
+        encoding = binary_response.requested_encoding(data, accept_mimetypes)
+        if encoding is not None:
+            return dict(data, format=encoding)
+    return data
+
+
+# Reject unknown state names before a query runs, from the in-memory dimensions (see dimensions.py).
+# Raises UnknownStatesError, which is answered with a 400. None is every state.
+def check_states(input_states):
+    if input_states is not None:
+        dimensions.state_codes(input_states)
+
+
+# If no mobility_types specified, send back data about all of them. Unknown types are ignored.
+def selected_mobility_types(data):
+    requested_mobility_types = data.get('mobility_types', [])
+    if len(requested_mobility_types) == 0:
+        return tuple(MOBILITY_TYPES)
+    return tuple(m for m in MOBILITY_TYPES if m in requested_mobility_types)
+
+
+def shape_query1_rows(result, input_state, mobility_types, response_format):
+    # Columnar mode: one array per series, built by transposing the rows in one go.
+    if response_format == 'columnar':
+        columns = list(zip(*result)) or [()] * (3 + len(mobility_types))
+        res_columns = {
+            "state": input_state,
+            "dates": list(columns[0]),
+            "infected_population_percent": list(columns[2]),
+        }
+        for i, mobility_type in enumerate(mobility_types):
+            res_columns[mobility_type] = list(columns[3 + i])
+        return res_columns
+
+    return [dict(zip(query1_keys(mobility_types), row)) for row in result]
+
+
+def query1_keys(mobility_types):
+    return ("date", "state", "infected_population_percent") + mobility_types
+
+
+def query1_columns(result, mobility_types):
+    columns = list(zip(*result)) or [()] * (3 + len(mobility_types))
+    types = (DATE, STRING, FLOAT) + (FLOAT,) * len(mobility_types)
+    return list(zip(query1_keys(mobility_types), types, columns))
+
+
+QUERY2_COLUMNS = (("date", DATE), ("state", STRING)) + tuple((name, FLOAT) for name in QUERY2_SERIES)
+
+
+def shape_query2_rows(result):
+    res_list = []
+    for row in result:
+        data = {
+            "date": row[0],
+            "state": row[1],
+            "avg_monthly_sni_covid19_vaccination": row[2],
+            "avg_monthly_sni_vaccination_intent": row[3],
+            "avg_monthly_sni_safety_side_effects": row[4],
+            "vaccination_rate": row[5]
+        }
+
+        res_list.append(data)
+
+    return res_list
+
+
+def query2_columns(result):
+    columns = list(zip(*result)) or [()] * len(QUERY2_COLUMNS)
+    return [(name, column_type, values) for (name, column_type), values in zip(QUERY2_COLUMNS, columns)]
+
+
+# Raised for a "states" value that is neither a list of state names nor "all". Answered with a 400.
+class InvalidStatesError(ValueError):
+    pass
+
+
+# "states" is either a list of state names or "all"
+def batch_states(data):
+    states = data.get('states', [])
+    if states == "all":
+        return None
+    if not isinstance(states, list) or not all(isinstance(state, str) for state in states):
+        raise InvalidStatesError('states must be a list of state names or "all"')
+    return sorted(set(states))
+
+
+# Rows are ordered by state, so they can be grouped in a single pass.
+def group_rows_by_state(result, state_column=1):
+    return groupby(result, key=lambda row: row[state_column])
+
+
+# Key of the per-sector values in the query3 response for each statistic
+QUERY3_STATISTIC_KEYS = {
+    "percent_in_profit": "sectorwise_percent_of_companies_in_profit",
+    "median_return": "sectorwise_median_return_percent",
+    "breadth": "sectorwise_breadth_percent",
+}
+
+
+# statistic and profit_threshold from the request body. The threshold is a return in percent and
+# only applies to percent_in_profit. Raises ValueError for values the query cannot answer.
+def query3_options(data):
+    statistic = data.get('statistic', 'percent_in_profit')
+    if statistic not in SECTOR_STATISTICS:
+        raise ValueError("statistic must be one of: {}".format(", ".join(SECTOR_STATISTICS)))
+
+    profit_threshold = data.get('profit_threshold', 0)
+    if (isinstance(profit_threshold, bool) or not isinstance(profit_threshold, (int, float))
+            or not math.isfinite(profit_threshold)):
+        raise ValueError("profit_threshold must be a number")
+    steps = round(profit_threshold / PROFIT_THRESHOLD_STEP)
+    if abs(profit_threshold - steps * PROFIT_THRESHOLD_STEP) > 1e-9:
+        raise ValueError("profit_threshold must be a multiple of {}".format(PROFIT_THRESHOLD_STEP))
+    if statistic != "percent_in_profit":
+        steps = 0
+
+    return statistic, round(steps * PROFIT_THRESHOLD_STEP, 10)
+
+
+def shape_query3_rows(result, statistic):
+    values_key = QUERY3_STATISTIC_KEYS[statistic]
+    res_map = {}
+    for row in result:
+        if str(row[0]) not in res_map:
+            res_map[str(row[0])] = {}
+            res_map[str(row[0])]["no_of_tested_people_per_100000_people"] = row[1]
+            res_map[str(row[0])][values_key] = {}
+
+        res_map[str(row[0])][values_key][row[3]] = row[2]        
+
+    return res_map
+
+
+def shape_query4_rows(result):
+    res_list = []
+    date_mapping = defaultdict(lambda: {})
+    for row in result:
+        if row[0] not in date_mapping: date_mapping[row[0]] = { "date": row[0] }
+        date_mapping[row[0]][row[1]] = row[2]
+        # data = {
+        #     "date": row[0],
+        #     "physician_category": row[1],
+        #     "avg_ratio_of_deaths_to_hospitalized_people": row[2]
+        # }
+
+    res_list = date_mapping.values()
+    return list(res_list)
+
+
+# One column per physician category next to the dates, with None for months a category has no value for
+def query4_columns(result):
+    dates = list(dict.fromkeys(row[0] for row in result))
+    categories = defaultdict(dict)
+    for row in result:
+        categories[row[1]][row[0]] = row[2]
+
+    columns = [("date", DATE, dates)]
+    for category, values in categories.items():
+        columns.append((category, FLOAT, [values.get(date) for date in dates]))
+    return columns
+
+
+def shape_query5_rows(result):
+    res_map = {}
+    for row in result:
+        if str(row[0]) not in res_map:
+            res_map[str(row[0])] = {}
+            res_map[str(row[0])]["mortality_rate_100000"] = row[3]
+            res_map[str(row[0])]["stringency_categories"] = {
+                "0-19": 0,
+                "20-39": 0,
+                "40-59": 0,
+                "60-79": 0,
+                "80-100": 0
+            }
+
+        res_map[str(row[0])]["stringency_categories"][row[1]] = row[2]    
+
+    return res_map
+
+
+# Row counts for each table and the total. By default the counts come from memory: exact counts
+# recomputed in the background, or the optimizer statistics until the first refresh has finished.
+# The response says which one it is and how old it is. mode=exact runs the COUNT(*) scans right away.
+def run_row_count(data=None):
+    if (data or {}).get('mode') == 'exact':
+        return row_count_cache.refresh_exact()
+    return row_count_cache.get()
+
+
+# Raised for a /dashboard body that is not an object mapping query names to parameter objects, or
+# with parameters a query's route would reject. Answered with a 400.
+class DashboardRequestError(ValueError):
+    pass
+
+
+# Check the parameters of a query the way its route does
+def check_query_params(name, params):
+    if name in ("query1", "query2"):
+        check_states([params.get('state')])
+    elif name in ("query1_batch", "query2_batch"):
+        check_states(batch_states(params))
+    elif name == "query3":
+        query3_options(params)
+    if name != "row_count":
+        resolution_options(RESOLUTION_QUERIES.get(name, name), params)
+
+
+# The parameters of each query of a /dashboard body (None for the defaults), all checked before
+# any of them runs. Raises DashboardRequestError naming the first query that is not valid.
+def dashboard_params(data, query_names):
+    if not isinstance(data, dict):
+        raise DashboardRequestError("The body must be an object mapping query names to their parameters")
+    unknown = [name for name in data if name != "row_count" and name not in query_names]
+    if unknown:
+        raise DashboardRequestError("Unknown queries: {}".format(", ".join(unknown)))
+
+    queries = {}
+    for name, params in data.items():
+        params = {} if params is None else params
+        if not isinstance(params, dict):
+            raise DashboardRequestError("The parameters of {} must be an object".format(name))
+        try:
+            check_query_params(name, params)
+        except ValueError as e:
+            raise DashboardRequestError("{}: {}".format(name, e)) from e
+        queries[name] = params
+    return queries
+
+
+# Errors raised by this code whose message is meant for the client. The message of any other error
+# of a /dashboard query, e.g. from the database driver, is only logged.
+CLIENT_ERRORS = (UnknownStatesError, InvalidStatesError, ResolutionError, PoolTimeoutError)
+
+
+# Error reported for a /dashboard query that failed while it ran
+def dashboard_error(name, e):
+    if isinstance(e, CLIENT_ERRORS):
+        return str(e)
+    print("Dashboard query {} failed: {!r}".format(name, e))
+    return "Query failed"
@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from data_access import backend
+
+# How often the exact COUNT(*) of every table is recomputed in the background.
+ROW_COUNT_REFRESH_SECONDS = int(os.getenv('ROW_COUNT_REFRESH_SECONDS', '3600'))
+
+
+# Keeps the latest exact counts in memory and recomputes them on a background thread, so the
+# endpoint never waits for the COUNT(*) scans.
+class RowCountCache:
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._exact = None
+        self._exact_as_of = None
+        self._statistics = None
+        self._statistics_as_of = None
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='row-count-refresh', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._refresh()
+            time.sleep(self.refresh_seconds)
+
+    def _refresh(self):
+        try:
+            self.refresh_exact()
+        except Exception as e:
+            print("Row count refresh failed: {}".format(e))
+
+    # Recompute the exact counts now instead of at the next scheduled refresh, on a thread of its
+    # own. Used when the data has been reloaded (see data_version.py).
+    def refresh_soon(self):
+        threading.Thread(target=self._refresh, name='row-count-refresh-now', daemon=True).start()
+
+    def refresh_exact(self):
+        counts = backend.exact_row_counts()
+        as_of = datetime.now(timezone.utc)
+        with self._lock:
+            self._exact = counts
+            self._exact_as_of = as_of
+        return self._response(counts, "exact", as_of)
+
+    # Exact counts when the background job has produced them, dictionary statistics until then.
+    def get(self):
+        self.start()
+        with self._lock:
+            if self._exact is not None:
+                return self._response(self._exact, "exact", self._exact_as_of)
+
+        with self._lock:
+            statistics = self._statistics
+            statistics_as_of = self._statistics_as_of
+        if statistics is None:
+            statistics, statistics_as_of = backend.statistics_row_counts()
+            with self._lock:
+                self._statistics = statistics
+                self._statistics_as_of = statistics_as_of
+        return self._response(statistics, "statistics", statistics_as_of)
+
+    @staticmethod
+    def _response(counts, source, as_of):
+        res_map = dict(counts)
+        res_map["source"] = source
+        if as_of is not None and as_of.tzinfo is None:
+            as_of = as_of.replace(tzinfo=timezone.utc)
+        res_map["as_of"] = as_of.isoformat() if as_of is not None else None
+        res_map["age_seconds"] = (
+            round((datetime.now(timezone.utc) - as_of).total_seconds()) if as_of is not None else None
+        )
+        return res_map
+
+
+row_count_cache = RowCountCache(ROW_COUNT_REFRESH_SECONDS)
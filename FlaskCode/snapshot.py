@@ -0,0 +1,65 @@
+import os
+import sys
+
+import cx_Oracle
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from dataset import DATASET_TABLES, LOOKUP_TABLES, SNAPSHOT_DIR
+from db import get_connection
+from db_settings import DB_ARRAYSIZE
+
+
+# Arrow type of an Oracle column, from the cursor description
+def arrow_type(column):
+    _, type_code, _, _, precision, scale, _ = column
+    if type_code in (cx_Oracle.DB_TYPE_DATE, cx_Oracle.DB_TYPE_TIMESTAMP):
+        return pa.timestamp('s')
+    if type_code is cx_Oracle.DB_TYPE_NUMBER:
+        return pa.int64() if precision and scale == 0 else pa.float64()
+    if type_code in (cx_Oracle.DB_TYPE_BINARY_FLOAT, cx_Oracle.DB_TYPE_BINARY_DOUBLE):
+        return pa.float64()
+    return pa.string()
+
+
+# Copy one Oracle table to <snapshot_dir>/<name>.parquet, DB_ARRAYSIZE rows at a time.
+# Column names are lower-cased, which is how local_backend.py refers to them.
+def export_table(connection, name, owner, table_name, snapshot_dir):
+    cursor = connection.cursor()
+    cursor.arraysize = DB_ARRAYSIZE
+    cursor.execute('SELECT * FROM "{}"."{}"'.format(owner, table_name))
+    schema = pa.schema([(column[0].lower(), arrow_type(column)) for column in cursor.description])
+
+    path = os.path.join(snapshot_dir, name + '.parquet')
+    row_count = 0
+    with pq.ParquetWriter(path + '.tmp', schema) as writer:
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            columns = [[row[i] for row in rows] for i in range(len(schema))]
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+            ))
+            row_count += len(rows)
+    cursor.close()
+
+    # Replaced in one step so a running app never reads a half-written file
+    os.replace(path + '.tmp', path)
+    print("{}: {} rows".format(path, row_count))
+
+
+def export_snapshot(snapshot_dir):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    with get_connection() as connection:
+        for name, owner, table_name in DATASET_TABLES + LOOKUP_TABLES:
+            export_table(connection, name, owner, table_name, snapshot_dir)
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else "export"
+    if command == "export":
+        export_snapshot(sys.argv[2] if len(sys.argv) > 2 else SNAPSHOT_DIR)
+    else:
+        print("Usage: python snapshot.py export [snapshot_dir]")
+        sys.exit(1)
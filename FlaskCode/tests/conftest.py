@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The app modules are imported by name from FlaskCode/, as the app and scripts do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Never reach Oracle or start the warm-up thread from the tests. The route tests read the Parquet
+# snapshot in SNAPSHOT_DIR (see snapshot.py) and are skipped without one.
+os.environ.setdefault("DATA_BACKEND", "memory")
+os.environ.setdefault("WARMUP_TOP_N", "0")
@@ -0,0 +1,63 @@
+from datetime import date, datetime, timezone
+
+import msgpack
+import pyarrow as pa
+
+import binary_response
+from binary_response import DATE, FLOAT, INTEGER, STRING
+
+COLUMNS = [
+    ("date", DATE, [datetime(2021, 1, 4), datetime(2021, 1, 11), datetime(2021, 1, 18)]),
+    ("state", STRING, ["Alabama", "Alabama", "California"]),
+    ("infected_population_percent", FLOAT, [0.5, None, 1.25]),
+    ("no_of_states", INTEGER, [3, 0, 12]),
+]
+
+
+def test_arrow_round_trip():
+    body = binary_response.encode("arrow", COLUMNS)
+
+    table = pa.ipc.open_stream(body).read_all()
+
+    assert table.schema.names == ["date", "state", "infected_population_percent", "no_of_states"]
+    assert table.schema.field("date").type == pa.date32()
+    assert pa.types.is_dictionary(table.schema.field("state").type)
+    assert table.column("date").to_pylist() == [date(2021, 1, 4), date(2021, 1, 11), date(2021, 1, 18)]
+    assert table.column("state").to_pylist() == ["Alabama", "Alabama", "California"]
+    assert table.column("infected_population_percent").to_pylist() == [0.5, None, 1.25]
+    assert table.column("no_of_states").to_pylist() == [3, 0, 12]
+
+
+def test_msgpack_round_trip():
+    body = binary_response.encode("msgpack", COLUMNS)
+
+    unpacked = msgpack.unpackb(body, timestamp=3)
+
+    assert list(unpacked) == ["date", "state", "infected_population_percent", "no_of_states"]
+    # Naive datetimes are sent as UTC
+    assert unpacked["date"] == [value.replace(tzinfo=timezone.utc) for value in COLUMNS[0][2]]
+    assert unpacked["state"] == ["Alabama", "Alabama", "California"]
+    assert unpacked["infected_population_percent"] == [0.5, None, 1.25]
+    assert unpacked["no_of_states"] == [3, 0, 12]
+
+
+def test_empty_columns_encode():
+    columns = [(name, column_type, []) for name, column_type, _ in COLUMNS]
+
+    assert pa.ipc.open_stream(binary_response.encode("arrow", columns)).read_all().num_rows == 0
+    assert msgpack.unpackb(binary_response.encode("msgpack", columns))["date"] == []
+
+
+class Accept:
+    def __init__(self, best):
+        self.best = best
+
+    def best_match(self, mimetypes):
+        return self.best if self.best in mimetypes else mimetypes[0]
+
+
+def test_encoding_is_requested_with_format_or_accept():
+    assert binary_response.requested_encoding({"format": "arrow"}, Accept("application/json")) == "arrow"
+    assert binary_response.requested_encoding({}, Accept("application/vnd.msgpack")) == "msgpack"
+    assert binary_response.requested_encoding({}, Accept("application/x-msgpack")) == "msgpack"
+    assert binary_response.requested_encoding({"format": "columnar"}, Accept("application/json")) is None
@@ -0,0 +1,189 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+import cache
+from cache import SingleFlight, TTLCache, estimate_size, make_key, normalize_params
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    result_cache = TTLCache(2, 1024, 60)
+    result_cache.set("a", 1)
+    result_cache.set("b", 2)
+    result_cache.get("a")
+    result_cache.set("c", 3)
+
+    assert result_cache.get("a") == (True, 1)
+    assert result_cache.get("b") == (False, None)
+    assert result_cache.get("c") == (True, 3)
+    assert result_cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    result_cache = TTLCache(8, 1024, 60)
+    result_cache.set("a", [1, 2, 3])
+
+    now[0] += 59
+    assert result_cache.get("a") == (True, [1, 2, 3])
+    now[0] += 2
+    assert result_cache.get("a") == (False, None)
+    assert result_cache.stats()["entries"] == 0
+
+
+def test_byte_limit_evicts_and_skips_oversized_results():
+    result_cache = TTLCache(8, 100, 60)
+    result_cache.set("a", b"x" * 60)
+    result_cache.set("b", b"x" * 60)
+
+    assert result_cache.get("a") == (False, None)
+    assert result_cache.get("b")[0]
+    assert result_cache.stats()["bytes"] == 60
+
+    result_cache.set("c", b"x" * 101)
+    assert result_cache.get("c") == (False, None)
+    assert result_cache.get("b")[0]
+
+
+def test_results_computed_before_an_invalidation_are_not_stored():
+    result_cache = TTLCache(8, 1024, 60)
+    result_cache.set("a", 1)
+    generation = result_cache.generation
+
+    result_cache.invalidate()
+    result_cache.set("b", 2, generation)
+    result_cache.set("c", 3, result_cache.generation)
+
+    assert result_cache.get("a") == (False, None)
+    assert result_cache.get("b") == (False, None)
+    assert result_cache.get("c") == (True, 3)
+    assert result_cache.stats()["bytes"] == estimate_size(3)
+
+
+def test_size_counts_a_list_as_its_first_row_times_its_length():
+    row = {"date": datetime(2021, 1, 1), "state": "Alabama", "value": 1.5}
+
+    assert estimate_size([row] * 10) == 2 + 10 * (estimate_size(row) + 1)
+    assert estimate_size([]) == 2
+    assert estimate_size(b"abc") == 3
+
+
+def test_concurrent_identical_computations_run_once():
+    in_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(in_flight.run("k", compute)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(in_flight.run("k", compute))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    wait_until(lambda: in_flight.stats()["coalesced"] == 3)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert in_flight.stats() == {"in_flight": 0, "executions": 1, "coalesced": 3}
+
+
+def test_waiting_callers_get_the_exception_of_the_computation():
+    in_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("query failed")
+
+    errors = []
+
+    def call():
+        try:
+            in_flight.run("k", compute)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    wait_until(lambda: in_flight.stats()["coalesced"] == 1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert errors == ["query failed"] * 2
+    # Nothing is kept, the next call runs again
+    with pytest.raises(RuntimeError):
+        in_flight.run("k", compute)
+    assert in_flight.stats()["executions"] == 2
+
+
+def test_concurrent_identical_coroutines_run_once():
+    in_flight = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*(in_flight.run_async("k", compute) for _ in range(4)))
+
+    assert asyncio.run(main()) == ["result"] * 4
+    assert len(calls) == 1
+    assert in_flight.stats()["coalesced"] == 3
+
+
+def test_params_are_normalized():
+    data = {
+        "sectors": ["Utilities", "Energy"],
+        "start_date": " 01-jan-21 ",
+        "state": " California ",
+        "mobility_types": ["b", "a"],
+        "profit_threshold": 0.5,
+    }
+
+    assert normalize_params(data) == {
+        "sectors": ["Energy", "Utilities"],
+        "start_date": "01-JAN-21",
+        "state": "California",
+        "mobility_types": ["a", "b"],
+        "profit_threshold": 0.5,
+    }
+    assert normalize_params(None) == {}
+
+
+def test_keys_only_differ_for_different_requests():
+    key = make_key("query3", {"sectors": ["Energy", "Utilities"], "start_date": "01-JAN-21"})
+
+    assert make_key("query3", {"start_date": "01-jan-21", "sectors": ["Utilities", "Energy"]}) == key
+    assert make_key("query3", {"sectors": ["Energy"], "start_date": "01-JAN-21"}) != key
+    assert make_key("query3.arrow", {"sectors": ["Energy", "Utilities"], "start_date": "01-JAN-21"}) != key
+    # A list of mixed types still gets a key, so the route can reject it
+    assert make_key("query1_batch", {"states": ["Alabama", 3]}) == make_key("query1_batch", {"states": [3, "Alabama"]})
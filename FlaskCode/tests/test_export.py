@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from export import QUEUE_BATCHES, date_ranges, iter_partition_batches
+
+
+def test_ranges_cover_the_dates_in_whole_partitions():
+    # Partitions start on the first of a month, the first and last one are cut at the requested dates
+    assert date_ranges("15-JAN-21", "10-JUL-21", 3) == [
+        ("15-JAN-21", "31-MAR-21"), ("01-APR-21", "30-JUN-21"), ("01-JUL-21", "10-JUL-21"),
+    ]
+    assert date_ranges("01-JAN-21", "31-DEC-21", 6) == [("01-JAN-21", "30-JUN-21"), ("01-JUL-21", "31-DEC-21")]
+    assert date_ranges("2021-11-01", "2022-02-15", 2) == [("01-NOV-21", "31-DEC-21"), ("01-JAN-22", "15-FEB-22")]
+    assert date_ranges("10-MAR-21", "10-MAR-21", 3) == [("10-MAR-21", "10-MAR-21")]
+
+
+@pytest.mark.parametrize("start_date, end_date", [("01-FEB-21", "01-JAN-21"), ("someday", "01-JAN-21"), (None, None)])
+def test_invalid_ranges_are_rejected(start_date, end_date):
+    with pytest.raises(ValueError):
+        date_ranges(start_date, end_date, 3)
+
+
+def test_batches_come_out_partition_after_partition():
+    partitions = [lambda i=i: iter([[(i, 0)], [(i, 1)]]) for i in range(4)]
+
+    batches = list(iter_partition_batches(partitions, 3))
+
+    assert batches == [[(i, j)] for i in range(4) for j in range(2)]
+
+
+def test_a_failed_partition_raises_in_the_reader():
+    def failing():
+        yield [("a",)]
+        raise RuntimeError("query failed")
+
+    batches = iter_partition_batches([lambda: iter([[("first",)]]), failing], 2)
+
+    assert next(batches) == [("first",)]
+    assert next(batches) == [("a",)]
+    with pytest.raises(RuntimeError, match="query failed"):
+        next(batches)
+
+
+# A partition that yields batches until the export stops reading, and records that it was closed
+class EndlessPartition:
+    def __init__(self):
+        self.closed = threading.Event()
+        self.batches = 0
+
+    def __call__(self):
+        try:
+            while True:
+                self.batches += 1
+                yield [(self.batches,)]
+        finally:
+            self.closed.set()
+
+
+def test_closing_the_reader_stops_and_closes_every_partition():
+    partitions = [EndlessPartition() for _ in range(3)]
+    never_started = EndlessPartition()
+
+    batches = iter_partition_batches(partitions + [never_started], 3)
+    assert next(batches) == [(1,)]
+    batches.close()
+
+    for partition in partitions:
+        assert partition.closed.is_set()
+        # Each stopped with at most a full queue of batches waiting
+        assert partition.batches <= QUEUE_BATCHES + 2
+    assert never_started.batches == 0
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+werkzeug_test = pytest.importorskip("werkzeug.test")
+from werkzeug.datastructures import MultiDict
+from werkzeug.wrappers import Response
+
+import http_cache
+
+LOADED_AT = datetime(2021, 6, 1, 12, 30, 15, 250000, tzinfo=timezone.utc)
+
+
+def make_request(headers=None):
+    return werkzeug_test.EnvironBuilder(headers=headers or {}).get_request()
+
+
+def test_etag_depends_on_the_data_version_request_and_accept_header():
+    etag = http_cache.make_etag(LOADED_AT, "/query3", {"sectors": ["Energy", "Utilities"]}, None)
+
+    assert http_cache.make_etag(LOADED_AT, "/query3", {"sectors": ["Utilities", "Energy"]}, None) == etag
+    assert http_cache.make_etag(LOADED_AT + timedelta(seconds=1), "/query3", {"sectors": ["Energy", "Utilities"]},
+                                None) != etag
+    assert http_cache.make_etag(LOADED_AT, "/query3", {"sectors": ["Energy"]}, None) != etag
+    assert http_cache.make_etag(LOADED_AT, "/query3", {"sectors": ["Energy", "Utilities"]},
+                                "application/x-ndjson") != etag
+
+
+def test_matching_if_none_match_is_not_modified():
+    etag = http_cache.make_etag(LOADED_AT, "/query5", {"party": "D"}, None)
+
+    assert http_cache.is_not_modified(make_request({"If-None-Match": 'W/"{}"'.format(etag)}), etag, LOADED_AT)
+    assert not http_cache.is_not_modified(make_request({"If-None-Match": 'W/"other"'}), etag, LOADED_AT)
+    assert not http_cache.is_not_modified(make_request(), etag, LOADED_AT)
+
+
+def test_if_none_match_takes_precedence_over_if_modified_since():
+    request = make_request({"If-None-Match": 'W/"other"', "If-Modified-Since": "Tue, 01 Jun 2021 12:30:15 GMT"})
+
+    assert not http_cache.is_not_modified(request, "etag", LOADED_AT)
+
+
+def test_if_modified_since_compares_whole_seconds():
+    assert http_cache.is_not_modified(make_request({"If-Modified-Since": "Tue, 01 Jun 2021 12:30:15 GMT"}),
+                                      "etag", LOADED_AT)
+    assert not http_cache.is_not_modified(make_request({"If-Modified-Since": "Tue, 01 Jun 2021 12:30:14 GMT"}),
+                                          "etag", LOADED_AT)
+
+
+def test_validators_are_weak_and_vary_on_accept(monkeypatch):
+    monkeypatch.setattr(http_cache, "HTTP_CACHE_MAX_AGE", 0)
+    response = Response()
+    http_cache.set_validators(response, "abc", LOADED_AT)
+
+    assert response.headers["ETag"] == 'W/"abc"'
+    assert response.headers["Last-Modified"] == "Tue, 01 Jun 2021 12:30:15 GMT"
+    assert "Accept" in response.vary
+    assert response.headers["Cache-Control"] == "no-cache"
+
+
+def test_query_string_is_read_like_a_json_body():
+    args = MultiDict([
+        ("sectors", "Energy,Utilities"), ("sectors", "Health Care"), ("states", "all"),
+        ("profit_threshold", "0.5"), ("max_points", "abc"), ("state", "California"),
+    ])
+
+    assert http_cache.query_string_data(args) == {
+        "sectors": ["Energy", "Utilities", "Health Care"],
+        "states": "all",
+        "profit_threshold": 0.5,
+        "max_points": "abc",
+        "state": "California",
+    }
@@ -0,0 +1,162 @@
+from datetime import datetime, timedelta
+
+import cache
+from cache import RangeCache
+
+# RangeCache with a fetch that serves one row per day from a fixed series and records the
+# (start, end) ranges it was asked for.
+
+
+def day(text):
+    return datetime.strptime(text, "%Y-%m-%d")
+
+
+def daily_rows(start, end):
+    rows = []
+    date = start
+    while date <= end:
+        rows.append((date, date.toordinal()))
+        date += timedelta(days=1)
+    return rows
+
+
+class Fetcher:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, start, end):
+        self.calls.append((start, end))
+        return daily_rows(start, end)
+
+
+def test_range_inside_the_cached_one_is_sliced_without_a_fetch():
+    range_cache = RangeCache(8)
+    fetch = Fetcher()
+    range_cache.get_rows("k", "2021-01-01", "2021-01-31", fetch)
+
+    rows = range_cache.get_rows("k", "2021-01-10", "2021-01-20", fetch)
+
+    assert rows == daily_rows(day("2021-01-10"), day("2021-01-20"))
+    assert fetch.calls == [(day("2021-01-01"), day("2021-01-31"))]
+    assert range_cache.stats()["hits"] == 1
+
+
+def test_left_and_right_edges_are_fetched_and_merged():
+    range_cache = RangeCache(8)
+    fetch = Fetcher()
+    range_cache.get_rows("k", "2021-01-10", "2021-01-20", fetch)
+
+    rows = range_cache.get_rows("k", "2021-01-05", "2021-01-25", fetch)
+
+    assert rows == daily_rows(day("2021-01-05"), day("2021-01-25"))
+    assert fetch.calls[1:] == [
+        (day("2021-01-05"), day("2021-01-09")),
+        (day("2021-01-21"), day("2021-01-25")),
+    ]
+    assert range_cache.stats()["partial_hits"] == 1
+
+    # The merged series now covers the whole range
+    assert range_cache.get_rows("k", "2021-01-05", "2021-01-25", fetch) == rows
+    assert len(fetch.calls) == 3
+
+
+def test_adjacent_range_extends_the_cached_series():
+    range_cache = RangeCache(8)
+    fetch = Fetcher()
+    range_cache.get_rows("k", "2021-01-01", "2021-01-10", fetch)
+
+    rows = range_cache.get_rows("k", "2021-01-11", "2021-01-15", fetch)
+
+    assert rows == daily_rows(day("2021-01-11"), day("2021-01-15"))
+    assert fetch.calls[1:] == [(day("2021-01-11"), day("2021-01-15"))]
+    assert range_cache.get_rows("k", "2021-01-01", "2021-01-15", fetch) == daily_rows(day("2021-01-01"),
+                                                                                         day("2021-01-15"))
+    assert len(fetch.calls) == 2
+
+
+def test_disjoint_range_replaces_the_cached_series():
+    range_cache = RangeCache(8)
+    fetch = Fetcher()
+    range_cache.get_rows("k", "2021-01-01", "2021-01-10", fetch)
+
+    rows = range_cache.get_rows("k", "2021-03-01", "2021-03-10", fetch)
+
+    assert rows == daily_rows(day("2021-03-01"), day("2021-03-10"))
+    assert fetch.calls[1:] == [(day("2021-03-01"), day("2021-03-10"))]
+
+    # The January rows were dropped, asking for them again fetches them
+    range_cache.get_rows("k", "2021-01-01", "2021-01-10", fetch)
+    assert fetch.calls[2:] == [(day("2021-01-01"), day("2021-01-10"))]
+
+
+def test_partial_months_are_always_fetched_with_whole_months():
+    range_cache = RangeCache(8)
+    fetch = Fetcher()
+    range_cache.get_rows("k", "2021-01-15", "2021-04-10", fetch, whole_months=True)
+
+    assert fetch.calls == [
+        (day("2021-01-15"), day("2021-01-31")),
+        (day("2021-02-01"), day("2021-03-31")),
+        (day("2021-04-01"), day("2021-04-10")),
+    ]
+
+    # The complete months are cached, the partial edges are fetched again
+    fetch.calls.clear()
+    rows = range_cache.get_rows("k", "2021-01-15", "2021-04-10", fetch, whole_months=True)
+    assert rows == daily_rows(day("2021-01-15"), day("2021-04-10"))
+    assert fetch.calls == [
+        (day("2021-01-15"), day("2021-01-31")),
+        (day("2021-04-01"), day("2021-04-10")),
+    ]
+
+
+def test_range_within_one_month_is_fetched_whole_with_whole_months():
+    range_cache = RangeCache(8)
+    fetch = Fetcher()
+    range_cache.get_rows("k", "2021-01-05", "2021-01-20", fetch, whole_months=True)
+    range_cache.get_rows("k", "2021-01-05", "2021-01-20", fetch, whole_months=True)
+
+    assert fetch.calls == [(day("2021-01-05"), day("2021-01-20"))] * 2
+    assert range_cache.stats()["series"] == 0
+
+
+def test_series_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    range_cache = RangeCache(8)
+    fetch = Fetcher()
+    range_cache.get_rows("k", "2021-01-01", "2021-01-31", fetch)
+
+    now[0] += cache.RESULT_CACHE_TTL - 1
+    range_cache.get_rows("k", "2021-01-01", "2021-01-31", fetch)
+    assert len(fetch.calls) == 1
+
+    now[0] += 2
+    range_cache.get_rows("k", "2021-01-01", "2021-01-31", fetch)
+    assert len(fetch.calls) == 2
+    assert range_cache.stats()["misses"] == 2
+
+
+def test_rows_fetched_during_an_invalidation_are_not_stored():
+    range_cache = RangeCache(8)
+
+    def fetch(start, end):
+        range_cache.invalidate()
+        return daily_rows(start, end)
+
+    rows = range_cache.get_rows("k", "2021-01-01", "2021-01-10", fetch)
+
+    assert rows == daily_rows(day("2021-01-01"), day("2021-01-10"))
+    assert range_cache.stats()["series"] == 0
+
+
+def test_least_recently_used_series_are_evicted():
+    range_cache = RangeCache(2)
+    fetch = Fetcher()
+    for key in ("a", "b", "a", "c"):
+        range_cache.get_rows(key, "2021-01-01", "2021-01-10", fetch)
+
+    fetch.calls.clear()
+    range_cache.get_rows("a", "2021-01-01", "2021-01-10", fetch)
+    range_cache.get_rows("b", "2021-01-01", "2021-01-10", fetch)
+    assert len(fetch.calls) == 1
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from resolution import LAYOUTS, ResolutionError, lttb_indices, resample, resolution_options
+
+
+def weeks(start, count):
+    return [start + timedelta(weeks=i) for i in range(count)]
+
+
+def test_finer_granularity_than_the_query_is_rejected():
+    with pytest.raises(ResolutionError):
+        resolution_options("query2", {"granularity": "week"})
+    assert resolution_options("query1", {"granularity": "week"}) == ("week", None)
+
+
+@pytest.mark.parametrize("max_points", [2, "10", True, 2.5])
+def test_invalid_max_points_is_rejected(max_points):
+    with pytest.raises(ResolutionError):
+        resolution_options("query1", {"max_points": max_points})
+
+
+def test_weeks_are_averaged_into_the_month_of_their_monday():
+    # 2021-01-25 is a Monday, its week ends in February but belongs to January
+    rows = [(date, "California", float(i)) for i, date in enumerate(weeks(datetime(2021, 1, 4), 5))]
+    rows += [(date, "Texas", None) for date in weeks(datetime(2021, 1, 4), 5)]
+
+    result = resample("query1", {"granularity": "month"}, rows)
+
+    assert result == [
+        (datetime(2021, 1, 1), "California", 1.5),
+        (datetime(2021, 2, 1), "California", 4.0),
+        (datetime(2021, 1, 1), "Texas", None),
+        (datetime(2021, 2, 1), "Texas", None),
+    ]
+
+
+def test_counts_average_over_every_month_of_a_quarter():
+    # query5: (month, category, no_of_states, mortality). The mortality rate is the party's for the
+    # month, the same in every category. A category missing in a month counts 0 states.
+    rows = [
+        (datetime(2021, 1, 1), "High", 3, 10.0),
+        (datetime(2021, 1, 1), "Low", 1, 10.0),
+        (datetime(2021, 2, 1), "High", 4, 30.0),
+        (datetime(2021, 3, 1), "High", 2, 50.0),
+    ]
+
+    result = resample("query5", {"granularity": "quarter"}, rows)
+
+    assert result == [
+        (datetime(2021, 1, 1), "High", 3.0, 30.0),
+        (datetime(2021, 1, 1), "Low", 0.3333, 30.0),
+    ]
+
+
+def test_lttb_keeps_the_ends_and_the_peak():
+    xs = list(range(20))
+    values = [0.0] * 20
+    values[7] = 100.0
+
+    kept = lttb_indices(xs, [values], 5)
+
+    assert len(kept) == 5
+    assert kept[0] == 0 and kept[-1] == 19
+    assert 7 in kept
+    assert kept == sorted(kept)
+
+
+def test_lttb_returns_everything_under_max_points():
+    assert lttb_indices([1, 2, 3], [[1.0, None, 3.0]], 5) == [0, 1, 2]
+
+
+def test_max_points_applies_per_state():
+    dates = weeks(datetime(2021, 1, 4), 30)
+    rows = [(date, state, float(i % 7)) for state in ("Alabama", "California") for i, date in enumerate(dates)]
+
+    result = resample("query1", {"max_points": 10}, rows)
+
+    for state in ("Alabama", "California"):
+        state_rows = [row for row in result if row[1] == state]
+        assert len(state_rows) == 10
+        assert state_rows[0][0] == dates[0] and state_rows[-1][0] == dates[-1]
+
+
+def test_max_points_keeps_the_same_dates_for_shared_keys():
+    # query4 rows are ordered by date then category, and every category keeps the same dates
+    dates = [datetime(2020 + i // 12, i % 12 + 1, 1) for i in range(24)]
+    rows = [(date, category, float((i * 7) % 5)) for i, date in enumerate(dates) for category in ("A", "B")]
+
+    result = resample("query4", {"max_points": 6}, rows)
+
+    a_dates = [row[0] for row in result if row[1] == "A"]
+    b_dates = [row[0] for row in result if row[1] == "B"]
+    assert len(a_dates) == 6
+    assert a_dates == b_dates
+    assert LAYOUTS["query4"].per_key is False
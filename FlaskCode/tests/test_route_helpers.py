@@ -0,0 +1,96 @@
+from datetime import datetime
+
+import pytest
+
+import route_helpers
+from dimensions import UnknownStatesError, dimensions
+from route_helpers import (
+    DashboardRequestError, InvalidStatesError, batch_states, dashboard_error, dashboard_params, group_rows_by_state,
+    warmup_params,
+)
+
+QUERY_NAMES = ("query1", "query2", "query3", "query4", "query5", "query1_batch", "query2_batch")
+
+DATES = {"start_date": "01-JAN-21", "end_date": "31-MAR-21"}
+
+
+# The dimensions of two states, instead of reading them from the backend
+@pytest.fixture
+def states(monkeypatch):
+    monkeypatch.setattr(dimensions, "_by_code", {"US_AL": None, "US_CA": None})
+    monkeypatch.setattr(dimensions, "_by_name", {"Alabama": ["US_AL"], "California": ["US_CA"]})
+
+
+def accept(*mimetypes):
+    datastructures = pytest.importorskip("werkzeug.datastructures")
+    return datastructures.MIMEAccept([(mimetype, 1) for mimetype in mimetypes])
+
+
+def test_batch_states_are_sorted_without_duplicates():
+    assert batch_states({"states": ["California", "Alabama", "California"]}) == ["Alabama", "California"]
+    assert batch_states({"states": "all"}) is None
+    assert batch_states({}) == []
+
+
+@pytest.mark.parametrize("states", ["Alabama", 5, None, {"Alabama": 1}, ["Alabama", 3]])
+def test_batch_states_must_be_a_list_of_names_or_all(states):
+    with pytest.raises(InvalidStatesError):
+        batch_states({"states": states})
+
+
+def test_rows_are_grouped_by_consecutive_state():
+    rows = [
+        (datetime(2021, 1, 4), "Alabama", 1.0),
+        (datetime(2021, 1, 11), "Alabama", 2.0),
+        (datetime(2021, 1, 4), "California", 3.0),
+    ]
+
+    groups = [(state, list(state_rows)) for state, state_rows in group_rows_by_state(rows)]
+
+    assert groups == [("Alabama", rows[:2]), ("California", rows[2:])]
+    assert [state for state, _ in group_rows_by_state(rows, state_column=2)] == [1.0, 2.0, 3.0]
+
+
+def test_dashboard_params_default_to_an_empty_object(states):
+    queries = dashboard_params({"query1": dict(DATES, state="Alabama"), "query4": None, "row_count": None},
+                               QUERY_NAMES)
+
+    assert queries == {"query1": dict(DATES, state="Alabama"), "query4": {}, "row_count": {}}
+
+
+@pytest.mark.parametrize("data, message", [
+    ([{"query1": {}}], "The body must be an object mapping query names to their parameters"),
+    ("query1", "The body must be an object mapping query names to their parameters"),
+    ({"query6": {}, "query1": {}}, "Unknown queries: query6"),
+    ({"query1": ["Alabama"]}, "The parameters of query1 must be an object"),
+    ({"query1": dict(DATES, state="Texas")}, "query1: Unknown states: Texas"),
+    ({"query2_batch": dict(DATES, states="Alabama")}, 'query2_batch: states must be a list of state names or "all"'),
+    ({"query3": dict(DATES, statistic="mean")}, "query3: statistic must be one of: "),
+    ({"query1_batch": dict(DATES, states="all", max_points=1)}, "query1_batch: max_points must be an integer"),
+    ({"query5": dict(DATES, party="D", granularity="week")}, "query5: query5 is computed per month"),
+])
+def test_dashboard_params_are_checked_like_their_routes(states, data, message):
+    with pytest.raises(DashboardRequestError) as error:
+        dashboard_params(data, QUERY_NAMES)
+
+    assert str(error.value).startswith(message)
+
+
+def test_dashboard_errors_only_carry_messages_of_the_app(capsys):
+    assert dashboard_error("query1", UnknownStatesError(["Texas"])) == "Unknown states: Texas"
+    assert dashboard_error("query1", RuntimeError("ORA-00942: table or view does not exist")) == "Query failed"
+    assert "ORA-00942" in capsys.readouterr().out
+
+
+def test_warmup_params_follow_the_format_negotiated_by_the_route():
+    data = dict(DATES, state="Alabama")
+    arrow = accept(route_helpers.binary_response.ARROW_MIMETYPE)
+
+    assert warmup_params("query1", data, accept("application/json")) == data
+    assert warmup_params("query1", data, arrow) == dict(data, format="arrow")
+    assert warmup_params("query1", dict(data, format="msgpack"), accept()) == dict(data, format="msgpack")
+    assert warmup_params("query1", dict(data, format="columnar"), accept()) == dict(data, format="columnar")
+    # NDJSON is streamed past the caches, query5 has no binary encoding
+    assert warmup_params("query1", data, accept(route_helpers.NDJSON_MIMETYPE)) is None
+    assert warmup_params("query1_batch", dict(data, format="ndjson"), accept()) is None
+    assert warmup_params("query5", data, arrow) == data
@@ -0,0 +1,128 @@
+import asyncio
+import importlib
+import os
+import time
+
+import pytest
+
+from cache import range_cache, result_cache
+from dataset import SNAPSHOT_DIR
+
+# /dashboard and conditional requests through both apps, on the memory backend (see conftest.py)
+
+pytestmark = pytest.mark.skipif(
+    not os.path.isdir(SNAPSHOT_DIR), reason="needs a snapshot in {} (python snapshot.py)".format(SNAPSHOT_DIR)
+)
+
+DATES = {"start_date": "01-JAN-21", "end_date": "31-MAR-21"}
+
+
+class FlaskClient:
+    def __init__(self, module):
+        self.module = module
+        self.client = module.app.test_client()
+
+    def request(self, method, path, **kwargs):
+        response = self.client.open(path, method=method, **kwargs)
+        return response.status_code, response.get_json(silent=True), response.headers
+
+    @staticmethod
+    def failing_query(data):
+        raise RuntimeError("ORA-00942: table or view does not exist")
+
+    @staticmethod
+    def slow_query(data):
+        time.sleep(0.3)
+        return {}
+
+
+class QuartClient:
+    def __init__(self, module):
+        self.module = module
+        self.client = module.app.test_client()
+
+    def request(self, method, path, **kwargs):
+        async def send():
+            response = await self.client.open(path, method=method, **kwargs)
+            return response.status_code, await response.get_json(silent=True), response.headers
+
+        return asyncio.run(send())
+
+    @staticmethod
+    async def failing_query(data):
+        raise RuntimeError("ORA-00942: table or view does not exist")
+
+    @staticmethod
+    async def slow_query(data):
+        await asyncio.sleep(0.3)
+        return {}
+
+
+@pytest.fixture(params=["app", "asgi"])
+def client(request):
+    if request.param == "app":
+        pytest.importorskip("flask")
+        pytest.importorskip("cx_Oracle")
+        client = FlaskClient(importlib.import_module("app"))
+    else:
+        pytest.importorskip("quart")
+        client = QuartClient(importlib.import_module("asgi"))
+    result_cache.invalidate()
+    range_cache.invalidate()
+    return client
+
+
+@pytest.mark.parametrize("body, error", [
+    ([{"query1": {}}], "The body must be an object mapping query names to their parameters"),
+    ({"query6": {}}, "Unknown queries: query6"),
+    ({"query5": "D"}, "The parameters of query5 must be an object"),
+    ({"query1": dict(DATES, state="Atlantis")}, "query1: Unknown states: Atlantis"),
+    ({"query1_batch": dict(DATES, states="Alabama")}, 'query1_batch: states must be a list of state names or "all"'),
+    ({"query3": dict(DATES, profit_threshold="high")}, "query3: profit_threshold must be a number"),
+])
+def test_dashboard_rejects_invalid_requests(client, body, error):
+    status, data, _ = client.request("POST", "/dashboard", json=body)
+
+    assert status == 400
+    assert data == {"error": error}
+
+
+def test_dashboard_reports_failed_queries_without_their_message(client, monkeypatch):
+    monkeypatch.setitem(client.module.DASHBOARD_QUERIES, "query5", client.failing_query)
+
+    status, data, _ = client.request("POST", "/dashboard", json={
+        "query5": dict(DATES, party="D"),
+        "query4": DATES,
+    })
+
+    assert status == 200
+    assert data["errors"] == {"query5": "Query failed"}
+    assert data["results"]["query5"] is None
+    assert data["results"]["query4"]
+
+
+def test_dashboard_stops_waiting_after_the_timeout(client, monkeypatch):
+    monkeypatch.setitem(client.module.DASHBOARD_QUERIES, "query4", client.slow_query)
+    monkeypatch.setattr(client.module, "DASHBOARD_TIMEOUT_SECONDS", 0.05)
+
+    status, data, _ = client.request("POST", "/dashboard", json={"query4": DATES, "query5": dict(DATES, party="D")})
+
+    assert status == 200
+    assert data["errors"] == {"query4": client.module.DASHBOARD_TIMEOUT_ERROR}
+    assert data["results"]["query5"]
+    assert data["timings_ms"]["total"] < 300
+
+
+def test_only_get_requests_are_revalidated(client):
+    path = "/query5?party=D&start_date=01-JAN-21&end_date=31-MAR-21"
+    status, _, headers = client.request("GET", path)
+    etag = headers["ETag"]
+
+    assert status == 200
+    assert client.request("GET", path, headers={"If-None-Match": etag})[0] == 304
+
+    status, data, headers = client.request("POST", "/query5", json=dict(DATES, party="D"),
+                                           headers={"If-None-Match": etag})
+    assert status == 200
+    assert data
+    assert "ETag" not in headers
@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from cache import make_key, normalize_params
+
+# Warm-up of the result and range caches, so the first requests after a deploy or a data load do
+# not wait for cold queries. The query routes count how often each normalized parameter set is
+# requested, response format included, so JSON rows, columnar JSON and encoded bodies are each
+# warmed in the cache entry their requests read. At startup and whenever the data version changes
+# (see data_version.py) the most requested ones are run again on a background thread, one at a
+# time so they do not crowd out requests on the session pool. The counts are saved to a file, so
+# a restart warms up what was popular before it.
+
+# Parameter sets replayed by a warm-up. 0 turns the warm-up off.
+WARMUP_TOP_N = int(os.getenv('WARMUP_TOP_N', '20'))
+
+# Where the request counts are kept between restarts
+WARMUP_LOG_FILE = os.getenv(
+    'WARMUP_LOG_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'warmup_log.json')
+)
+
+# Seconds between saves of the request counts
+WARMUP_SAVE_SECONDS = int(os.getenv('WARMUP_SAVE_SECONDS', '300'))
+
+# Parameter sets counted. Past twice this many the least requested are dropped.
+WARMUP_LOG_MAX_ENTRIES = 1000
+
+
+# How often each (query, normalized parameters) has been requested
+class RequestLog:
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._counts = Counter()  # cache key -> requests
+        self._params = {}  # cache key -> (query, parameters)
+
+    def record(self, query_name, data):
+        params = normalize_params(data)
+        key = make_key(query_name, params)
+        with self._lock:
+            self._counts[key] += 1
+            self._params[key] = (query_name, params)
+            if len(self._counts) > 2 * self.max_entries:
+                for dropped, _ in self._counts.most_common()[self.max_entries:]:
+                    del self._counts[dropped]
+                    del self._params[dropped]
+
+    # (query, parameters, requests) of the n most requested
+    def top(self, n):
+        with self._lock:
+            return [self._params[key] + (count,) for key, count in self._counts.most_common(n)]
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print("Reading the warm-up log failed: {}".format(e))
+            return
+
+        with self._lock:
+            for entry in entries:
+                key = make_key(entry["query"], entry["params"])
+                self._counts[key] += entry["count"]
+                self._params[key] = (entry["query"], entry["params"])
+
+    # Written next to the file and renamed, so a reader never sees half of it. With several worker
+    # processes (make start-asgi) the last one to save wins.
+    def save(self):
+        entries = [
+            {"query": query_name, "params": params, "count": count}
+            for query_name, params, count in self.top(self.max_entries)
+        ]
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(entries, f, default=str)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class Warmer:
+    def __init__(self, request_log, top_n, save_seconds):
+        self.request_log = request_log
+        self.top_n = top_n
+        self.save_seconds = save_seconds
+        self._lock = threading.Lock()
+        self._pending = threading.Event()
+        self._replay = None
+        self._thread = None
+        self._pid = None
+        self._last_run = None
+
+    # replay(query_name, params) computes one query through the caches of the app. The first
+    # warm-up runs right away. Starts once per process: a worker forked from a process that had
+    # already started does not inherit the thread, so it starts its own.
+    def start(self, replay):
+        if self.top_n <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._replay = replay
+            self._pid = os.getpid()
+            self.request_log.load()
+            self._thread = threading.Thread(target=self._run, name='cache-warmup', daemon=True)
+            self._thread.start()
+        self.schedule()
+
+    # Warm up again, after the caches have been dropped
+    def schedule(self):
+        self._pending.set()
+
+    def _run(self):
+        while True:
+            if self._pending.wait(self.save_seconds):
+                self._pending.clear()
+                self.warm_up()
+            try:
+                self.request_log.save()
+            except OSError as e:
+                print("Saving the warm-up log failed: {}".format(e))
+
+    def warm_up(self):
+        entries = self.request_log.top(self.top_n)
+        start = time.perf_counter()
+        warmed = failed = 0
+        for query_name, params, _ in entries:
+            # The data changed again, start over with empty caches
+            if self._pending.is_set():
+                break
+            try:
+                self._replay(query_name, params)
+                warmed += 1
+            except Exception as e:
+                failed += 1
+                print("Warm-up of {} {} failed: {}".format(query_name, params, e))
+
+        seconds = round(time.perf_counter() - start, 3)
+        with self._lock:
+            self._last_run = {
+                "queries": len(entries),
+                "warmed": warmed,
+                "failed": failed,
+                "seconds": seconds,
+                "finished_at": datetime.now(timezone.utc).isoformat(),
+            }
+        print("Warmed up {} of {} queries in {}s".format(warmed, len(entries), seconds))
+
+    def stats(self):
+        with self._lock:
+            return {"top_n": self.top_n, "running": self._thread is not None, "last_run": self._last_run}
+
+
+request_log = RequestLog(WARMUP_LOG_FILE, WARMUP_LOG_MAX_ENTRIES)
+warmer = Warmer(request_log, WARMUP_TOP_N, WARMUP_SAVE_SECONDS)